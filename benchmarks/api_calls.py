@@ -0,0 +1,228 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+# Benchmark: API calls, SQL queries, SSH calls and wall time of the scripts
+# against a simulated cloud
+#
+# Every script runs in a fresh interpreter against the same synthetic cloud
+# (see cloudstackops/simulator.py), with the API metrics written to a file.
+# counting_run.py counts its SQL queries per CloudStackSQL method and its SSH
+# calls. We compare all counts and the wall time with the baseline in
+# api_calls.json. We fail when a script makes more calls or queries than the
+# baseline allows (N+1 patterns show up here first), gets a lot slower, or
+# stops with an error.
+#
+# Each script gets a fresh home directory, so nothing one script caches
+# there (such as the name index) changes the counts of the next one.
+#
+# There are no hypervisors to SSH into, so the SSH baselines are empty and any
+# SSH call a script starts making fails the run. Database queries are
+# answered by the mysql.connector stand-in in mysqlstub/, with fixed rows.
+#
+# With --smoke we only check that every script runs to the end against the
+# simulator, without calls the simulator does not support.
+#
+# Usage: python benchmarks/api_calls.py [--factor F] [--time-factor F] [--update] [--smoke] [script ...]
+
+import getopt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_calls.json')
+COUNTING_RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'counting_run.py')
+MYSQL_STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mysqlstub')
+
+# What we count -> how we name one of them
+COUNTS = (('calls', 'calls'), ('sql', 'queries'), ('ssh', 'invocations'))
+
+# The synthetic cloud every script runs against
+SIMULATOR = 'zones=1,clusters=2,hosts=5,vms=20,volumes=2,jobduration=0.1,pagesize=100'
+
+# name -> script and arguments
+SCRIPTS = {
+    'checkRedundantRouters': ['checkRedundantRouters.py', '-c', 'simulator'],
+    'listHAWorkers': ['listHAWorkers.py', '-s', 'mysql-alias'],
+    'listVirtualMachines': ['listVirtualMachines.py', '-c', 'simulator', '--zone', 'zone1'],
+    'listVirtualMachines-cluster': ['listVirtualMachines.py', '-c', 'simulator', '--oncluster', 'zone1-cluster1'],
+    'listVolumes': ['listVolumes.py', '-c', 'simulator', '-p', 'zone1-cluster1-pool1'],
+    'listVolumes-stream': ['listVolumes.py', '-c', 'simulator', '-p', 'zone1-cluster1-pool1', '--stream'],
+    'rebalanceOSTypesOnCluster': ['rebalanceOSTypesOnCluster.py', '-c', 'simulator', '-n', 'zone1-cluster1'],
+}
+
+CLOUDMONKEY_CONFIG = """[core]
+profile = simulator
+
+[simulator]
+url = http://simulator.local/client/api
+apikey = simulator
+secretkey = simulator
+username =
+password =
+"""
+
+
+# A fresh home directory for one script, with a cloudmonkey profile for the
+# simulator and our own settings in ./config
+def make_home():
+    home = tempfile.mkdtemp(prefix='cloudstackops-bench-')
+    os.mkdir(os.path.join(home, '.cloudmonkey'))
+    with open(os.path.join(home, '.cloudmonkey', 'config'), 'w') as f:
+        f.write(CLOUDMONKEY_CONFIG)
+    shutil.copy(os.path.join(ROOT, 'config.sample'), os.path.join(home, 'config'))
+    return home
+
+
+# Run one script from home, returns the wall time, the counts and the output
+def run(args, home):
+    metricsfile = os.path.join(home, 'metrics.json')
+    countsfile = os.path.join(home, 'counts.json')
+    env = dict(os.environ)
+    env.update({
+        'HOME': home,
+        'PYTHONPATH': os.pathsep.join([ROOT, MYSQL_STUB, env.get('PYTHONPATH', '')]),
+        'CLOUDSTACKOPS_SIMULATOR': SIMULATOR,
+        'CLOUDSTACKOPS_METRICS': metricsfile,
+    })
+    env.pop('CLOUDSTACKOPS_RECORD', None)
+    env.pop('CLOUDSTACKOPS_REPLAY', None)
+    for path in (metricsfile, countsfile):
+        if os.path.exists(path):
+            os.remove(path)
+
+    start = time.time()
+    process = subprocess.Popen([sys.executable, COUNTING_RUN, countsfile, os.path.join(ROOT, args[0])] + args[1:],
+                               env=env, cwd=home, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    elapsed = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError("exit status %s\n%s" % (process.returncode, output))
+    if 'Unsupported API call' in output:
+        raise RuntimeError("the simulator does not support a call\n%s" % output)
+    # Many scripts print an error and stop with exit status 0
+    if any(line.startswith('Error:') for line in output.splitlines()):
+        raise RuntimeError("stopped with an error\n%s" % output)
+
+    counts = {'calls': {}, 'sql': {}, 'ssh': {}}
+    if os.path.exists(metricsfile):
+        with open(metricsfile) as f:
+            for row in json.load(f):
+                counts['calls'][row['command']] = row['calls']
+    if os.path.exists(countsfile):
+        with open(countsfile) as f:
+            counts.update(json.load(f))
+    return elapsed, counts, output
+
+
+# What went wrong compared to the baseline, if anything
+def compare(result, baseline, factor, timefactor):
+    problems = []
+    for kind, unit in COUNTS:
+        prefix = '' if kind == 'calls' else kind + ' '
+        for name, count in sorted(result.get(kind, {}).items()):
+            allowed = int(baseline.get(kind, {}).get(name, 0) * factor)
+            if count > allowed:
+                problems.append("%s%s: %s %s, baseline allows %s" % (prefix, name, count, unit, allowed))
+    if result['seconds'] > max(baseline['seconds'] * timefactor, 1.0):
+        problems.append("took %.2fs, baseline %.2fs" % (result['seconds'], baseline['seconds']))
+    return problems
+
+
+def main(argv):
+    factor = 1.0
+    timefactor = 2.0
+    update = False
+    smoke = False
+    try:
+        opts, names = getopt.getopt(argv, "", ["factor=", "time-factor=", "update", "smoke"])
+    except getopt.GetoptError as e:
+        print "Error: " + str(e)
+        return 2
+    for opt, arg in opts:
+        if opt == "--factor":
+            factor = float(arg)
+        elif opt == "--time-factor":
+            timefactor = float(arg)
+        elif opt == "--update":
+            update = True
+        elif opt == "--smoke":
+            smoke = True
+
+    for name in names:
+        if name not in SCRIPTS:
+            print "Error: Unknown script '%s', use one of %s" % (name, ', '.join(sorted(SCRIPTS)))
+            return 2
+    if not names:
+        names = sorted(SCRIPTS.keys())
+
+    baselines = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baselines = json.load(f)
+
+    failed = 0
+    saved = 0
+    for name in names:
+        home = make_home()
+        try:
+            seconds, counts, output = run(SCRIPTS[name], home)
+        except RuntimeError as e:
+            print "%-30s ERROR (%s)" % (name, e)
+            failed += 1
+            continue
+        finally:
+            shutil.rmtree(home)
+
+        if smoke:
+            print "%-30s ok" % name
+            continue
+
+        result = {'seconds': round(seconds, 2), 'calls': counts['calls'], 'sql': counts['sql'],
+                  'ssh': counts['ssh'], 'total': sum(counts['calls'].values())}
+        if update or name not in baselines:
+            baselines[name] = result
+            saved += 1
+            print "%-30s %5s calls %4s queries %4s ssh %6.2fs baseline saved" % (
+                name, result['total'], sum(result['sql'].values()), sum(result['ssh'].values()), seconds)
+            continue
+
+        problems = compare(result, baselines[name], factor, timefactor)
+        status = "ok"
+        if problems:
+            status = "REGRESSED\n    " + "\n    ".join(problems)
+            failed += 1
+        print "%-30s %5s calls %4s queries %4s ssh %6.2fs %s" % (
+            name, result['total'], sum(result['sql'].values()), sum(result['ssh'].values()), seconds, status)
+
+    if saved:
+        with open(BASELINE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True, separators=(',', ': '))
+            f.write("\n")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,125 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+# Run a script the way python would, counting its SQL queries and SSH calls
+#
+# SQL queries come from the timings sqlpool keeps per CloudStackSQL method.
+# SSH calls are counted by wrapping CloudStackOpsSSH.runSSHCommand and the
+# fabric operations the hypervisor classes use, once the script imports them.
+# At exit we write {"sql": {method: queries}, "ssh": {call: invocations}}.
+#
+# Usage: python benchmarks/counting_run.py <counts.json> <script> [args ...]
+
+import atexit
+import json
+import os
+import runpy
+import sys
+import threading
+
+# Fabric operations that open an SSH session
+FABRIC_OPERATIONS = ('run', 'sudo', 'put', 'get', 'open_shell')
+
+_lock = threading.Lock()
+_ssh = {}
+
+
+def _counted(name, function):
+    def call(*args, **kwargs):
+        with _lock:
+            _ssh[name] = _ssh.get(name, 0) + 1
+        return function(*args, **kwargs)
+    return call
+
+
+def _patch_ssh(module):
+    cls = module.CloudStackOpsSSH
+    cls.runSSHCommand = _counted('runSSHCommand', cls.__dict__['runSSHCommand'])
+
+
+def _patch_fabric(module):
+    for name in FABRIC_OPERATIONS:
+        if hasattr(module, name):
+            setattr(module, name, _counted('fabric.' + name, getattr(module, name)))
+
+
+class PatchOnImport(object):
+    """Import hook that patches a module right after it is first imported.
+
+    Patching fabric.operations before fabric.api imports from it means
+    'fab.run' and 'from fabric.api import *' both get the counting version,
+    without importing fabric in scripts that do not use it.
+    """
+
+    def __init__(self, patches):
+        self.patches = patches
+
+    def find_module(self, fullname, path=None):
+        if fullname in self.patches:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        sys.meta_path.remove(self)
+        try:
+            __import__(fullname)
+        finally:
+            sys.meta_path.insert(0, self)
+        module = sys.modules[fullname]
+        self.patches[fullname](module)
+        return module
+
+
+def _write(path):
+    sql = {}
+    sqlpool = sys.modules.get('cloudstackops.sqlpool')
+    if sqlpool is not None:
+        for row in sqlpool.stats.summary():
+            if row['command'].startswith('sql:'):
+                sql[row['command'][len('sql:'):]] = row['calls']
+    with _lock:
+        ssh = dict(_ssh)
+    with open(path, 'w') as f:
+        json.dump({'sql': sql, 'ssh': ssh}, f)
+
+
+def main(argv):
+    if len(argv) < 2:
+        print "Usage: python benchmarks/counting_run.py <counts.json> <script> [args ...]"
+        return 2
+    countsfile, script = argv[0], os.path.abspath(argv[1])
+
+    sys.meta_path.insert(0, PatchOnImport({
+        'cloudstackops.cloudstackopsssh': _patch_ssh,
+        'fabric.operations': _patch_fabric,
+    }))
+    # Registered first, so it runs after the handlers of the script
+    atexit.register(_write, countsfile)
+
+    sys.argv = [script] + argv[2:]
+    sys.path[0] = os.path.dirname(script)
+    runpy.run_path(script, run_name='__main__')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,105 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Benchmark: how long it takes to import our modules
+#
+# Every import is timed in a fresh interpreter. We fail when an import is
+# slower than its budget, or when it loads heavy dependencies that should
+# only be loaded when first used.
+#
+# Usage: python benchmarks/import_time.py [--runs N] [--factor F]
+
+import getopt
+import os
+import subprocess
+import sys
+
+# module -> (budget in seconds, modules that must not be loaded by importing it)
+BUDGETS = {
+    'cloudstackops.cloudstackopsbase': (0.05, ('clint', 'slackweb')),
+    'cloudstackops.cloudstacksql': (0.25, ('clint', 'slackweb', 'marvin', 'requests', 'cs')),
+    'cloudstackops.cloudstackops': (0.15, ('marvin.cloudstackConnection', 'marvin.jsonHelper',
+                                           'marvin.cloudstackAPI.listVirtualMachines',
+                                           'requests', 'cs', 'clint', 'prettytable')),
+}
+
+PROBE = """
+import sys, time
+start = time.time()
+import %(module)s
+elapsed = time.time() - start
+loaded = [m for m in %(forbidden)r if m in sys.modules and sys.modules[m] is not None]
+print elapsed, ','.join(loaded)
+"""
+
+
+def measure(module, forbidden, runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    timings = []
+    loaded = ''
+    for run in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', PROBE % {'module': module, 'forbidden': forbidden}], env=env, cwd=root)
+        fields = output.strip().split(' ')
+        timings.append(float(fields[0]))
+        if len(fields) > 1:
+            loaded = fields[1]
+    timings.sort()
+    return timings[len(timings) // 2], loaded
+
+
+def main(argv):
+    runs = 5
+    factor = 1.0
+    try:
+        opts, args = getopt.getopt(argv, "", ["runs=", "factor="])
+    except getopt.GetoptError as e:
+        print "Error: " + str(e)
+        return 2
+    for opt, arg in opts:
+        if opt == "--runs":
+            runs = int(arg)
+        elif opt == "--factor":
+            factor = float(arg)
+
+    failed = 0
+    for module in sorted(BUDGETS.keys()):
+        budget, forbidden = BUDGETS[module]
+        try:
+            median, loaded = measure(module, forbidden, runs)
+        except subprocess.CalledProcessError as e:
+            print "%-40s ERROR (could not import: %s)" % (module, e)
+            failed += 1
+            continue
+        status = "ok"
+        if median > budget * factor:
+            status = "SLOW (budget %.3fs)" % (budget * factor)
+            failed += 1
+        if loaded:
+            status += " LOADED %s" % loaded
+            failed += 1
+        print "%-40s %.3fs %s" % (module, median, status)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
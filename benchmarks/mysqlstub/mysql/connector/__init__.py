@@ -0,0 +1,88 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+
+# Stand-in for mysql.connector, used by the benchmark instead of a database
+#
+# It answers the queries of the scripts in the benchmark with a few fixed
+# rows, picked by the table the query reads from. Queries on other tables
+# return no rows. Put benchmarks/mysqlstub first on PYTHONPATH to use it.
+
+import errorcode
+import errors
+from errors import Error
+
+# Rows per table: HA workers as getHAWorkerData selects them
+ROWS = {
+    'op_ha_work': [
+        ('ROOT', 'vm%s' % i, 'HA', 'Starting', '2024-01-02 03:04:05', '2024-01-02 03:05:05',
+         'Investigating', 'zone1-cluster1-host%s.example.com' % (i % 5 + 1), 'mgt1.example.com', 'Running')
+        for i in range(1, 11)
+    ],
+}
+
+
+class Cursor(object):
+
+    def __init__(self, prepared=False, buffered=None):
+        self.rows = []
+
+    def execute(self, operation, params=None):
+        self.rows = []
+        for table, rows in ROWS.items():
+            if table in operation:
+                self.rows = list(rows)
+                break
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=1):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def close(self):
+        pass
+
+
+class Connection(object):
+
+    def __init__(self, **kwargs):
+        self.config = kwargs
+
+    def cursor(self, prepared=False, buffered=None):
+        return Cursor(prepared, buffered)
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect(**kwargs):
+    return Connection(**kwargs)
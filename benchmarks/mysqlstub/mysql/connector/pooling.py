@@ -0,0 +1,63 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+
+# Connection pool with the same limits as mysql.connector.pooling
+
+import threading
+
+from . import connect, errors
+
+CNX_POOL_MAXNAMESIZE = 64
+CNX_POOL_MAXSIZE = 32
+
+
+class PooledConnection(object):
+    """Connection that goes back to its pool on close."""
+
+    def __init__(self, pool, cnx):
+        self.pool = pool
+        self.cnx = cnx
+
+    def __getattr__(self, name):
+        return getattr(self.cnx, name)
+
+    def close(self):
+        self.pool.put(self.cnx)
+
+
+class MySQLConnectionPool(object):
+
+    def __init__(self, pool_name=None, pool_size=5, **kwargs):
+        if pool_size > CNX_POOL_MAXSIZE:
+            raise AttributeError("Pool size should be higher than 0 and lower or equal to %s" % CNX_POOL_MAXSIZE)
+        self.pool_name = pool_name
+        self.lock = threading.Lock()
+        self.free = [connect(**kwargs) for i in range(pool_size)]
+
+    def get_connection(self):
+        with self.lock:
+            if not self.free:
+                raise errors.PoolError("Failed getting connection; pool exhausted")
+            return PooledConnection(self, self.free.pop())
+
+    def put(self, cnx):
+        with self.lock:
+            self.free.append(cnx)
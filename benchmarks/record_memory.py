@@ -0,0 +1,123 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Benchmark: memory used by 100k volumes as Marvin objects and as records
+#
+# Both variants are built from the same synthetic listVolumes response. We
+# count the bytes of everything reachable from the resulting list (objects,
+# their dicts or slots, and the values), each object once.
+#
+# Usage: python benchmarks/record_memory.py [--volumes N]
+
+import getopt
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cloudstackops import records
+from marvin import jsonHelper
+
+
+# One synthetic listVolumes response, parsed like the API client does
+def response(count):
+    items = []
+    for i in range(count):
+        items.append({
+            "id": "5c2f5e6a-%08d-4b8e-9f0a-6c1d2e3f4a5b" % i,
+            "name": "ROOT-%d" % i,
+            "zoneid": "8f3c6a1e-1d2b-4c5d-9e8f-7a6b5c4d3e2f",
+            "zonename": "zone-%d" % (i % 3),
+            "type": "ROOT" if i % 3 else "DATADISK",
+            "deviceid": i % 4,
+            "virtualmachineid": "9a8b7c6d-%08d-4e3f-2a1b-0c9d8e7f6a5b" % (i // 2),
+            "vmname": "vm-%d" % (i // 2),
+            "vmdisplayname": "vm-%d" % (i // 2),
+            "vmstate": "Running",
+            "size": 21474836480,
+            "created": "2016-05-12T10:%02d:00+0200" % (i % 60),
+            "state": "Ready",
+            "account": "account-%d" % (i % 200),
+            "domainid": "1b2c3d4e-%08d-4f5a-6b7c-8d9e0f1a2b3c" % (i % 50),
+            "domain": "domain-%d" % (i % 50),
+            "storagetype": "shared",
+            "hypervisor": "KVM",
+            "destroyed": False,
+            "serviceofferingid": "2d3e4f5a-6b7c-8d9e-0f1a-2b3c4d5e6f7a",
+            "serviceofferingname": "Small",
+            "serviceofferingdisplaytext": "Small instance",
+            "isextractable": False,
+            "storageid": "3e4f5a6b-%08d-9e0f-1a2b-3c4d5e6f7a8b" % (i % 20),
+            "storage": "pool-%d" % (i % 20),
+            "path": "7f8a9b0c-%08d-4d5e-6f7a-8b9c0d1e2f3a" % i,
+            "quiescevm": False,
+            "tags": [],
+            "displayvolume": True,
+        })
+    return json.loads(json.dumps({"listvolumesresponse": {"count": count, "volume": items}}))
+
+
+# Bytes of everything reachable from obj, shared objects counted once
+def deep_size(obj):
+    seen = set()
+    todo = [obj]
+    size = 0
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            todo.extend(obj.keys())
+            todo.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            todo.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            todo.append(obj.__dict__)
+        elif hasattr(obj, '__slots__'):
+            todo.extend(getattr(obj, field) for field in obj.__slots__)
+    return size
+
+
+def main(argv):
+    count = 100000
+    try:
+        opts, args = getopt.getopt(argv, "", ["volumes="])
+    except getopt.GetoptError as e:
+        print "Error: " + str(e)
+        return 2
+    for opt, arg in opts:
+        if opt == "--volumes":
+            count = int(arg)
+
+    marvin = deep_size([jsonHelper.jsonLoader(item) for item in response(count)["listvolumesresponse"]["volume"]])
+    compact = deep_size([records.VolumeRecord.from_dict(item) for item in response(count)["listvolumesresponse"]["volume"]])
+
+    print "%s volumes as Marvin objects: %7.1f MB" % (count, marvin / 1024.0 / 1024.0)
+    print "%s volumes as records:        %7.1f MB" % (count, compact / 1024.0 / 1024.0)
+    print "Records use %.1fx less memory" % (float(marvin) / compact)
+
+    # Records should never cost more than the objects they replace
+    return 0 if compact < marvin else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
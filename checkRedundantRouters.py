@@ -26,6 +26,7 @@ import time
 import sys
 import getopt
 from cloudstackops import cloudstackops
+from cloudstackops import inventory
 import os.path
 from random import choice
 from prettytable import PrettyTable
@@ -101,15 +102,24 @@ if DEBUG == 1:
     print "ApiKey: " + c.apikey
     print "SecretKey: " + c.secretkey
 
-# Get the redundant routers
-redRouters = c.getRedundantRouters('{}')
+# Load all routers at once, instead of looking up the peer of every router
+inv = inventory.Inventory(c, DEBUG)
+if not inv.load('routers', state='Running'):
+    sys.exit(1)
+
+# Group the redundant routers by their guest network
+redRouters = {}
+for router in inv.all('routers'):
+    if router.isredundantrouter != True:
+        continue
+    redRouters.setdefault(router.guestnetworkid, []).append(router)
 
 # Look for routers on the same POD
-if redRouters is not None and redRouters is not 1:
-    for routerData in redRouters.itervalues():
-        if routerData is None or routerData == 1:
-            continue
-        if routerData['router'].podid == routerData['routerPeer'].podid:
-            print "Warning: Router pair " + routerData['router'].name + " and " + routerData['routerPeer'].name + " run on same POD!" + " (" + routerData['router'].podid + " / " + routerData['routerPeer'].podid + ")"
-        if DEBUG == 1:
-            print "DEBUG: " + routerData['router'].name + " has peer " + routerData['routerPeer'].name
+for routers in redRouters.itervalues():
+    if len(routers) != 2:
+        continue
+    router, routerPeer = routers
+    if router.podid == routerPeer.podid:
+        print "Warning: Router pair " + router.name + " and " + routerPeer.name + " run on same POD!" + " (" + router.podid + " / " + routerPeer.podid + ")"
+    if DEBUG == 1:
+        print "DEBUG: " + router.name + " has peer " + routerPeer.name
@@ -0,0 +1,122 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to cache reference data we look up again and again during a run
+#
+# Things like service offerings, storage pools and os types hardly change
+# while a script runs, so we keep the API results for a while. Each kind of
+# data has its own time to live, the least recently used entries are evicted
+# when the cache is full and mutating calls drop the kinds they affect.
+
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds to keep each kind of data, kinds not listed use DEFAULT_TTL
+TTLS = {
+    'configurations': 3600,
+    'oscategories': 3600,
+    'ostypes': 3600,
+    'serviceofferings': 900,
+    'storagepools': 60,
+}
+DEFAULT_TTL = 60
+
+# API commands that change a kind of data
+INVALIDATED_BY = {
+    'configurations': ('updateConfiguration',),
+    'oscategories': (),
+    'ostypes': ('addGuestOs', 'updateGuestOs', 'removeGuestOs'),
+    'serviceofferings': ('createServiceOffering', 'updateServiceOffering', 'deleteServiceOffering'),
+    'storagepools': ('createStoragePool', 'updateStoragePool', 'deleteStoragePool',
+                     'enableStorageMaintenance', 'cancelStorageMaintenance',
+                     'createVolume', 'deleteVolume', 'migrateVolume', 'migrateVirtualMachineWithVolume'),
+}
+
+
+class Cache(object):
+    """Thread-safe LRU cache with a time to live per kind of data."""
+
+    def __init__(self, maxsize=1000, ttls=None, debug=0):
+        self.maxsize = int(maxsize)
+        self.ttls = dict(TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.DEBUG = debug
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Is caching switched on?
+    def enabled(self):
+        return self.maxsize > 0
+
+    # Key for an API call and its arguments
+    def key(self, kind, command, args):
+        return (kind, command, tuple(sorted(args.items())))
+
+    # Returns (found, value)
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return False, None
+            # Move to the end, it is the most recently used now
+            self.entries[key] = entry
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, key, value):
+        if not self.enabled():
+            return
+        expires = time.time() + self.ttls.get(key[0], DEFAULT_TTL)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop one kind of data, or everything
+    def invalidate(self, kind=None):
+        with self.lock:
+            if kind is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if key[0] == kind]:
+                del self.entries[key]
+        if self.DEBUG == 1:
+            print "DEBUG: Cache: dropped all '%s' entries" % kind
+
+    # Drop the kinds of data an API command changes
+    def invalidate_command(self, command):
+        for kind, commands in INVALIDATED_BY.iteritems():
+            if command in commands:
+                self.invalidate(kind)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.entries)}
@@ -0,0 +1,254 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+# Classes to record API traffic to a cassette file and replay it offline
+#
+# Both API clients send their requests over one PooledSession, so that is
+# where we hook in. A recorder keeps every request and response and writes
+# them to a gzipped JSON cassette at exit. On replay, a requests adapter
+# serves the responses from the cassette instead of the network.
+#
+# Requests are matched on method, command and parameters, leaving out the
+# signature and other per-request values. When the same request was made
+# more than once (e.g. polling an async job), the responses are handed out
+# in the order they were recorded and the last one repeats after that.
+#
+# Set CLOUDSTACKOPS_RECORD=<file> or CLOUDSTACKOPS_REPLAY=<file> to use it.
+
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+import urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+VERSION = 1
+
+RECORD_ENV = 'CLOUDSTACKOPS_RECORD'
+REPLAY_ENV = 'CLOUDSTACKOPS_REPLAY'
+
+# Parameters that differ per request or per API key
+VOLATILE_PARAMS = ('apikey', 'signature', 'signatureversion', 'expires', 'sessionkey')
+
+
+# Not a requests.ConnectionError: a request we did not record says nothing
+# about the management server, so it should not slow down the rate limiter
+class CassetteMiss(Exception):
+    """Raised on replay when a request was not recorded."""
+
+    def __init__(self, message, request=None):
+        super(CassetteMiss, self).__init__(message)
+        self.request = request
+
+
+# Key to match a prepared request on
+def request_key(request):
+    parts = urlparse.urlsplit(request.url)
+    query = parts.query
+    if isinstance(request.body, basestring):
+        query += '&' + request.body
+    params = sorted((key, value) for key, value in urlparse.parse_qsl(query, keep_blank_values=True)
+                    if key.lower() not in VOLATILE_PARAMS)
+    return json.dumps([request.method, parts.path, params])
+
+
+class Recorder(object):
+    """Keeps the requests and responses that went over a session."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.interactions = []
+
+    # A streamed response is recorded once the caller read all of it, reading
+    # it here would load the whole body before the caller sees the first item
+    def record(self, request, response, stream=False):
+        if stream and not response._content_consumed:
+            response.raw = _TeeRaw(response.raw, lambda body: self._add(request, response, body))
+        else:
+            self._add(request, response, response.content)
+
+    def _add(self, request, response, body):
+        interaction = {
+            'key': request_key(request),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict((key, value) for key, value in response.headers.items()
+                            if key.lower() == 'content-type'),
+            'body': body.decode('utf-8', 'replace'),
+        }
+        with self.lock:
+            self.interactions.append(interaction)
+
+    def save(self):
+        with self.lock:
+            data = {'version': VERSION, 'interactions': self.interactions}
+        tmpfile = self.path + '.tmp'
+        with gzip.open(tmpfile, 'wb') as f:
+            json.dump(data, f)
+        os.rename(tmpfile, self.path)
+        print "Note: Recorded %s API calls to cassette '%s'" % (len(data['interactions']), self.path)
+
+
+class _TeeRaw(object):
+    """Wraps the raw body of a streamed response, keeping a copy of what was read."""
+
+    def __init__(self, raw, done):
+        self.raw = raw
+        self.done = done
+        self.chunks = []
+        self.decode_content = None
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        if not hasattr(self.raw, 'stream'):
+            # A plain file object, e.g. the simulator's
+            chunk = self.read(amt)
+            while chunk:
+                yield chunk
+                chunk = self.read(amt)
+            return
+        self.decode_content = decode_content
+        for chunk in self.raw.stream(amt, decode_content=decode_content):
+            self.chunks.append(chunk)
+            yield chunk
+        self._finish()
+
+    def read(self, amt=None, *args, **kwargs):
+        chunk = self.raw.read(amt, *args, **kwargs)
+        if chunk:
+            self.chunks.append(chunk)
+        else:
+            self._finish()
+        return chunk
+
+    # A caller may stop reading as soon as it has what it needs (the JSON
+    # decoder stops at the closing brace), we read the rest so the cassette
+    # holds the whole body
+    def close(self):
+        if self.done is not None:
+            try:
+                if hasattr(self.raw, 'stream'):
+                    for chunk in self.raw.stream(2 ** 16, decode_content=self.decode_content):
+                        self.chunks.append(chunk)
+                else:
+                    self.chunks.append(self.raw.read())
+            except Exception:
+                # What we could not read stays out of the cassette
+                self.done = None
+            self._finish()
+        self.raw.close()
+
+    def _finish(self):
+        if self.done is not None:
+            done, self.done = self.done, None
+            done(b''.join(self.chunks))
+
+    def __getattr__(self, attr):
+        return getattr(self.raw, attr)
+
+
+class Cassette(object):
+    """Recorded responses, handed out in recorded order per request."""
+
+    def __init__(self, interactions):
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.served = 0
+        for interaction in interactions:
+            self.responses.setdefault(interaction['key'], []).append(interaction)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rb') as f:
+            data = json.load(f)
+        if data.get('version') != VERSION:
+            raise ValueError("cassette '%s' has version %s, we need %s" % (path, data.get('version'), VERSION))
+        return cls(data['interactions'])
+
+    # Next recorded response for this request, None when we have none
+    def next(self, request):
+        key = request_key(request)
+        with self.lock:
+            responses = self.responses.get(key)
+            if not responses:
+                return None
+            self.served += 1
+            if len(responses) > 1:
+                return responses.pop(0)
+            return responses[0]
+
+
+class ReplayAdapter(BaseAdapter):
+    """requests adapter that answers from a cassette instead of the network."""
+
+    def __init__(self, cassette):
+        super(ReplayAdapter, self).__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        interaction = self.cassette.next(request)
+        if interaction is None:
+            raise CassetteMiss("Request not found in cassette: %s" % request_key(request), request=request)
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction['reason']
+        body = interaction['body'].encode('utf-8')
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.headers['Content-Length'] = str(len(body))
+        response.encoding = 'utf-8'
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+# Record or replay on this session, as asked for in the environment
+# Returns a short description of what we do, or None
+# A cassette we cannot load is fatal: we should not fall back to a live cloud
+def install_from_env(session, environ=None):
+    if environ is None:
+        environ = os.environ
+
+    if environ.get(REPLAY_ENV):
+        path = environ[REPLAY_ENV]
+        try:
+            cassette = Cassette.load(path)
+        except (IOError, ValueError) as e:
+            print "Error: Cannot load cassette '%s': %s" % (path, e)
+            sys.exit(1)
+        adapter = ReplayAdapter(cassette)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return "replaying from cassette '%s'" % path
+
+    if environ.get(RECORD_ENV):
+        session.recorder = Recorder(environ[RECORD_ENV])
+        return "recording to cassette '%s'" % environ[RECORD_ENV]
+
+    return None
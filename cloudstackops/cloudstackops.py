@@ -24,46 +24,67 @@ import logging
 import operator
 import re
 # Import our dependencies
+import atexit
 import smtplib
 import string
 import urllib2
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 # Import the class we depend on
+import copy
 from os.path import expanduser
 from random import choice
 from urlparse import urlparse
 
+import threading
 import time
-from prettytable import PrettyTable
 
 from cloudstackopsbase import *
+from lazyimport import LazyModule, lazy_module
 
-# Marvin
+# Marvin, the API command modules are imported when first used
 try:
-    import requests
-    from marvin.cloudstackConnection import cloudConnection
     from marvin.cloudstackException import cloudstackAPIException
-    from marvin.cloudstackAPI import *
     from marvin import cloudstackAPI
 except:
     print "Error: Please install Marvin to talk to the CloudStack API:"
     print "       pip install ./marvin/Marvin-0.1.0.tar.gz (file is in this repository)"
     sys.exit(1)
-# Colored terminals
-try:
-    from clint.textui import colored
-except:
-    print "Error: Please install clint library to support color in the terminal:"
-    print "       pip install clint"
-    sys.exit(1)
+for _command in cloudstackAPI.__all__:
+    globals()[_command] = LazyModule('marvin.cloudstackAPI.' + _command)
+del _command
+jsonHelper = lazy_module('marvin.jsonHelper', install_hint=(
+    "Marvin to talk to the CloudStack API",
+    "pip install ./marvin/Marvin-0.1.0.tar.gz (file is in this repository)"))
+
 # Exoscale CS library
-try:
-    from cs import CloudStack, CloudStackException
-except:
-    print "Error: Please install cs library to talk to Cosmic API:"
-    print "       pip install cs"
-    sys.exit(1)
+cs = lazy_module('cs', install_hint=("cs library to talk to Cosmic API", "pip install cs"))
+
+# Pretty tables
+prettytable = lazy_module('prettytable', install_hint=("prettytable library", "pip install prettytable"))
+
+import cache
+import concurrentapi
+import jobwatcher
+import jsonstream
+import metrics
+import nameindex
+import pagination
+import ratelimit
+import records
+
+# Only used to count pending async jobs for the rate limiter
+cloudstacksql = lazy_module('cloudstacksql', __name__)
+
+# Our HTTP pool depends on requests and the Marvin connection
+httppool = lazy_module('httppool', __name__)
+cassette = lazy_module('cassette', __name__)
+simulator = lazy_module('simulator', __name__)
+
+# The vm fields we need to move vm's off a hypervisor
+MIGRATION_VM_FIELDS = ('id', 'name', 'instancename', 'memory', 'hostid', 'hostname', 'zonename', 'isoid',
+                       'maintenancepolicy', 'state')
+
 
 class CloudStackOps(CloudStackOpsBase):
     # Init function
@@ -87,6 +108,20 @@ class CloudStackOps(CloudStackOpsBase):
         self.kvm = None
         self.vmware = None
         self.vmshutpolicy = {}
+        self.pagesize = None
+        self.pageworkers = 4
+        self.httppoolsize = 10
+        self.httpsession = None
+        self.jobwatcher = None
+        self.apiworkers = 8
+        self.concurrentclient = None
+        self.cache = cache.Cache(debug=debug)
+        self.metrics = metrics.Metrics()
+        self.ratelimiter = ratelimit.AdaptiveRateLimiter(debug=debug)
+        self.pendingjobssql = None
+        self.metricsfile = os.environ.get('CLOUDSTACKOPS_METRICS', '')
+        self.nameindexttl = 3600
+        self.nameindex = None
         self.check_screen_alike()
 
 
@@ -186,6 +221,62 @@ class CloudStackOps(CloudStackOpsBase):
             print "Hint: Setup the local config file 'config', using 'config.sample' as a starting point. See documentation."
             sys.exit(1)
 
+        # Optional: number of pages of a list call to fetch concurrently
+        try:
+            self.pageworkers = config.getint('cloudstackOps', 'page_workers')
+        except:
+            pass
+
+        # Optional: number of keep-alive connections to the API
+        try:
+            self.httppoolsize = config.getint('cloudstackOps', 'http_pool_size')
+        except:
+            pass
+
+        # Optional: number of API calls to run concurrently
+        try:
+            self.apiworkers = config.getint('cloudstackOps', 'api_workers')
+        except:
+            pass
+
+        # Optional: number of API results to cache, 0 switches the cache off
+        try:
+            self.cache.maxsize = config.getint('cloudstackOps', 'cache_size')
+        except:
+            pass
+
+        # Optional: adaptive rate limiter, off unless api_max_concurrency is set
+        try:
+            self.ratelimiter.maximum = config.getint('cloudstackOps', 'api_max_concurrency')
+        except:
+            self.ratelimiter.maximum = 0
+        try:
+            self.ratelimiter.target_latency = config.getfloat('cloudstackOps', 'api_target_latency')
+        except:
+            pass
+        try:
+            self.ratelimiter.max_pending_jobs = config.getint('cloudstackOps', 'api_max_pending_jobs')
+        except:
+            pass
+        if self.ratelimiter.maximum < 1:
+            self.ratelimiter = None
+        else:
+            self.ratelimiter.limit = min(self.ratelimiter.limit, self.ratelimiter.maximum)
+
+        # Optional: write API call metrics to this .json or .csv file at exit
+        # The CLOUDSTACKOPS_METRICS environment variable takes precedence
+        try:
+            if not self.metricsfile:
+                self.metricsfile = config.get('cloudstackOps', 'metrics_file')
+        except:
+            pass
+
+        # Optional: seconds to trust the name index on disk, 0 switches it off
+        try:
+            self.nameindexttl = config.getint('cloudstackOps', 'name_index_ttl')
+        except:
+            pass
+
     # Read and parse config file
     def parseConfig(self, configFile):
         if self.DEBUG == 1:
@@ -254,10 +345,29 @@ class CloudStackOps(CloudStackOpsBase):
         if self.DEBUG == 1:
             print "Debug: apiserver=" + self.apiserver + " apiKey=" + self.apikey + " securityKey=" + self.secretkey + " username=" + self.username + " password=" + self.password + " port=" + str(
                 self.apiport) + " scheme=" + self.apiprotocol
+
+        # Both API clients share one pool of keep-alive connections
+        self.httpsession = httppool.PooledSession(max(self.httppoolsize, self.pageworkers), metrics=self.metrics,
+                                                  limiter=self.ratelimiter)
+
+        # Record the API traffic to a cassette, or replay it from one
+        cassettemode = cassette.install_from_env(self.httpsession)
+        if cassettemode:
+            print "Note: API calls are " + cassettemode
+        if self.httpsession.recorder is not None:
+            atexit.register(self.httpsession.recorder.save)
+
+        # Or have a simulated cloud answer them (see simulator.py)
+        if os.environ.get('CLOUDSTACKOPS_SIMULATOR') is not None:
+            cloud = simulator.install_from_env(self.httpsession, debug=self.DEBUG)
+            print "Note: API calls are answered by a simulated cloud with %s hosts and %s vm's" % (
+                len(cloud.data['hosts']), len(cloud.data['virtualmachines']))
+
         try:
             if self.apikey:
-                self.cloudstack = cloudConnection(
+                self.cloudstack = httppool.PooledCloudConnection(
                     self.apiserver,
+                    session=self.httpsession,
                     apiKey=self.apikey,
                     securityKey=self.secretkey,
                     asyncTimeout=14400,
@@ -267,8 +377,9 @@ class CloudStackOps(CloudStackOpsBase):
                     scheme=self.apiprotocol)
             elif self.password:
                 print "Using username + password for connection!"
-                self.cloudstack = cloudConnection(
+                self.cloudstack = httppool.PooledCloudConnection(
                     self.apiserver,
+                    session=self.httpsession,
                     user=self.username,
                     passwd=self.password,
                     asyncTimeout=14400,
@@ -280,11 +391,12 @@ class CloudStackOps(CloudStackOpsBase):
             print "Error connecting to CloudStack. Are you using the right Marvin version? See README file. Halting."
             sys.exit(1)
         try:
-            self.exoCsApi = CloudStack(
+            self.exoCsApi = cs.CloudStack(
                 endpoint=self.apiurl,
                 key=self.apikey,
                 secret=self.secretkey,
-                timeout=60
+                timeout=60,
+                session=self.httpsession
             )
         except:
             print "Error connecting to Cosmic. Halting."
@@ -293,6 +405,27 @@ class CloudStackOps(CloudStackOpsBase):
         # Print name of cloud we're connected to
         print "Note: Connected to '" + self.getCloudName() + "'"
 
+        if self.DEBUG == 1:
+            atexit.register(self.printConnectionStats)
+            atexit.register(self.printCacheStats)
+
+        # kill -USR1 <pid> shows the API metrics so far
+        self.metrics.print_on_signal()
+        if self.metricsfile:
+            atexit.register(self.metrics.write, self.metricsfile)
+
+    # Show how well the keep-alive connections were reused
+    def printConnectionStats(self):
+        if self.httpsession is None:
+            return
+        stats = self.httpsession.stats.as_dict()
+        print "Note: API connections: %(requests)s requests, %(opened)s opened, %(reused)s reused" % stats
+
+    # Show how many API calls the cache saved us
+    def printCacheStats(self):
+        stats = self.cache.stats()
+        print "Note: API cache: %(hits)s hits, %(misses)s misses, %(evictions)s evicted, %(size)s entries" % stats
+
     # Call the CloudStack API
     def _callAPI(self, apicall):
 
@@ -300,6 +433,10 @@ class CloudStackOps(CloudStackOpsBase):
         if apicall is None:
             return 1
 
+        # List calls without an explicit page get all pages
+        if self._isPaginated(apicall):
+            return self._callAPIAllPages(apicall)
+
         try:
             data = self.cloudstack.marvin_request(apicall)
             if data is None and self.DEBUG == 1:
@@ -309,21 +446,203 @@ class CloudStackOps(CloudStackOpsBase):
                 print "DEBUG: received data:"
                 print data
 
-        except Exception as err:
-            # org.apache.cloudstack.api.ApiErrorCode Enum Reference
-            if "errorCode: 432" in str(err):
-                print "Error: Please try again with --non-admin-credentials argument, or use admin API credentials."
-                print "Error: Unsupported API call: %s" % str(apicall)[1:str(apicall).index(" object at ")]
-                sys.exit()
-            else:
-                print "Error: " + str(err)
+        except urllib2.HTTPError as e:
+            print "Error: Command failed: " + str(e.msg)
             return 1
+        except Exception as err:
+            return self._handleAPIError(apicall, err)
+
+        # Cached data this call changed is no longer valid
+        self.cache.invalidate_command(self._commandName(apicall))
+
+        return data
+
+    # Call the CloudStack API, or reuse an earlier result of the same call
+    # kind selects the time to live, see cache.TTLS
+    def _cachedCallAPI(self, apicall, kind):
+        if not self.cache.enabled():
+            return self._callAPI(apicall)
+
+        args = dict((k, v) for k, v in vars(apicall).iteritems() if v is not None and k != 'required')
+        key = self.cache.key(kind, self._commandName(apicall), args)
+        found, data = self.cache.get(key)
+        if found:
+            if self.DEBUG == 1:
+                print "DEBUG: Cache hit for %s %s" % (self._commandName(apicall), args)
+        else:
+            data = self._callAPI(apicall)
+            # Do not remember errors
+            if data == 1:
+                return data
+            self.cache.set(key, data)
+
+        # Callers may change the list, not our copy
+        if isinstance(data, list):
+            return list(data)
+        return data
+
+    # API command name of a Marvin command object
+    def _commandName(self, apicall):
+        name = apicall.__class__.__name__
+        if name.endswith('Cmd'):
+            name = name[:-3]
+        return name
+
+    # Print a failed API call and return our usual error value
+    def _handleAPIError(self, apicall, err):
+        # org.apache.cloudstack.api.ApiErrorCode Enum Reference
+        if "errorCode: 432" in str(err):
+            print "Error: Please try again with --non-admin-credentials argument, or use admin API credentials."
+            print "Error: Unsupported API call: %s" % str(apicall)[1:str(apicall).index(" object at ")]
+            sys.exit()
+        else:
+            print "Error: " + str(err)
+        return 1
+
+    # Is this a list call we should page through?
+    def _isPaginated(self, apicall):
+        return getattr(apicall, 'pagesize', False) is None and getattr(apicall, 'page', None) is None
+
+    # Call a list API command by name and return the results of all pages
+    def listAll(self, command, args=None, lazy=False, compact=False, stream=False):
+        apicall = getattr(globals()[command], command + 'Cmd')()
+        for key, value in self.remove_empty_values(args or {}).iteritems():
+            setattr(apicall, key, value)
+
+        return self._callAPIAllPages(apicall, lazy, compact, stream)
+
+    # Call the CloudStack API for all pages of a list call
+    # Returns a merged list, or a generator of items when lazy is set. The
+    # generator raises on API errors, as we cannot return 1 halfway through.
+    # With compact set, hosts, vm's, routers, volumes and storage pools come
+    # back as slotted records (see records.py) instead of Marvin objects.
+    # With stream set, we get a generator too, but each page is decoded item
+    # by item while it arrives and pages are fetched one after the other.
+    # With fields set, only those fields of each item are kept.
+    def _callAPIAllPages(self, apicall, lazy=False, compact=False, stream=False, fields=None):
+        if stream:
+            return self._streamAllPages(apicall, compact, fields)
+        if lazy:
+            return self._fetchAllPages(apicall, lazy=True, compact=compact, fields=fields)
+
+        try:
+            data = self._fetchAllPages(apicall, compact=compact, fields=fields)
+            if not data:
+                if self.DEBUG == 1:
+                    print "Warning: Received None object from CloudStack API"
+                return None
+
+            if self.DEBUG == 1:
+                print "DEBUG: received %s items in total" % len(data)
+
         except urllib2.HTTPError as e:
             print "Error: Command failed: " + str(e.msg)
             return 1
+        except Exception as err:
+            return self._handleAPIError(apicall, err)
 
         return data
 
+    # Fetch all pages of a list call, raising on errors
+    def _fetchAllPages(self, apicall, lazy=False, compact=False, fields=None):
+        paginator = pagination.Paginator(
+            lambda page, pagesize: self._callAPIPage(apicall, page, pagesize, compact, fields),
+            pagesize=self.getPageSize(),
+            workers=self.pageworkers,
+            debug=self.DEBUG)
+
+        if lazy:
+            return paginator.items()
+        return paginator.all()
+
+    # Fetch one page of a list call, returns the total count and the items
+    def _callAPIPage(self, apicall, page, pagesize, compact=False, fields=None):
+        pagecall = copy.copy(apicall)
+        pagecall.page = page
+        pagecall.pagesize = pagesize
+
+        cmdname, isAsync, payload = self.cloudstack.sanitize_command(pagecall)
+        response = self.cloudstack.request(cmdname, self.cloudstack.auth, payload=payload)
+        recordtype = records.FOR_COMMAND.get(cmdname) if compact else None
+        return self._parseListResponse(response.json(), recordtype, fields)
+
+    # Generator of all items of a list call, streaming page after page
+    def _streamAllPages(self, apicall, compact=False, fields=None):
+        pagesize = self.getPageSize()
+        page = 1
+        while True:
+            received = 0
+            for item in self._streamAPIPage(apicall, page, pagesize, compact, fields):
+                received += 1
+                yield item
+            if received < pagesize:
+                return
+            page += 1
+
+    # Generator of the items of one page, decoded while the response arrives
+    def _streamAPIPage(self, apicall, page, pagesize, compact=False, fields=None):
+        pagecall = copy.copy(apicall)
+        pagecall.page = page
+        pagecall.pagesize = pagesize
+
+        cmdname, isAsync, payload = self.cloudstack.sanitize_command(pagecall)
+        response = self.cloudstack.request(cmdname, self.cloudstack.auth, payload=payload, stream=True)
+        recordtype = records.FOR_COMMAND.get(cmdname) if compact else None
+        items = jsonstream.ListResponseStream(response.iter_content(65536))
+        try:
+            for item in items:
+                item = records.project(item, fields)
+                if recordtype is not None:
+                    yield recordtype.from_dict(item)
+                else:
+                    yield jsonHelper.jsonLoader(item)
+        finally:
+            response.close()
+        self._checkListResponse(items.responsename, items.meta)
+
+    # Turn a raw list response into the count and Marvin-style objects, or
+    # records of recordtype when given, keeping only fields when given
+    def _parseListResponse(self, data, recordtype=None, fields=None):
+        responsename = [key for key in data.keys() if key != 'cloudstack-version'][0]
+        response = data[responsename]
+        self._checkListResponse(responsename, response)
+
+        items = []
+        for key, value in response.iteritems():
+            if key != 'count' and isinstance(value, list):
+                value = [records.project(item, fields) for item in value]
+                if recordtype is not None:
+                    items = [recordtype.from_dict(item) for item in value]
+                else:
+                    items = [jsonHelper.jsonLoader(item) for item in value]
+
+        return response.get('count'), items
+
+    # Raise the API error a list response holds, if any
+    def _checkListResponse(self, responsename, response):
+        if 'errorcode' in response:
+            raise cloudstackAPIException(
+                (responsename or '').replace("response", ""),
+                "errorCode: %s, errorText:%s" % (response['errorcode'], response.get('errortext')))
+
+    # Get the maximum page size of this cloud (default.page.size)
+    def getPageSize(self):
+        if self.pagesize is not None:
+            return self.pagesize
+
+        # Ask for a single page, not everyone may list configurations
+        self.pagesize = 500
+        try:
+            apicall = listConfigurations.listConfigurationsCmd()
+            apicall.name = "default.page.size"
+            count, result = self._callAPIPage(apicall, 1, 1)
+            self.pagesize = int(result[0].value)
+        except:
+            if self.DEBUG == 1:
+                print "DEBUG: Could not get default.page.size, using %s" % self.pagesize
+
+        return self.pagesize
+
     # Remove empty arguments
     def remove_empty_values(self, d):
         if isinstance(d, dict):
@@ -390,6 +709,18 @@ class CloudStackOps(CloudStackOpsBase):
         if isProjectVm == 'true':
             apicall.projectid = "-1"
 
+        # Look the name up in the index when it is not scoped to a domain or project
+        if csApiCall in nameindex.INDEXED and domainId == '' and isProjectVm != 'true' and self.getNameIndex().enabled():
+            csnameIDs = self.lookupNameIndex(csApiCall, csname, apicall, listAll)
+            if csnameIDs is not None and len(csnameIDs) > 0:
+                if len(csnameIDs) > 1:
+                    print "Error: '%s' could not be located in CloudStack database using '%s' because it is not unique -- Exit." % (
+                        csname, csApiCall)
+                    sys.exit(1)
+                if self.DEBUG == 1:
+                    print "DEBUG: Found: '%s' with ID %s in the name index." % (csname, csnameIDs[0])
+                return csnameIDs[0]
+
         try:
             if csname.startswith('i-'):
                 apicall.keyword = str(csname)
@@ -408,8 +739,8 @@ class CloudStackOps(CloudStackOpsBase):
         try:
             if self.DEBUG == 1:
                 print "DEBUG: making marvin request:"
-            
-            data = self.cloudstack.marvin_request(apicall)
+
+            data = self._fetchAllPages(apicall)
             if (data is None or len(data) == 0) and self.DEBUG == 1:
                 print "Warning: Received None object from CloudStack API"
 
@@ -458,6 +789,31 @@ class CloudStackOps(CloudStackOpsBase):
 
         return csnameID
 
+    # Index of names per API type, stored per CloudMonkey profile
+    def getNameIndex(self):
+        if self.nameindex is None:
+            profile = getattr(self, 'configProfileName', 'config')
+            self.nameindex = nameindex.NameIndex(nameindex.NameIndex.path_for_profile(profile),
+                                                 ttl=self.nameindexttl, debug=self.DEBUG)
+        return self.nameindex
+
+    # Ids with this name according to the index, None when the index cannot tell
+    def lookupNameIndex(self, csApiCall, csname, apicall, listAll='false'):
+        indextype = csApiCall
+        if listAll == 'true':
+            apicall.listAll = "true"
+            indextype += "/all"
+
+        def listing():
+            try:
+                return self._fetchAllPages(copy.copy(apicall)) or []
+            except Exception as err:
+                if self.DEBUG == 1:
+                    print "DEBUG: Could not build name index '%s': %s" % (indextype, err)
+                return None
+
+        return self.getNameIndex().lookup(indextype, csname, listing)
+
     # Find Random storagePool for Cluster
     def getRandomStoragePool(self, clusterID):
         apicall = listStoragePools.listStoragePoolsCmd()
@@ -541,7 +897,7 @@ class CloudStackOps(CloudStackOpsBase):
         apicall.listAll = "true"
 
         # Call CloudStack API
-        return self._callAPI(apicall)
+        return self._cachedCallAPI(apicall, 'storagepools')
 
     # Find all hosts in a given cluster
     def getAllHostsFromCluster(self, clusterID):
@@ -600,14 +956,21 @@ class CloudStackOps(CloudStackOpsBase):
         return self._callAPI(apicall)
 
     # Generic listVirtualMachines function
-    def listVirtualMachines(self, args):
-        return self.exoCsApi.listVirtualMachines(**args)
+    # Pass details (e.g. 'min' or 'servoff,iso') in args to have CloudStack
+    # return less, and fields to keep only those keys of each vm
+    def listVirtualMachines(self, args, fields=None):
+        result = self.exoCsApi.listVirtualMachines(**args)
+        if fields is not None and 'virtualmachine' in result:
+            result['virtualmachine'] = [records.project(vm, fields) for vm in result['virtualmachine']]
+        return result
 
     # Generic listRouters function
     def listRouters(self, args):
         return self.exoCsApi.listRouters(**args)
 
     # Generic listVirtualMachines function - DEPRECATED
+    # Supports the same details and fields projection as listVirtualMachines,
+    # with fields given in args
     def deprecatedListVirtualMachines(self, args):
         args = self.remove_empty_values(args)
 
@@ -622,9 +985,11 @@ class CloudStackOps(CloudStackOpsBase):
             str(args['domainid'])) if 'domainid' in args else None
         apicall.keyword = (
             args['filterKeyword']) if 'filterKeyword' in args else None
+        if 'details' in args:
+            apicall.details = str(args['details'])
 
         # Call CloudStack API
-        return self._callAPI(apicall)
+        return self._callAPIAllPages(apicall, fields=args.get('fields'))
 
     # Find volume
     def getVolumeData(self, volumeid):
@@ -796,6 +1161,24 @@ class CloudStackOps(CloudStackOpsBase):
         # Call CloudStack API
         return self._callAPI(apicall)
 
+    # Restart VPC networks in waves, at most workers restart jobs run at once
+    # Returns a dict vpcid -> True when the restart succeeded
+    def restartVPCs(self, vpcids, cleanup='true', workers=4):
+        slots = threading.BoundedSemaphore(max(1, int(workers)))
+        watcher = self.getJobWatcher()
+        futures = {}
+        for vpcid in vpcids:
+            slots.acquire()
+            try:
+                result = self.exoCsApi.restartVPC(id=vpcid, cleanup=str(cleanup))
+                futures[vpcid] = watcher.watch(result['jobid'], callback=lambda future: slots.release())
+            except Exception as e:
+                slots.release()
+                print "Error: Restarting VPC %s failed: %s" % (vpcid, e)
+                futures[vpcid] = None
+
+        return dict((vpcid, future is not None and watcher.succeeded(future)) for vpcid, future in futures.iteritems())
+
     # Reboot virtualrouter
     def rebootRouter(self, vmid):
         apicall = rebootRouter.rebootRouterCmd()
@@ -864,6 +1247,7 @@ class CloudStackOps(CloudStackOpsBase):
     # migrateVirtualMachine with Volumes
     def migrateVirtualMachineWithVolume(self, vmid, hostid):
         vmresult = self.exoCsApi.migrateVirtualMachineWithVolume(hostid=hostid, virtualmachineid=vmid)
+        self.cache.invalidate_command('migrateVirtualMachineWithVolume')
         return self.__waitforjob(vmresult['jobid'])
 
     # migrateSystemVm
@@ -1017,59 +1401,26 @@ class CloudStackOps(CloudStackOpsBase):
         apicall.name = setting
 
         # Call CloudStack API
-        return self._callAPI(apicall)
+        return self._cachedCallAPI(apicall, 'configurations')
 
-    # Get volumes
-    def listVolumes(self, storageid, isProjectVm):
+    # Get volumes, with stream set as a generator that yields them while they arrive
+    def listVolumes(self, storageid, isProjectVm, stream=False):
         apicall = listVolumes.listVolumesCmd()
         apicall.storageid = storageid
+        apicall.listAll = "true"
 
         if isProjectVm == 'true':
             apicall.projectid = "-1"
 
-        # get default.page.size
-        result = self.getConfiguration("default.page.size")
-        apicall.listAll = "true"
-        apicall.pagesize = result[0].value
-
-        # Call API multiple times to get all volumes
-        page = 0
-        apicall.page = page
-
-        # As long as we receive useful output, keep going
-        volumes = []
-        while result is not None:
-            page = page + 1
-            apicall.page = page
-            result = self._listVolumesCall(apicall)
-            if result is not None:
-                if 'volumes' in locals():
-                    volumes = volumes + result
-                else:
-                    volumes = result
+        if stream:
+            return self._streamAllPages(apicall, compact=True)
 
+        # Call CloudStack API, this gets all pages as compact records
+        volumes = self._callAPIAllPages(apicall, compact=True)
+        if volumes is None:
+            return []
         return volumes
 
-    # Internal function used by listVolumes
-    def _listVolumesCall(self, apicall):
-        try:
-            data = self.cloudstack.marvin_request(apicall)
-            if (data is None) and self.DEBUG == 1:
-                print "Warning: Received None object from CloudStack API"
-
-            if self.DEBUG == 1:
-                print "DEBUG: received data:"
-                print data
-
-        except Exception as err:
-            print "Error: " + str(err)
-            return 1
-        except urllib2.HTTPError as e:
-            print "Error: Command failed: " + str(e.msg)
-            return 1
-
-        return data
-
     # Calculate storage usage of vm
     def calculateVirtualMachineStorageUsage(self, vmid, isProjectVm):
         # Get vm volume data
@@ -1149,7 +1500,7 @@ class CloudStackOps(CloudStackOpsBase):
             str(args['issystem'])) if 'issystem' in args else None
 
         # Call CloudStack API
-        return self._callAPI(apicall)
+        return self._cachedCallAPI(apicall, 'serviceofferings')
 
     # Get hosttags
     def getServiceOfferingTags(self, serviceofferingid, tagtype):
@@ -1292,7 +1643,12 @@ class CloudStackOps(CloudStackOpsBase):
         else:
             return None
 
-    def getDetachedVolumes(self, storagepoolid):
+    def getDetachedVolumes(self, storagepoolid, stream=False):
+
+        # Unsorted, but yielded while the volumes arrive
+        if stream:
+            return (volume for volume in self.listVolumes(storagepoolid, False, stream=True)
+                    if volume.vmname is None)
 
         volumes = self.listVolumes(storagepoolid, False)
 
@@ -1423,8 +1779,6 @@ class CloudStackOps(CloudStackOpsBase):
             args['zoneid']) > 0 else ""
         apicall.templatefilter = (str(args['templatefilter'])) if 'templatefilter' in args and len(
             args['templatefilter']) > 0 else "featured"
-        apicall.page = 1
-        apicall.pagesize = 1500
 
         # Call CloudStack API
         return self._callAPI(apicall)
@@ -1640,7 +1994,7 @@ class CloudStackOps(CloudStackOpsBase):
         clusterHostsData = self.getAllHostsFromCluster(clusterid)
 
         # Start table
-        t = PrettyTable(["Hostname",
+        t = prettytable.PrettyTable(["Hostname",
                          "Poolmaster",
                          "Resource state",
                          "State",
@@ -1712,7 +2066,7 @@ class CloudStackOps(CloudStackOpsBase):
     # Print cluster table
     def printCluster(self, clusterID, hypervisor="XenServer"):
         clusterData = self.listClusters({'clusterid': clusterID})
-        t = PrettyTable(["Cluster name",
+        t = prettytable.PrettyTable(["Cluster name",
                          "Allocation state",
                          "Managed state",
                          "XenServer HA",
@@ -1754,10 +2108,12 @@ class CloudStackOps(CloudStackOpsBase):
         print t
 
     # Check vm's still running on this host
+    # We only ask for the vm details emptyHypervisor needs to move them
     def getVirtualMachinesRunningOnHost(self, hostID):
         all_vmdata = ()
-        vms = self.deprecatedListVirtualMachines({'hostid': hostID, 'listAll': 'true'}) or []
-        pvms = tuple([self.deprecatedListVirtualMachines({'hostid': hostID, 'listAll': 'true', 'isProjectVm': 'true'})] or [])
+        vmargs = {'hostid': hostID, 'listAll': 'true', 'details': 'servoff,iso', 'fields': MIGRATION_VM_FIELDS}
+        vms = self.deprecatedListVirtualMachines(vmargs) or []
+        pvms = tuple([self.deprecatedListVirtualMachines(dict(vmargs, isProjectVm='true'))] or [])
         routers = tuple([self.getRouterData({'hostid': hostID, 'listAll': 'true'})] or [])
         prouters = tuple([self.getRouterData({'hostid': hostID, 'listAll': 'true', 'isProjectVm': 'true'})] or [])
         svms = tuple([[svm for svm in self.getSystemVmData({'hostid': hostID}) or []]])
@@ -1865,6 +2221,9 @@ class CloudStackOps(CloudStackOpsBase):
         # Check vm's still running on this host
         all_vmdata = self.getVirtualMachinesRunningOnHost(hostID)
 
+        # Stop jobs of vm's with ShutdownAndStart policy, we wait for them together
+        stopjobs = []
+
         if all_vmdata is None:
             print "Warning: No vm's to be moved found on '" + hostname + "'.."
         else:
@@ -1887,10 +2246,7 @@ class CloudStackOps(CloudStackOpsBase):
                             self.print_message(message=message, message_type="Note", to_slack=to_slack)
 
                             vmresult = self.exoCsApi.stopVirtualMachine(id=vm.id)
-                            if self.__waitforjob(vmresult['jobid']):
-                                self.vmshutpolicy[vm.id] = {"name": vm.name, "hostid": vm.hostid, "hostname": vm.hostname}
-                            else:
-                                vmresult = 1
+                            stopjobs.append((vm, self.getJobWatcher().watch(vmresult['jobid'])))
                             continue
 
                         # Affinity
@@ -2003,15 +2359,31 @@ class CloudStackOps(CloudStackOpsBase):
                                 vm.name +
                                 " (failed), ")
                             sys.stdout.flush()
+                            self.__collectStoppedVms(stopjobs)
                             return False
+        self.__collectStoppedVms(stopjobs)
         return True
 
+    # Wait for the stop jobs of vm's with ShutdownAndStart policy, and remember the stopped ones
+    def __collectStoppedVms(self, stopjobs):
+        if not stopjobs:
+            return
+        results = self.__waitforfutures([future for vm, future in stopjobs])
+        for (vm, future), stopped in zip(stopjobs, results):
+            if stopped:
+                self.vmshutpolicy[vm.id] = {"name": vm.name, "hostid": vm.hostid, "hostname": vm.hostname}
+            else:
+                message = "Error stopping vm %s with ShutdownAndStart policy on host %s" % (vm.name, vm.hostname)
+                self.print_message(message=message, message_type="Error", to_slack=(self.DEBUG == 0))
+
     # Start machines with ShutdownAndStart policy
     def startVmsWithShutPolicy(self):
         to_slack = True
         if self.DEBUG == 1:
             to_slack = False
 
+        # Start them all, then wait for the jobs together
+        startjobs = []
         for i, vm in self.vmshutpolicy.iteritems():
             if 'status' in self.vmshutpolicy[i]:
                 continue
@@ -2019,12 +2391,17 @@ class CloudStackOps(CloudStackOpsBase):
             self.print_message(message=message, message_type="Note", to_slack=to_slack)
             if self.DEBUG == 0:
                 vmresult = self.exoCsApi.startVirtualMachine(id=i, hostid=vm['hostid'])
-                if self.__waitforjob(vmresult['jobid']):
-                    self.vmshutpolicy[i].update({'status': 'done'})
-                else:
-                    self.vmshutpolicy[i].update({'status': 'error'})
-                    message = "Error starting vm %s with ShutdownAndStart policy on host %s" % (vm['name'], vm['hostname'])
-                    self.print_message(message=message, message_type="Error", to_slack=to_slack)
+                startjobs.append((i, self.getJobWatcher().watch(vmresult['jobid'])))
+
+        results = self.__waitforfutures([future for i, future in startjobs])
+        for (i, future), started in zip(startjobs, results):
+            vm = self.vmshutpolicy[i]
+            if started:
+                self.vmshutpolicy[i].update({'status': 'done'})
+            else:
+                self.vmshutpolicy[i].update({'status': 'error'})
+                message = "Error starting vm %s with ShutdownAndStart policy on host %s" % (vm['name'], vm['hostname'])
+                self.print_message(message=message, message_type="Error", to_slack=to_slack)
 
     # list oscategories
     def listOsCategories(self, args):
@@ -2036,7 +2413,7 @@ class CloudStackOps(CloudStackOpsBase):
         apicall.keyword = (str(args['keyword'])) if 'keyword' in args and len(args['keyword']) > 0 else None
 
         # Call CloudStack API
-        return self._callAPI(apicall)
+        return self._cachedCallAPI(apicall, 'oscategories')
 
     # list ostypes
     def listOsTypes(self, args):
@@ -2049,7 +2426,7 @@ class CloudStackOps(CloudStackOpsBase):
         apicall.keyword = (str(args['keyword'])) if 'keyword' in args and len(args['keyword']) > 0 else None
 
         # Call CloudStack API
-        return self._callAPI(apicall)
+        return self._cachedCallAPI(apicall, 'ostypes')
 
     def extract_volume(self, uuid, zoneid):
         # Export volume
@@ -2095,40 +2472,51 @@ class CloudStackOps(CloudStackOpsBase):
                 system_vm.memory = 1024
         return int(system_vm.memory) * 1024 * 1024
 
-    def __waitforjob(self, jobid=None, retries=10):
+    # Let the rate limiter back off when too many async jobs are pending
+    # We use our own MySQL connection, the limiter asks from any thread
+    def usePendingJobsFromSQL(self, mysqlhost, mysqlpassword=''):
+        if self.ratelimiter is None or self.pendingjobssql is not None:
+            return True
+        sql = cloudstacksql.CloudStackSQL(self.DEBUG, self.DRYRUN)
+        if sql.connectMySQL(mysqlhost, mysqlpassword) > 0:
+            print "Warning: Could not connect to MySQL to count pending async jobs"
+            return False
+        self.pendingjobssql = sql
+        lock = threading.Lock()
+
+        def pending():
+            with lock:
+                return sql.countPendingAsyncJobs()
+        self.ratelimiter.set_pending_jobs_probe(pending)
+        return True
+
+    # Client to run many API calls at the same time
+    def getConcurrentClient(self):
+        if self.concurrentclient is None:
+            self.concurrentclient = concurrentapi.ConcurrentClient(self.exoCsApi, workers=self.apiworkers,
+                                                                   debug=self.DEBUG)
+        return self.concurrentclient
+
+    # Watcher that polls all async jobs we wait for
+    def getJobWatcher(self):
+        if self.jobwatcher is None:
+            self.jobwatcher = jobwatcher.JobWatcher(self.exoCsApi, workers=self.pageworkers, debug=self.DEBUG,
+                                                    metrics=self.metrics)
+        return self.jobwatcher
+
+    def __waitforjob(self, jobid=None):
+        if self.DRYRUN:
+            return True
+        return self.__waitforfutures([self.getJobWatcher().watch(jobid)])[0]
+
+    # Wait for job futures with a spinner, returns per future whether the job succeeded
+    def __waitforfutures(self, futures):
         char = 0
         outputchar = '|/-\\'
-        while True:
-            if retries < 0:
-                break
-            # TODO: @FIXME Temporary fix for Cosmic serialization problem
-            try:
-                # jobstatus: 0 = Job still running
-                #            1 = Job done successfully
-                #            2 = Job has an error
-                jobstatus = self.exoCsApi.queryAsyncJobResult(jobid=jobid) if not self.DRYRUN else {'jobstatus': 1}
-            except CloudStackException as e:
-                if 'multiple JSON fields named jobstatus' not in str(e):
-                    raise e
-                retries -= 1
-            except requests.exceptions.ConnectionError as e:
-                if 'Connection aborted' not in str(e):
-                    raise e
-                print e
-                retries -= 1
-
-            
-            # jobstatus 1 = Job done successfully
-            if int(jobstatus['jobstatus']) == 1:
-                sys.stdout.write('\r')
-                return True
-            # jobstatus 2 = Job has an error
-            if int(jobstatus['jobstatus']) == 2:
-                sys.stdout.write('\r')
-                break
-            
+        while not all(future.done() for future in futures):
             sys.stdout.write('\r' + outputchar[char % 4])
             sys.stdout.flush()
-            char +=1
+            char += 1
             time.sleep(1)
-        return False
+        sys.stdout.write('\r')
+        return [self.getJobWatcher().succeeded(future) for future in futures]
@@ -26,21 +26,15 @@ import pprint
 import signal
 import sys
 
-# Slackweb
-try:
-    import slackweb
-except Exception as e:
-    print "Error: Please install slackweb library to support Slack messaging: %s" % e
-    print "       pip install slackweb"
-    sys.exit(1)
-
-# Colored terminals
-try:
-    from clint.textui import colored
-except Exception as e:
-    print "Error: Please install clint library to support color in the terminal: %s" % e
-    print "       pip install clint"
-    sys.exit(1)
+from lazyimport import lazy_module
+
+# Slackweb, loaded when first used
+slackweb = lazy_module('slackweb', install_hint=(
+    "slackweb library to support Slack messaging", "pip install slackweb"))
+
+# Colored terminals, loaded when first used
+colored = lazy_module('clint.textui.colored', install_hint=(
+    "clint library to support color in the terminal", "pip install clint"))
 
 
 class Timeout:
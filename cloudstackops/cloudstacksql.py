@@ -21,6 +21,11 @@
 # Remi Bergsma - rbergsma@schubergphilis.com
 
 # Import the class we depend on
+import Queue
+import atexit
+import contextlib
+import functools
+import threading
 import uuid
 
 from cloudstackopsbase import *
@@ -28,6 +33,59 @@ from cloudstackopsbase import *
 import mysql.connector
 from mysql.connector import errorcode
 
+import cache
+import sqlpool
+
+# Rows we fetch at a time when streaming, and rows that may wait in memory
+# until they are printed
+STREAM_BATCH = 500
+STREAM_BACKLOG = 5000
+
+# Name -> id lookups we remember per database, and the query that loads the
+# full map of each for preloading: kind -> (query returning name, id)
+ID_PRELOAD = {
+    'templates': "SELECT name, id FROM vm_template WHERE removed IS NULL;",
+    'guestos': "SELECT display_name, id FROM guest_os WHERE removed IS NULL;",
+    'storagepools': "SELECT storage_pool.name, storage_pool.id FROM cluster, storage_pool "
+                    "WHERE storage_pool.cluster_id = cluster.id AND cluster.removed IS NULL "
+                    "AND storage_pool.removed IS NULL;",
+    'affinitygroups': "SELECT name, id FROM affinity_group;",
+    'diskofferings': "SELECT name, id FROM disk_offering_view WHERE removed IS NULL AND domain_name = 'Cust';",
+    'serviceofferings': "SELECT name, id FROM service_offering_view WHERE removed IS NULL "
+                        "AND domain_path = '/Cust/';",
+    'vpcofferings': "SELECT name, id FROM vpc_offerings WHERE removed IS NULL;",
+    'networkofferings': "SELECT name, id FROM network_offerings WHERE removed IS NULL;",
+}
+ID_TTL = 900
+ID_CACHE_SIZE = 100000
+
+# Seconds a replica may be behind before checkReplica stops reading from it,
+# unless the config section sets mysqlreplicamaxlag
+REPLICA_MAX_LAG = 5
+
+# How to match an ip or mac address: exact and prefix can use an index,
+# substring scans the whole table
+MATCH_MODES = ('exact', 'prefix', 'substring')
+
+
+# Remember the ids a name -> id lookup method finds, in the idcache of the
+# CloudStackSQL instance. Not found is not remembered, the name may show up
+def _memoised(kind):
+    def decorate(method):
+        @functools.wraps(method)
+        def lookup(self, *args, **kwargs):
+            name = args[0] if args else kwargs.values()[0]
+            key = (kind, name)
+            found, id = self.idcache.get(key)
+            if found:
+                return id
+            id = method(self, *args, **kwargs)
+            if id:
+                self.idcache.set(key, id)
+            return id
+        return lookup
+    return decorate
+
 
 class CloudStackSQL(CloudStackOpsBase):
     # Init function
@@ -35,14 +93,19 @@ class CloudStackSQL(CloudStackOpsBase):
         self.DEBUG = debug
         self.DRYRUN = dryrun
         self.FORCE = force
+        self.conn = None
+        self.replica = None
+        self.replicamaxlag = REPLICA_MAX_LAG
+        self.mysqlhost = None
+        self.idcache = cache.Cache(maxsize=ID_CACHE_SIZE, ttls=dict((kind, ID_TTL) for kind in ID_PRELOAD),
+                                   debug=debug)
 
     # Get all DB's
     def getAllDB(self):
         db = []
         try:
             self.configfile = os.getcwd() + '/config'
-            config = ConfigParser.RawConfigParser()
-            config.read(self.configfile)
+            config = sqlpool.read_config(self.configfile)
             for each_section in config.sections():
                 for item, value in config.items(each_section):
                     if item == 'mysqlhostname':
@@ -52,16 +115,39 @@ class CloudStackSQL(CloudStackOpsBase):
             sys.exit(1)
         return db
 
+    # Databases to query: 'any' means all of the config file, or a comma
+    # separated list of config sections (or hosts)
+    def resolveDatabases(self, mysqlhost):
+        if mysqlhost == 'any':
+            return self.getAllDB()
+        return [db for db in mysqlhost.split(',') if db]
+
     # Connect MySQL Cloud DB
-    def connectMySQL(self, mysqlhost, mysqlpassword='', mysqluser='cloud'):
+    # Connections come from a pool per config section (or host), closing
+    # them with disconnectMySQL hands them back
+    # The first connect decides the pool size, poolsize overrides the config
+    # When the config section has a mysqlreplica, read-only reports read from
+    # that host (see _cursor) and everything else goes to mysqlhostname
+    def connectMySQL(self, mysqlhost, mysqlpassword='', mysqluser='cloud', poolsize=None):
+        # Hand the connections we still hold back to their pool first, with a
+        # pool of one we would otherwise wait for ourselves
+        if self.conn:
+            self.closeReplica()
+            try:
+                self.conn.close()
+            except mysql.connector.Error:
+                pass
+            self.conn = None
+
+        self.configfile = os.getcwd() + '/config'
+        config = sqlpool.read_config(self.configfile)
+        mysqlhostname = mysqlhost
+        mysqlport = 3306
 
         # Try to lookup password if not supplied
         if not mysqlpassword:
             # Try to read MySQL settings from config file
             try:
-                self.configfile = os.getcwd() + '/config'
-                config = ConfigParser.RawConfigParser()
-                config.read(self.configfile)
                 mysqlpassword = config.get(mysqlhost, 'mysqlpassword')
                 mysqlhostname = config.get(mysqlhost, 'mysqlhostname')
                 mysqluser = config.get(mysqlhost, 'mysqluser')
@@ -76,7 +162,7 @@ class CloudStackSQL(CloudStackOpsBase):
             except:
                 mysqlport = 3306
 
-        config = {
+        dbconfig = {
             'user': mysqluser,
             'password': mysqlpassword,
             'host': mysqlhostname,
@@ -87,7 +173,7 @@ class CloudStackSQL(CloudStackOpsBase):
         }
 
         try:
-            conn = mysql.connector.connect(**config)
+            conn = sqlpool.get_connection(mysqlhost, dbconfig, poolsize or sqlpool.pool_size(config))
         except mysql.connector.Error as err:
             if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
                 print("Something is wrong with your user name or password")
@@ -99,15 +185,176 @@ class CloudStackSQL(CloudStackOpsBase):
                 print(err)
                 return 1
 
+        # Ids we remember belong to one database
+        if mysqlhost != self.mysqlhost:
+            self.idcache.invalidate()
+
         self.conn = conn
+        self.mysqlhost = mysqlhost
+        self.connectReplica(config, dbconfig, poolsize)
+        if self.DEBUG == 1:
+            _print_stats_at_exit()
+
+        try:
+            preload = config.getboolean('cloudstackOps', 'sql_preload_ids')
+        except:
+            preload = False
+        if preload and self.idcache.stats()['size'] == 0:
+            self.preloadIds()
         return 0
 
+    # Connect the replica of the config section, if it has one
+    # Without a reachable replica, reads go to the primary
+    def connectReplica(self, config, dbconfig, poolsize=None):
+        self.closeReplica()
+        try:
+            replicahost = config.get(self.mysqlhost, 'mysqlreplica')
+        except:
+            return False
+
+        try:
+            self.replicamaxlag = config.getint(self.mysqlhost, 'mysqlreplicamaxlag')
+        except:
+            self.replicamaxlag = REPLICA_MAX_LAG
+
+        replicaconfig = dict(dbconfig)
+        replicaconfig['host'] = replicahost
+        try:
+            replicaconfig['port'] = config.get(self.mysqlhost, 'mysqlreplicaport')
+        except:
+            pass
+
+        try:
+            self.replica = sqlpool.get_connection(self.mysqlhost + '-replica', replicaconfig,
+                                                  poolsize or sqlpool.pool_size(config))
+        except mysql.connector.Error as err:
+            print "Warning: Replica '%s' of '%s' is not available, reading from the primary: %s" % (
+                replicahost, self.mysqlhost, err)
+            return False
+
+        if self.DEBUG == 1:
+            print "DEBUG: Read-only queries of '%s' go to replica '%s'" % (self.mysqlhost, replicahost)
+        return True
+
+    def closeReplica(self):
+        if self.replica is not None:
+            self.replica.close()
+            self.replica = None
+
+    # Seconds the replica is behind the primary, None when we have no replica
+    # or it is not replicating
+    def replicaLag(self):
+        if self.replica is None:
+            return None
+
+        cursor = self.replica.cursor()
+        try:
+            cursor.execute("SHOW SLAVE STATUS;")
+            row = cursor.fetchone()
+            columns = cursor.column_names
+        except mysql.connector.Error as err:
+            print "Warning: Cannot read the replication status of '%s': %s" % (self.mysqlhost, err)
+            return None
+        finally:
+            cursor.close()
+
+        if row is None:
+            return None
+        return dict(zip(columns, row)).get('Seconds_Behind_Master')
+
+    # Check the replica before trusting its reads for decisions, we read from
+    # the primary from now on when it is too far behind or not replicating
+    # Returns whether reads still go to the replica
+    def checkReplica(self, maxlag=None):
+        if self.replica is None:
+            return False
+        if maxlag is None:
+            maxlag = self.replicamaxlag
+
+        lag = self.replicaLag()
+        if lag is None or lag > maxlag:
+            print "Warning: Replica of '%s' is %s, reading from the primary" % (
+                self.mysqlhost, "not replicating" if lag is None else "%ss behind" % lag)
+            self.closeReplica()
+            return False
+
+        if self.DEBUG == 1:
+            print "DEBUG: Replica of '%s' is %ss behind, max is %ss" % (self.mysqlhost, lag, maxlag)
+        return True
+
     # Disconnect MySQL connection
     def disconnectMySQL(self):
+        self.closeReplica()
         self.conn.close()
+        self.conn = None
+        if self.DEBUG == 1:
+            stats = self.idCacheStats()
+            if stats['hits'] + stats['misses'] > 0:
+                print "DEBUG: Id lookups: %(hits)s hits, %(misses)s misses, %(hitrate).0f%% hit rate" % stats
+
+    # Load the full name -> id maps of these kinds (all of ID_PRELOAD by
+    # default) with one query each, so lookups need no query at all
+    # Names that are not unique are left to the lookup queries
+    def preloadIds(self, kinds=None):
+        if not self.conn:
+            return False
+
+        for kind in kinds or sorted(ID_PRELOAD):
+            cursor = self.conn.cursor()
+            cursor.execute(ID_PRELOAD[kind])
+            if self.DEBUG == 1:
+                print "DEBUG: Executed SQL: " + cursor.statement
+            rows = cursor.fetchall()
+            cursor.close()
+
+            counts = {}
+            for name, id in rows:
+                counts[name] = counts.get(name, 0) + 1
+            for name, id in rows:
+                if counts[name] == 1:
+                    self.idcache.set((kind, name), id)
+
+            if self.DEBUG == 1:
+                print "DEBUG: Preloaded %s %s ids" % (len(rows), kind)
+        return True
+
+    # Forget remembered ids of one kind, or all of them
+    def invalidateIds(self, kind=None):
+        self.idcache.invalidate(kind)
+
+    # Hits and misses of the id lookups
+    def idCacheStats(self):
+        stats = self.idcache.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hitrate'] = 100.0 * stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    # Run the statements of a with block as one transaction, everything is
+    # rolled back when the block raises
+    @contextlib.contextmanager
+    def transaction(self):
+        self.conn.start_transaction()
+        try:
+            yield
+        except:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    # Cursor for a query, unbuffered when we stream its rows
+    # An unbuffered cursor reads rows from the server as we fetch them, so the
+    # connection cannot run other queries until all rows are read
+    # Read-only queries use the replica when we have one
+    def _cursor(self, stream=False, readonly=False):
+        conn = self.conn
+        if readonly and self.replica is not None:
+            conn = self.replica
+        if stream:
+            return conn.cursor(buffered=False)
+        return conn.cursor()
 
     # list HA Workers
-    def getHAWorkerData(self, hypervisorName):
+    def getHAWorkerData(self, hypervisorName, stream=False):
         if not self.conn:
             return 1
 
@@ -116,7 +363,7 @@ class CloudStackSQL(CloudStackOpsBase):
         else:
             hypervisorNameWhere = ""
 
-        cursor = self.conn.cursor()
+        cursor = self._cursor(stream, readonly=True)
         cursor.execute("SELECT \
         d.name AS domain, \
         vm.name AS vmname, \
@@ -138,17 +385,19 @@ class CloudStackSQL(CloudStackOpsBase):
         GROUP BY vm.name \
         ORDER BY domain,ha.created DESC \
         ;")
+        if stream:
+            return _stream(cursor)
         result = cursor.fetchall()
         cursor.close()
 
         return result
 
     # list Async jobs
-    def getAsyncJobData(self):
+    def getAsyncJobData(self, stream=False):
         if not self.conn:
             return 1
 
-        cursor = self.conn.cursor()
+        cursor = self._cursor(stream, readonly=True)
         cursor.execute("SELECT user.username, \
         account.account_name, \
         instance_name, \
@@ -161,17 +410,33 @@ class CloudStackSQL(CloudStackOpsBase):
         LEFT JOIN vm_instance ON instance_id = vm_instance.id \
         LEFT JOIN mshost ON job_init_msid = mshost.id \
         WHERE job_result IS NULL;")
+        if stream:
+            return _stream(cursor)
         result = cursor.fetchall()
         cursor.close()
 
         return result
 
+    # Number of async jobs that did not finish yet
+    def countPendingAsyncJobs(self):
+        if not self.conn:
+            return None
+
+        # Polled often, so we keep this one prepared
+        cursor = self.conn.prepared()
+        cursor.execute("SELECT COUNT(*) FROM async_job WHERE job_result IS NULL")
+        result = cursor.fetchone()
+
+        return result[0]
+
     # list ip adress info
-    def getIpAddressData(self, ipaddress):
+    def getIpAddressData(self, ipaddress, mode='substring', stream=False):
         if not self.conn:
             return 1
 
-        cursor = self.conn.cursor()
+        publicwhere, publicvalue = _match('public_ip_address', ipaddress, mode)
+        nicwhere, nicvalue = _match('ip4_address', ipaddress, mode)
+        cursor = self._cursor(stream, readonly=True)
         cursor.execute("SELECT \
         vpc.name, \
         'n/a' AS 'mac_address', \
@@ -185,7 +450,7 @@ class CloudStackSQL(CloudStackOpsBase):
         FROM cloud.user_ip_address \
         LEFT JOIN vpc ON user_ip_address.vpc_id = vpc.id \
         LEFT JOIN networks ON user_ip_address.source_network_id = networks.id \
-        WHERE public_ip_address LIKE '%" + ipaddress + "%' \
+        WHERE " + publicwhere + " \
         UNION \
         SELECT networks.name, \
         nics.mac_address, \
@@ -200,39 +465,44 @@ class CloudStackSQL(CloudStackOpsBase):
         cloud.networks \
         WHERE nics.instance_id = vm_instance.id \
         AND nics.network_id = networks.id \
-        AND ip4_address \
-        LIKE '%" + ipaddress + "%' \
-        AND nics.removed IS NULL;")
+        AND " + nicwhere + " \
+        AND nics.removed IS NULL;", (publicvalue, nicvalue))
+        if stream:
+            return _stream(cursor)
         result = cursor.fetchall()
         cursor.close()
 
         return result
 
     # list ip adress info
-    def getIpAddressDataBridge(self, ipaddress):
+    def getIpAddressDataBridge(self, ipaddress, mode='substring', stream=False):
         if not self.conn:
             return 1
 
-        cursor = self.conn.cursor()
+        where, value = _match('user_ip_address.public_ip_address', ipaddress, mode)
+        cursor = self._cursor(stream, readonly=True)
         cursor.execute("SELECT DISTINCT \
         vm_instance.name, public_ip_address, update_time, networks.name, user_ip_address.state \
         FROM vm_instance \
         JOIN vm_network_map ON vm_network_map.vm_id = vm_instance.id \
         JOIN networks ON networks.id = vm_network_map.network_id \
         JOIN user_ip_address ON networks.id = user_ip_address.network_id \
-        WHERE user_ip_address.public_ip_address LIKE '%" + ipaddress + "%' ;")
+        WHERE " + where + " ;", (value,))
 
+        if stream:
+            return _stream(cursor)
         result = cursor.fetchall()
         cursor.close()
 
         return result
 
     # list ip adress info
-    def getIpAddressDataInfra(self, ipaddress):
+    def getIpAddressDataInfra(self, ipaddress, mode='substring', stream=False):
         if not self.conn:
             return 1
 
-        cursor = self.conn.cursor()
+        where, value = _match('nics.ip4_address', ipaddress, mode)
+        cursor = self._cursor(stream, readonly=True)
         cursor.execute("SELECT DISTINCT \
         name, \
         nics.vm_type, \
@@ -241,19 +511,22 @@ class CloudStackSQL(CloudStackOpsBase):
         instance_id \
         FROM nics \
         JOIN vm_instance ON vm_instance.id = nics.instance_id \
-        WHERE nics.ip4_address LIKE '%" + ipaddress + "%' ;")
+        WHERE " + where + " ;", (value,))
 
+        if stream:
+            return _stream(cursor)
         result = cursor.fetchall()
         cursor.close()
 
         return result
 
     # list mac adress info
-    def getMacAddressData(self, macaddress):
+    def getMacAddressData(self, macaddress, mode='substring', stream=False):
         if not self.conn:
             return 1
 
-        cursor = self.conn.cursor()
+        where, value = _match('mac_address', macaddress.lower(), mode)
+        cursor = self._cursor(stream, readonly=True)
         cursor.execute("SELECT networks.name, \
         nics.mac_address, \
         nics.ip4_address, \
@@ -267,12 +540,180 @@ class CloudStackSQL(CloudStackOpsBase):
         cloud.networks \
         WHERE nics.instance_id = vm_instance.id \
         AND nics.network_id = networks.id \
-        AND mac_address \
-        LIKE '%" + macaddress + "%' \
-        AND nics.removed IS NULL;")
+        AND " + where + " \
+        AND nics.removed IS NULL;", (value,))
+        if stream:
+            return _stream(cursor)
         result = cursor.fetchall()
         cursor.close()
 
+        return result
+
+    # Hosts of the given clusters (uuids), for the vm report
+    def getReportHostData(self, clusterids):
+        if not self.conn:
+            return 1
+        if not clusterids:
+            return []
+
+        query = """
+SELECT `host`.`uuid`, `host`.`name`, `cluster`.`uuid`, `cluster`.`name`, `host`.`status`,
+       `host`.`resource_state`, `host`.`ram`
+FROM `host`
+JOIN `cluster` ON `cluster`.`id` = `host`.`cluster_id`
+WHERE
+(
+  `host`.`type` = 'Routing'
+  AND
+  `host`.`removed` IS NULL
+  AND
+  `cluster`.`uuid` IN (%s)
+)
+ORDER BY `host`.`name`;
+""" % ', '.join(['%s'] * len(clusterids))
+
+        cursor = self._cursor(readonly=True)
+        cursor.execute(query, tuple(clusterids))
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
+        result = cursor.fetchall()
+        cursor.close()
+
+        return result
+
+    # Vm's running on the hosts of the given clusters, with memory and cores of
+    # the offering (or custom values) and storage in GB summed over the volumes,
+    # rounded per volume like the API based report does
+    def getReportVirtualMachineData(self, clusterids, domainid='', keyword='', projectvms=False):
+        if not self.conn:
+            return 1
+        if not clusterids:
+            return []
+
+        params = list(clusterids)
+        where = ""
+        if projectvms:
+            where += " AND `projects`.`id` IS NOT NULL"
+        else:
+            where += " AND `projects`.`id` IS NULL"
+        if domainid:
+            where += " AND `domain`.`uuid` = %s"
+            params.append(domainid)
+        if keyword:
+            where += " AND (`vm`.`name` LIKE %s OR `user_vm`.`display_name` LIKE %s)"
+            params += ['%' + keyword + '%'] * 2
+
+        query = """
+SELECT `vm`.`uuid`, `vm`.`name`, `user_vm`.`display_name`, `vm`.`instance_name`,
+       `host`.`uuid`, `host`.`name`, `account`.`account_name`, `domain`.`name`, `domain`.`uuid`,
+       `projects`.`name`, `projects`.`uuid`,
+       COALESCE(CAST(`memory`.`value` AS UNSIGNED), `service_offering`.`ram_size`),
+       COALESCE(CAST(`cpu`.`value` AS UNSIGNED), `service_offering`.`cpu`),
+       `vm_template`.`display_text`,
+       (
+         SELECT COALESCE(SUM(FLOOR(`volumes`.`size` / 1073741824)), 0)
+         FROM `volumes`
+         WHERE `volumes`.`instance_id` = `vm`.`id` AND `volumes`.`removed` IS NULL
+       ),
+       `vm`.`created`
+FROM `vm_instance` `vm`
+JOIN `user_vm` ON `user_vm`.`id` = `vm`.`id`
+JOIN `host` ON `host`.`id` = `vm`.`host_id`
+JOIN `cluster` ON `cluster`.`id` = `host`.`cluster_id`
+JOIN `account` ON `account`.`id` = `vm`.`account_id`
+JOIN `domain` ON `domain`.`id` = `vm`.`domain_id`
+JOIN `service_offering` ON `service_offering`.`id` = `vm`.`service_offering_id`
+LEFT JOIN `projects` ON `projects`.`project_account_id` = `vm`.`account_id` AND `projects`.`removed` IS NULL
+LEFT JOIN `vm_template` ON `vm_template`.`id` = `vm`.`vm_template_id`
+LEFT JOIN `user_vm_details` `memory` ON `memory`.`vm_id` = `vm`.`id` AND `memory`.`name` = 'memory'
+LEFT JOIN `user_vm_details` `cpu` ON `cpu`.`vm_id` = `vm`.`id` AND `cpu`.`name` = 'cpuNumber'
+WHERE
+(
+  `vm`.`type` = 'User'
+  AND
+  `vm`.`removed` IS NULL
+  AND
+  `cluster`.`uuid` IN (%s)
+)%s
+ORDER BY `host`.`name`, `vm`.`name`;
+""" % (', '.join(['%s'] * len(clusterids)), where)
+
+        cursor = self._cursor(readonly=True)
+        cursor.execute(query, tuple(params))
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
+        result = cursor.fetchall()
+        cursor.close()
+
+        return result
+
+    # Routers running on the hosts of the given clusters, with their nic count,
+    # template version, offering and the name of their vpc or guest network
+    def getReportRouterData(self, clusterids, domainid='', projectvms=False):
+        if not self.conn:
+            return 1
+        if not clusterids:
+            return []
+
+        params = list(clusterids)
+        if projectvms:
+            where = " AND `projects`.`id` IS NOT NULL"
+        else:
+            where = " AND `projects`.`id` IS NULL"
+        if domainid:
+            where += " AND `domain`.`uuid` = %s"
+            params.append(domainid)
+
+        query = """
+SELECT `vm`.`uuid`, `vm`.`name`, `host`.`uuid`, `host`.`name`, `account`.`account_name`,
+       `domain`.`name`, `domain`.`uuid`, `projects`.`name`, `projects`.`uuid`,
+       `domain_router`.`template_version`, `domain_router`.`is_redundant_router`,
+       `domain_router`.`redundant_state`, `vpc`.`uuid`, `vpc`.`name`, `networks`.`uuid`,
+       `networks`.`name`, `service_offering`.`id`, `service_offering`.`ram_size`,
+       `service_offering`.`cpu`,
+       (
+         SELECT COUNT(*)
+         FROM `nics`
+         WHERE `nics`.`instance_id` = `vm`.`id` AND `nics`.`removed` IS NULL
+       ),
+       `configuration`.`value`,
+       `vm`.`created`
+FROM `domain_router`
+JOIN `vm_instance` `vm` ON `vm`.`id` = `domain_router`.`id`
+JOIN `host` ON `host`.`id` = `vm`.`host_id`
+JOIN `cluster` ON `cluster`.`id` = `host`.`cluster_id`
+JOIN `account` ON `account`.`id` = `vm`.`account_id`
+JOIN `domain` ON `domain`.`id` = `vm`.`domain_id`
+JOIN `service_offering` ON `service_offering`.`id` = `vm`.`service_offering_id`
+LEFT JOIN `projects` ON `projects`.`project_account_id` = `vm`.`account_id` AND `projects`.`removed` IS NULL
+LEFT JOIN `vpc` ON `vpc`.`id` = `domain_router`.`vpc_id`
+LEFT JOIN `networks` ON `networks`.`id` =
+(
+  SELECT MIN(`router_network_ref`.`network_id`)
+  FROM `router_network_ref`
+  WHERE `router_network_ref`.`router_id` = `domain_router`.`id`
+  AND `router_network_ref`.`guest_type` IS NOT NULL
+)
+LEFT JOIN `configuration` ON `configuration`.`name` = 'minreq.sysvmtemplate.version'
+WHERE
+(
+  `vm`.`removed` IS NULL
+  AND
+  `cluster`.`uuid` IN (%s)
+)%s
+ORDER BY `host`.`name`, `vm`.`name`;
+""" % (', '.join(['%s'] * len(clusterids)), where)
+
+        cursor = self._cursor(readonly=True)
+        cursor.execute(query, tuple(params))
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
         result = cursor.fetchall()
         cursor.close()
 
@@ -306,7 +747,7 @@ class CloudStackSQL(CloudStackOpsBase):
         if not instancename:
             return 1
 
-        cursor = self.conn.cursor()
+        cursor = self._cursor(readonly=True)
         cursor.execute("SELECT volumes.name, volumes.path, volumes.uuid, volumes.size, vm_instance.state as vmstate, "
                        "volumes.volume_type as voltype" +
                        " FROM vm_instance, volumes" +
@@ -375,6 +816,7 @@ class CloudStackSQL(CloudStackOpsBase):
         return result
 
     # Return new template id
+    @_memoised('templates')
     def get_template_id_from_name(self, template_name):
         if not self.conn:
             return False
@@ -394,6 +836,7 @@ class CloudStackSQL(CloudStackOpsBase):
             return False
 
     # Return guest_os id
+    @_memoised('guestos')
     def get_guest_os_id_from_name(self, guest_os_name):
         if not self.conn:
             return False
@@ -414,6 +857,7 @@ class CloudStackSQL(CloudStackOpsBase):
             return False
 
     # Return storage_pool id
+    @_memoised('storagepools')
     def get_storage_pool_id_from_name(self, storage_pool_name):
         if not self.conn:
             return False
@@ -458,6 +902,7 @@ class CloudStackSQL(CloudStackOpsBase):
             return False
 
     # Return instance_id
+    @_memoised('affinitygroups')
     def get_affinity_group_id_from_name(self, affinity_group_name):
         if not self.conn:
             return False
@@ -611,7 +1056,7 @@ class CloudStackSQL(CloudStackOpsBase):
         if not instancename:
             return False
 
-        cursor = self.conn.cursor()
+        cursor = self._cursor(readonly=True)
         cursor.execute("SELECT vm_instance.id AS instance_id, vm_instance.vm_template_id AS vm_template_id, " +
                        "vm_instance.guest_os_id AS guest_os_id, volumes.pool_id AS pool_id " +
                        "FROM vm_instance, volumes " +
@@ -704,9 +1149,24 @@ class CloudStackSQL(CloudStackOpsBase):
         except:
             return False
 
+    def get_vpc_uuid(self, vpc_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT `uuid` FROM `vpc` WHERE `id` = %s;", (vpc_id,))
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
+        result = cursor.fetchall()
+        cursor.close()
+
+        try:
+            return result[0][0]
+        except:
+            return False
+
     def create_vpc(self, network_id, vpc_offering_id):
         create_vpc_query = """
-INSERT INTO `vpc` 
+INSERT INTO `vpc`
 (
   `uuid`,
   `name`,
@@ -728,32 +1188,32 @@ INSERT INTO `vpc`
   `source_nat_list`,
   `syslog_server_list`
 )
-VALUES
-(
+SELECT
   UUID(), -- uuid
-  (SELECT `name` FROM `networks` WHERE `id` = %(network_id)s), -- name
-  (SELECT `name` FROM `networks` WHERE `id` = %(network_id)s), -- display_text
-  (SELECT `cidr` FROM `networks` WHERE `id` = %(network_id)s), -- cidr
+  `name`, -- name
+  `name`, -- display_text
+  `cidr`, -- cidr
   %(vpc_offering_id)s, -- vpc_offering_id
-  (SELECT `data_center_id` FROM `networks` WHERE `id` = %(network_id)s), -- zone_id
+  `data_center_id`, -- zone_id
   'Enabled', -- state
-  (SELECT `domain_id` FROM `networks` WHERE `id` = %(network_id)s), -- domain_id
-  (SELECT `account_id` FROM `networks` WHERE `id` = %(network_id)s), -- account_id
-  (SELECT `network_domain` FROM `networks` WHERE `id` = %(network_id)s), -- network_domain
+  `domain_id`, -- domain_id
+  `account_id`, -- account_id
+  `network_domain`, -- network_domain
   NULL, -- removed
-  (SELECT `created` FROM `networks` WHERE `id` = %(network_id)s), -- created
+  `created`, -- created
   0, -- restart_required
   1, -- display
   0, -- uses_distributed_router
   0, -- region_level_vpc
-  (SELECT `redundant` FROM `networks` WHERE `id` = %(network_id)s), -- redundant
+  `redundant`, -- redundant
   NULL, -- source_nat_list
   NULL -- syslog_server_list
-);
-""" % dict(network_id=network_id, vpc_offering_id=vpc_offering_id)
+FROM `networks`
+WHERE `id` = %(network_id)s;
+"""
 
         cursor = self.conn.cursor()
-        cursor.execute(create_vpc_query)
+        cursor.execute(create_vpc_query, dict(network_id=network_id, vpc_offering_id=vpc_offering_id))
 
         vpc_db_id = cursor.getlastrowid()
 
@@ -836,7 +1296,8 @@ WHERE
   `ip_address_id` IS NULL
   AND
   `network_id` = %(network_id)s
-);    
+)
+ORDER BY `id`;
 """ % dict(network_id=network_id)
 
         cursor = self.conn.cursor()
@@ -852,23 +1313,25 @@ WHERE
 
         self.migrate_firewall_rules_to_network_acl_items(network_acl_id, ids)
 
-    def convert_isolated_network_public_ip_rules_to_network_acl(self, public_ip_db_id, network_acl_id):
-        # Gather list of rule ids for the isolated network
+    # Ingress rules of all public ips of the network, in the order of the ips
+    def convert_isolated_network_ingress_rules_to_network_acl(self, network_id, network_acl_id):
         query = """
-SELECT `id`
+SELECT `firewall_rules`.`id`
 FROM `firewall_rules`
+JOIN `user_ip_address` ON `user_ip_address`.`id` = `firewall_rules`.`ip_address_id`
 WHERE
 (
-  `Purpose` = 'Firewall'
+  `firewall_rules`.`purpose` = 'Firewall'
   AND
-  `traffic_type` = 'Ingress'
+  `firewall_rules`.`traffic_type` = 'Ingress'
   AND
-  `ip_address_id` = %(ip_address_id)s
-);    
-""" % dict(ip_address_id=public_ip_db_id)
+  `user_ip_address`.`network_id` = %(network_id)s
+)
+ORDER BY `firewall_rules`.`ip_address_id`, `firewall_rules`.`id`;
+"""
 
         cursor = self.conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, dict(network_id=network_id))
 
         if self.DEBUG == 1:
             print "DEBUG: Executed SQL: " + cursor.statement
@@ -880,35 +1343,78 @@ WHERE
 
         self.migrate_firewall_rules_to_network_acl_items(network_acl_id, ids)
 
+    # Copy firewall rules and their cidrs to acl items, numbered after the
+    # items the acl already has, in a fixed number of statements
     def migrate_firewall_rules_to_network_acl_items(self, network_acl_id, firewall_rules_ids):
+        firewall_rules_ids = list(firewall_rules_ids)
+        if len(firewall_rules_ids) == 0:
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT MAX(`number`) FROM `network_acl_item` WHERE `acl_id` = %s;", (network_acl_id,))
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
+        number = cursor.fetchone()
+        first_number = number[0] or 0
+
+        placeholders = ', '.join(['%s'] * len(firewall_rules_ids))
         query = """
-SELECT MAX(`number`)
-FROM `network_acl_item`
-WHERE
-(
-  `acl_id` = %(acl_id)s
-);
+SELECT
+  `id`,
+  `start_port`,
+  `end_port`,
+  `state`,
+  `protocol`,
+  `created`,
+  `icmp_code`,
+  `icmp_type`,
+  `traffic_type`,
+  `display`
+FROM `firewall_rules`
+WHERE `id` IN (%s);
+""" % placeholders
 
-""" % dict(acl_id=network_acl_id)
+        cursor.execute(query, firewall_rules_ids)
 
-        cursor = self.conn.cursor()
-        cursor.execute(query)
         if self.DEBUG == 1:
             print "DEBUG: Executed SQL: " + cursor.statement
 
-        rule_counter = 0
+        rules = dict((row[0], row[1:]) for row in cursor.fetchall())
 
-        number = cursor.fetchone()
-        if number[0]:
-            rule_counter = number[0]
+        query = """
+SELECT `firewall_rule_id`, `source_cidr`
+FROM `firewall_rules_cidrs`
+WHERE `firewall_rule_id` IN (%s);
+""" % placeholders
 
-        cursor.close()
+        cursor.execute(query, firewall_rules_ids)
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
+        rule_cidrs = {}
+        for firewall_rule_id, cidr in cursor.fetchall():
+            rule_cidrs.setdefault(firewall_rule_id, []).append(cidr)
 
-        # Convert each rule
+        # Number the items ourselves, so we can find them back by number
+        items = []
+        rule_by_number = {}
+        rule_counter = first_number
         for firewall_rule_id in firewall_rules_ids:
+            if firewall_rule_id not in rules:
+                continue
             rule_counter += 1
+            rule_by_number[rule_counter] = firewall_rule_id
+            rule = rules[firewall_rule_id]
+            items.append((str(uuid.uuid4()), network_acl_id) + tuple(rule[:8]) + (rule_counter, 'Allow', rule[8]))
 
-            query = """
+        if len(items) == 0:
+            cursor.close()
+            return
+
+        query = """
 INSERT INTO `network_acl_item`
 (
   `uuid`,
@@ -925,60 +1431,51 @@ INSERT INTO `network_acl_item`
   `action`,
   `display`
 )
-SELECT 
-  UUID(), -- uuid
-  %(acl_id)s, -- acl_id
-  `start_port`,
-  `end_port`,
-  `state`,
-  `protocol`,
-  `created`,
-  `icmp_code`,
-  `icmp_type`,
-  `traffic_type`,
-  %(number)s, -- number
-  'Allow', -- action
-  `display`
-FROM `firewall_rules`
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+"""
+
+        cursor.executemany(query, items)
+
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
+
+        query = """
+SELECT `id`, `number`
+FROM `network_acl_item`
 WHERE
 (
-  `id` = %(firewall_rule_id)s
+  `acl_id` = %s
+  AND
+  `number` > %s
 );
-""" % dict(acl_id=network_acl_id, number=rule_counter, firewall_rule_id=firewall_rule_id)
-
-            cursor = self.conn.cursor()
-            cursor.execute(query)
+"""
 
-            if self.DEBUG == 1:
-                print "DEBUG: Executed SQL: " + cursor.statement
+        cursor.execute(query, (network_acl_id, first_number))
 
-            network_acl_item_db_id = cursor.getlastrowid()
+        if self.DEBUG == 1:
+            print "DEBUG: Executed SQL: " + cursor.statement
 
-            cursor.close()
+        cidrs = []
+        for network_acl_item_id, number in cursor.fetchall():
+            for cidr in rule_cidrs.get(rule_by_number.get(number), []):
+                cidrs.append((network_acl_item_id, cidr))
 
+        if len(cidrs) > 0:
             query = """
 INSERT INTO `network_acl_item_cidrs`
 (
   `network_acl_item_id`,
   `cidr`
 )
-SELECT
-  %(network_acl_item_id)s,
-  `source_cidr`
-FROM `firewall_rules_cidrs`
-WHERE
-(
-  `firewall_rule_id` = %(firewall_rule_id)s
-);
-""" % dict(network_acl_item_id=network_acl_item_db_id, firewall_rule_id=firewall_rule_id)
+VALUES (%s, %s);
+"""
 
-            cursor = self.conn.cursor()
-            cursor.execute(query)
+            cursor.executemany(query, cidrs)
 
             if self.DEBUG == 1:
                 print "DEBUG: Executed SQL: " + cursor.statement
 
-            cursor.close()
+        cursor.close()
 
     def update_isolated_network_to_be_a_vpc_tier(self, vpc_id, network_acl_id, network_offering_id, network_id):
         query = """
@@ -1001,7 +1498,7 @@ WHERE
 
         cursor.close()
 
-    def get_all_ipaddresses_from_network(self, network_id):
+    def get_all_ipaddresses_from_network(self, network_id, stream=False):
         query = """
 SELECT `id`, `public_ip_address`
 FROM `user_ip_address`
@@ -1011,65 +1508,50 @@ WHERE
 );
 """ % dict(network_id=network_id)
 
-        cursor = self.conn.cursor()
+        cursor = self._cursor(stream)
         cursor.execute(query)
 
         if self.DEBUG == 1:
             print "DEBUG: Executed SQL: " + cursor.statement
 
+        if stream:
+            return _stream(cursor)
         ids = cursor.fetchall()
 
         cursor.close()
 
         return ids
 
-    def migrate_public_ip_from_isolated_network_to_vpc(self, vpc_id, ip_acl_id, public_ip_id):
+    # Move all public ips of the network to the vpc, ips without port forwarding
+    # or load balancing rules are detached from the network
+    def migrate_public_ips_from_isolated_network_to_vpc(self, vpc_id, ip_acl_id, network_id):
         query = """
-SELECT `id`
-FROM `firewall_rules`
-WHERE
-(
-  `ip_address_id` = %(public_ip_id)s
-  AND
-  `purpose` IN ('PortForwarding', 'LoadBalancing')
-);
-""" % dict(public_ip_id=public_ip_id)
-
-        cursor = self.conn.cursor()
-        cursor.execute(query)
-
-        if self.DEBUG == 1:
-            print "DEBUG: Executed SQL: " + cursor.statement
-
-        result = cursor.fetchall()
-        cursor.close()
-
-        if len(result) is 0:
-            query = """
 UPDATE `user_ip_address`
 SET
   `vpc_id` = %(vpc_id)s,
   `ip_acl_id` = %(ip_acl_id)s,
-  `network_id` = NULL
-WHERE
-(
-  `id` = %(public_ip_id)s
-);
-""" % dict(vpc_id=vpc_id, ip_acl_id=ip_acl_id, public_ip_id=public_ip_id)
-        else:
-            query = """
-UPDATE `user_ip_address`
-SET
-  `vpc_id` = %(vpc_id)s,
-  `ip_acl_id` = %(ip_acl_id)s
+  `network_id` = IF(
+    EXISTS (
+      SELECT 1
+      FROM `firewall_rules`
+      WHERE
+      (
+        `firewall_rules`.`ip_address_id` = `user_ip_address`.`id`
+        AND
+        `firewall_rules`.`purpose` IN ('PortForwarding', 'LoadBalancing')
+      )
+    ),
+    `network_id`,
+    NULL
+  )
 WHERE
 (
-  `id` = %(public_ip_id)s
+  `network_id` = %(network_id)s
 );
-""" % dict(vpc_id=vpc_id, ip_acl_id=ip_acl_id, public_ip_id=public_ip_id)
+"""
 
         cursor = self.conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, dict(vpc_id=vpc_id, ip_acl_id=ip_acl_id, network_id=network_id))
 
         if self.DEBUG == 1:
             print "DEBUG: Executed SQL: " + cursor.statement
@@ -1108,37 +1590,22 @@ WHERE
         query = """
 UPDATE `ntwk_service_map`
 SET
-  `provider` = 'VpcVirtualRouter'
+  `provider` = IF(`provider` = 'VirtualRouter', 'VpcVirtualRouter', `provider`),
+  `service` = IF(`service` = 'Firewall', 'NetworkACL', `service`)
 WHERE
 (
   `network_id` = %(network_id)s
   AND
-  `provider` = 'VirtualRouter'
-);
-""" % dict(network_id=network_id)
-
-        cursor = self.conn.cursor()
-        cursor.execute(query)
-
-        if self.DEBUG == 1:
-            print "DEBUG: Executed SQL: " + cursor.statement
-
-        cursor.close()
-
-        query = """
-UPDATE `ntwk_service_map`
-SET
-  `service` = 'NetworkACL'
-WHERE
-(
-  `network_id` = %(network_id)s
-  AND
-  `service` = 'Firewall'
+  (
+    `provider` = 'VirtualRouter'
+    OR
+    `service` = 'Firewall'
+  )
 );
-""" % dict(network_id=network_id)
+"""
 
         cursor = self.conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, dict(network_id=network_id))
 
         if self.DEBUG == 1:
             print "DEBUG: Executed SQL: " + cursor.statement
@@ -1199,6 +1666,7 @@ WHERE
         else:
             return False
 
+    @_memoised('vpcofferings')
     def get_vpc_offering_id(self, vpc_offering_name):
         query = """
 SELECT `id`
@@ -1228,6 +1696,7 @@ WHERE
 
         return result[0][0]
 
+    @_memoised('networkofferings')
     def get_network_offering_id(self, network_offering_name):
         query = """
 SELECT `id`
@@ -1326,6 +1795,7 @@ WHERE
         return True
 
 
+    @_memoised('diskofferings')
     def get_disk_offering_id(self, disk_offering_name):
             query = """
                 SELECT id FROM disk_offering_view WHERE removed IS NULL AND domain_name='Cust' AND `name` = '%(disk_offering_name)s';
@@ -1452,6 +1922,7 @@ WHERE
         cursor.close()
         return True
 
+    @_memoised('serviceofferings')
     def get_service_offering_id(self, service_offering_name):
         query = """
         SELECT `id`
@@ -1518,3 +1989,90 @@ WHERE
 
         cursor.close()
         return True
+
+
+# Run query against all databases at the same time, each on its own pooled
+# connection in its own thread. query gets a connected CloudStackSQL and
+# returns an iterable of rows, for instance a method called with stream=True
+# Yields (database, row) for each row as soon as any database sends it, and
+# (database, None) once for a database we cannot connect to
+def fan_out_rows(databases, query, mysqlpassword='', debug=0, dryrun=0):
+    rows = Queue.Queue(STREAM_BACKLOG)
+    done = object()
+
+    def run(database):
+        try:
+            sql = CloudStackSQL(debug, dryrun)
+            if sql.connectMySQL(database, mysqlpassword) > 0:
+                print "Error: MySQL connection to '%s' failed" % database
+                rows.put((database, None))
+                return
+            try:
+                for row in query(sql):
+                    rows.put((database, row))
+            finally:
+                sql.disconnectMySQL()
+        except Exception as e:
+            rows.put((database, e))
+        finally:
+            rows.put((database, done))
+
+    # Daemon threads, so we can exit while a database is still sending rows
+    for database in databases:
+        thread = threading.Thread(target=run, args=(database,), name="SQL " + database)
+        thread.daemon = True
+        thread.start()
+
+    running = len(databases)
+    while running > 0:
+        # A timeout keeps the wait interruptible with Ctrl-C
+        database, row = rows.get(True, 86400)
+        if row is done:
+            running -= 1
+        elif isinstance(row, Exception):
+            raise row
+        else:
+            yield database, row
+
+
+# Yield the rows of an executed unbuffered cursor as they arrive, STREAM_BATCH
+# at a time, and close the cursor at the end
+def _stream(cursor):
+    try:
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+    finally:
+        # Read what we did not use, the connection is unusable until we do
+        try:
+            while cursor.fetchmany(STREAM_BATCH):
+                pass
+        except mysql.connector.Error:
+            pass
+        cursor.close()
+
+
+# WHERE clause and parameter to match column against value in this mode
+def _match(column, value, mode):
+    if mode not in MATCH_MODES:
+        print "Error: Unknown match mode '%s', use one of %s" % (mode, ', '.join(MATCH_MODES))
+        sys.exit(1)
+    if mode == 'exact':
+        return column + " = %s", value
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if mode == 'prefix':
+        return column + " LIKE %s", escaped + '%'
+    return column + " LIKE %s", '%' + escaped + '%'
+
+
+_statsregistered = []
+
+
+# Show the connection wait and query timings at exit, once per process
+def _print_stats_at_exit():
+    if not _statsregistered:
+        _statsregistered.append(True)
+        atexit.register(sqlpool.stats.print_table)
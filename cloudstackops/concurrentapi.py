@@ -0,0 +1,148 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to run many Cosmic/CloudStack API calls at the same time
+#
+# Calls go through the cs library client (exoCsApi), so signing and error
+# handling are the same as for our serial calls. Each call returns a Future.
+# A global limit caps the calls in flight, and per-command limits keep heavy
+# commands like migrations from overloading the management servers.
+
+import sys
+import threading
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except Exception as e:
+    print "Error: Please install futures library to support concurrent API calls: %s" % e
+    print "       pip install futures"
+    sys.exit(1)
+
+# Maximum number of concurrent calls per command, others are only bound by
+# the global limit
+COMMAND_LIMITS = {
+    'migrateVirtualMachine': 4,
+    'migrateVirtualMachineWithVolume': 2,
+    'migrateSystemVm': 2,
+    'migrateVolume': 2,
+    'restartNetwork': 4,
+    'restartVPC': 4,
+}
+
+
+class ConcurrentClient(object):
+    """Run cs API calls concurrently, with a global and per-command limit."""
+
+    # api is a cs.CloudStack client (exoCsApi)
+    def __init__(self, api, workers=8, limits=None, debug=0):
+        self.api = api
+        self.workers = max(1, int(workers))
+        self.limits = dict(COMMAND_LIMITS)
+        if limits is not None:
+            self.limits.update(limits)
+        self.DEBUG = debug
+
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.commandslots = {}
+        self.lock = threading.Lock()
+        # Calls waiting for a per-command slot do not take a global slot, so
+        # we need more threads than global slots
+        self.executor = ThreadPoolExecutor(max_workers=self.workers * 4)
+
+    # Start an API call, returns a Future with the result
+    def call(self, command, **params):
+        return self.executor.submit(self._call, command, params)
+
+    # Start the same command for each set of parameters, returns a list of Futures
+    def map(self, command, paramslist):
+        return [self.call(command, **params) for params in paramslist]
+
+    # Wait for all futures, returns their results in order
+    # Failed calls give the exception instead of a result unless raise_errors is set
+    def gather(self, futures, raise_errors=False):
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if raise_errors:
+                    raise
+                results.append(e)
+        return results
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def _commandslot(self, command):
+        if command not in self.limits:
+            return None
+        with self.lock:
+            if command not in self.commandslots:
+                self.commandslots[command] = threading.BoundedSemaphore(self.limits[command])
+            return self.commandslots[command]
+
+    def _call(self, command, params):
+        commandslot = self._commandslot(command)
+        if commandslot is not None:
+            commandslot.acquire()
+        try:
+            with self.slots:
+                if self.DEBUG == 1:
+                    print "DEBUG: Calling %s %s" % (command, params)
+                return getattr(self.api, command)(**params)
+        finally:
+            if commandslot is not None:
+                commandslot.release()
+
+    # The wrappers we use most, same arguments as the API commands
+    def listVirtualMachines(self, **params):
+        return self.call('listVirtualMachines', **params)
+
+    def listRouters(self, **params):
+        return self.call('listRouters', **params)
+
+    def listHosts(self, **params):
+        return self.call('listHosts', **params)
+
+    def listVolumes(self, **params):
+        return self.call('listVolumes', **params)
+
+    def listStoragePools(self, **params):
+        return self.call('listStoragePools', **params)
+
+    def findHostsForMigration(self, **params):
+        return self.call('findHostsForMigration', **params)
+
+    def migrateVirtualMachine(self, **params):
+        return self.call('migrateVirtualMachine', **params)
+
+    def migrateVirtualMachineWithVolume(self, **params):
+        return self.call('migrateVirtualMachineWithVolume', **params)
+
+    def stopVirtualMachine(self, **params):
+        return self.call('stopVirtualMachine', **params)
+
+    def startVirtualMachine(self, **params):
+        return self.call('startVirtualMachine', **params)
+
+    def restartVPC(self, **params):
+        return self.call('restartVPC', **params)
+
+    def queryAsyncJobResult(self, **params):
+        return self.call('queryAsyncJobResult', **params)
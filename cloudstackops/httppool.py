@@ -0,0 +1,187 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Classes to share one pool of keep-alive HTTP connections between the
+# Marvin and cs API clients
+
+import threading
+import time
+import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from marvin.cloudstackConnection import cloudConnection
+
+import ratelimit
+
+
+class ConnectionStats(object):
+    """Thread-safe counters of HTTP requests and opened connections."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def count_opened(self):
+        with self.lock:
+            self.opened += 1
+
+    # Requests that went over an already open connection
+    def reused(self):
+        with self.lock:
+            return max(0, self.requests - self.opened)
+
+    def as_dict(self):
+        with self.lock:
+            return {'requests': self.requests,
+                    'opened': self.opened,
+                    'reused': max(0, self.requests - self.opened)}
+
+
+# Build a connection pool class that reports to stats
+def _counting_pool(poolcls, stats):
+    basecls = poolcls.ConnectionCls
+
+    class CountingConnection(basecls):
+        def connect(self):
+            stats.count_opened()
+            return basecls.connect(self)
+
+    class CountingPool(poolcls):
+        ConnectionCls = CountingConnection
+
+        def _get_conn(self, timeout=None):
+            stats.count_request()
+            return poolcls._get_conn(self, timeout)
+
+    return CountingPool
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools count requests and new connections."""
+
+    def __init__(self, stats, pool_size=10):
+        self.stats = stats
+        super(CountingHTTPAdapter, self).__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+class PooledSession(requests.Session):
+    """requests Session with a bounded pool of keep-alive connections.
+
+    The cs library wraps every request in 'with session', which would close
+    the pool each time. We only close when explicitly asked to.
+    """
+
+    def __init__(self, pool_size=10, metrics=None, limiter=None):
+        super(PooledSession, self).__init__()
+        self.stats = ConnectionStats()
+        self.metrics = metrics
+        self.limiter = limiter
+        # Set by cassette.install_from_env when recording
+        self.recorder = None
+        adapter = CountingHTTPAdapter(self.stats, pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def __exit__(self, *args):
+        pass
+
+    # Record latency and size per API command when we have metrics, and wait
+    # for the rate limiter when we have one
+    # Both the Marvin and the cs client end up here, so we record here too
+    def send(self, request, **kwargs):
+        if self.metrics is None and self.limiter is None and self.recorder is None:
+            return super(PooledSession, self).send(request, **kwargs)
+
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.time()
+        try:
+            response = super(PooledSession, self).send(request, **kwargs)
+        except Exception as e:
+            self._done(request, start, error=True, overloaded=isinstance(e, (requests.ConnectionError, requests.Timeout)))
+            raise
+
+        if self.recorder is not None:
+            self.recorder.record(request, response, stream=kwargs.get('stream'))
+
+        if kwargs.get('stream') and not response._content_consumed:
+            size = int(response.headers.get('content-length') or 0)
+        else:
+            size = len(response.content)
+        self._done(request, start, size=size, error=response.status_code >= 400,
+                   overloaded=response.status_code in ratelimit.OVERLOAD_STATUS)
+        return response
+
+    def _done(self, request, start, size=0, error=False, overloaded=False):
+        latency = time.time() - start
+        if self.limiter is not None:
+            self.limiter.release(latency, overloaded)
+        if self.metrics is not None:
+            self.metrics.record(_command_name(request), latency, size=size, error=error)
+
+
+# API command name of a prepared request, from the query string or a form body
+def _command_name(request):
+    query = urlparse.urlsplit(request.url).query
+    if isinstance(request.body, basestring):
+        query += '&' + request.body
+    command = urlparse.parse_qs(query).get('command')
+    if command:
+        return command[0]
+    return 'unknown'
+
+
+class PooledCloudConnection(cloudConnection):
+    """Marvin cloudConnection that sends its requests over a shared session."""
+
+    def __init__(self, mgtSvr, session=None, **kwargs):
+        super(PooledCloudConnection, self).__init__(mgtSvr, **kwargs)
+        self.session = session if session is not None else PooledSession()
+
+    def request(self, command, auth=True, payload={}, method='GET', stream=False):
+        payload["command"] = command
+        payload["response"] = "json"
+
+        if auth:
+            payload["apiKey"] = self.apiKey
+            signature = self.sign(payload)
+            payload["signature"] = signature
+
+        try:
+            if method == 'POST':
+                return self.session.post(self.baseurl, params=payload, stream=stream)
+            return self.session.get(self.baseurl, params=payload, stream=stream)
+        except requests.RequestException as e:
+            self.logging.debug("Request to %s failed: %s" % (self.baseurl, e))
+            raise e
@@ -0,0 +1,169 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to keep an in-memory snapshot of the CloudStack inventory
+#
+# Instead of asking the API for the vm's of every host, the volumes of every
+# vm and the offering of every router, the report scripts load each resource
+# type once with a few paginated bulk calls and look things up in memory.
+# Hosts, vm's, routers, volumes and storage pools are kept as compact records.
+
+import sys
+
+
+class Inventory(object):
+    """In-memory snapshot of hosts, vm's, routers, volumes and friends."""
+
+    # Resource types we know how to load: name -> (API command, default arguments)
+    COLLECTIONS = {
+        'hosts': ('listHosts', {'type': 'Routing'}),
+        'virtualmachines': ('listVirtualMachines', {'listAll': 'true'}),
+        'projectvirtualmachines': ('listVirtualMachines', {'listAll': 'true', 'projectid': '-1'}),
+        'routers': ('listRouters', {'listAll': 'true'}),
+        'projectrouters': ('listRouters', {'listAll': 'true', 'projectid': '-1'}),
+        'systemvms': ('listSystemVms', {}),
+        'volumes': ('listVolumes', {'listAll': 'true'}),
+        'projectvolumes': ('listVolumes', {'listAll': 'true', 'projectid': '-1'}),
+        'storagepools': ('listStoragePools', {}),
+        'networks': ('listNetworks', {'listAll': 'true'}),
+        'projectnetworks': ('listNetworks', {'listAll': 'true', 'projectid': '-1'}),
+        'vpcs': ('listVPCs', {'listAll': 'true'}),
+        'projectvpcs': ('listVPCs', {'listAll': 'true', 'projectid': '-1'}),
+        'serviceofferings': ('listServiceOfferings', {}),
+        'systemofferings': ('listServiceOfferings', {'issystem': 'true'}),
+    }
+
+    # Attributes we build a lookup index for, next to the id
+    INDEX_KEYS = ('hostid', 'clusterid', 'virtualmachineid')
+
+    # Offerings are not bound to a zone
+    ZONELESS = ('serviceofferings', 'systemofferings')
+
+    def __init__(self, ops, debug=0):
+        self.ops = ops
+        self.DEBUG = debug
+        self.data = {}
+        self.by_id = {}
+        self.by_key = {}
+
+    # Load one resource type, replacing what we had before
+    def load(self, name, **args):
+        if name not in self.COLLECTIONS:
+            print "Error: Inventory does not know how to load '%s'" % name
+            return False
+
+        command, defaults = self.COLLECTIONS[name]
+        apiargs = dict(defaults)
+        apiargs.update(args)
+        if name in self.ZONELESS:
+            apiargs.pop('zoneid', None)
+            apiargs.pop('podid', None)
+
+        if self.DEBUG == 1:
+            print "DEBUG: Loading inventory '%s' using %s %s" % (name, command, apiargs)
+
+        result = self.ops.listAll(command, apiargs, compact=True)
+        if result == 1:
+            print "Error: Could not load '%s' into the inventory" % name
+            return False
+
+        self._index(name, result or [])
+        return True
+
+    # Use items we got elsewhere (for instance from the database), replacing
+    # what we had before
+    def fill(self, name, items):
+        self._index(name, items)
+        return True
+
+    # Load everything a zone-wide report needs
+    def snapshot(self, zoneid='', collections=None):
+        if collections is None:
+            collections = sorted(self.COLLECTIONS.keys())
+        for name in collections:
+            if not self.load(name, zoneid=zoneid):
+                return False
+        return True
+
+    def _index(self, name, items):
+        self.data[name] = items
+        self.by_id[name] = {}
+        self.by_key[name] = dict((key, {}) for key in self.INDEX_KEYS)
+
+        for item in items:
+            if item.id is not None:
+                self.by_id[name][item.id] = item
+            for key in self.INDEX_KEYS:
+                value = getattr(item, key, None)
+                if value is not None:
+                    self.by_key[name][key].setdefault(value, []).append(item)
+
+        if self.DEBUG == 1:
+            print "DEBUG: Inventory '%s' holds %s items" % (name, len(items))
+
+    def _names(self, names):
+        if isinstance(names, basestring):
+            return (names,)
+        return names
+
+    # Is this resource type loaded?
+    def loaded(self, name):
+        return name in self.data
+
+    # All items of one or more resource types
+    def all(self, names):
+        items = []
+        for name in self._names(names):
+            items += self.data.get(name, [])
+        return items
+
+    # Get a single item by id, looking in one or more resource types
+    def get(self, names, id):
+        for name in self._names(names):
+            if id in self.by_id.get(name, {}):
+                return self.by_id[name][id]
+        return None
+
+    # Get all items where key (hostid, clusterid, virtualmachineid) matches value
+    def find(self, names, key, value):
+        if key not in self.INDEX_KEYS:
+            print "Error: Inventory has no index on '%s'" % key
+            sys.exit(1)
+        items = []
+        for name in self._names(names):
+            items += self.by_key.get(name, {}).get(key, {}).get(value, [])
+        return items
+
+    # Hosts of a cluster, optionally limited to a resource state and state
+    def hosts_in_cluster(self, clusterid, resourcestate=None, state=None):
+        hosts = []
+        for host in self.find('hosts', 'clusterid', clusterid):
+            if resourcestate is not None and host.resourcestate != resourcestate:
+                continue
+            if state is not None and host.state != state:
+                continue
+            hosts.append(host)
+        return hosts
+
+    # Storage usage of a vm in GB, same rounding as calculateVirtualMachineStorageUsage
+    def storage_size(self, vmid, names='volumes'):
+        storageSize = 0
+        for vol in self.find(names, 'virtualmachineid', vmid):
+            storageSize = storageSize + (vol.size / 1024 / 1024 / 1024)
+        return storageSize
@@ -0,0 +1,188 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to wait for many CloudStack async jobs at once
+#
+# One poller thread checks all pending jobs per round, either with a single
+# listAsyncJobs call or with a bounded number of concurrent
+# queryAsyncJobResult calls. The poll interval backs off while nothing
+# finishes and resets as soon as a job completes.
+
+import sys
+import threading
+import time
+
+try:
+    from concurrent.futures import Future, ThreadPoolExecutor
+except Exception as e:
+    print "Error: Please install futures library to support concurrent API calls: %s" % e
+    print "       pip install futures"
+    sys.exit(1)
+
+# jobstatus: 0 = Job still running
+#            1 = Job done successfully
+#            2 = Job has an error
+JOB_PENDING = 0
+JOB_SUCCESS = 1
+JOB_FAILURE = 2
+
+
+class JobWatcher(object):
+    """Poll many async jobs together and complete a future per job."""
+
+    # api is a cs.CloudStack client (exoCsApi)
+    def __init__(self, api, workers=4, interval=1.0, max_interval=10.0, retries=10, use_list=False, debug=0,
+                 metrics=None):
+        self.api = api
+        self.metrics = metrics
+        self.workers = max(1, int(workers))
+        self.min_interval = float(interval)
+        self.max_interval = float(max_interval)
+        self.retries = retries
+        self.use_list = use_list
+        self.DEBUG = debug
+
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.thread = None
+
+    # Start watching a job, returns a Future with the final job result
+    # The callback, if any, is called with the future once the job is done
+    def watch(self, jobid, callback=None):
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        with self.lock:
+            self.jobs[jobid] = {'future': future, 'retries': self.retries}
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="JobWatcher")
+                self.thread.daemon = True
+                self.thread.start()
+
+        return future
+
+    # Wait for all given jobs, returns a dict jobid -> True when successful
+    def wait(self, jobids):
+        futures = dict((jobid, self.watch(jobid)) for jobid in jobids)
+        return dict((jobid, self.succeeded(future)) for jobid, future in futures.iteritems())
+
+    # Did the job of this future finish successfully?
+    def succeeded(self, future):
+        try:
+            return int(future.result()['jobstatus']) == JOB_SUCCESS
+        except Exception as e:
+            if self.DEBUG == 1:
+                print "DEBUG: Job failed: %s" % e
+            return False
+
+    # Number of jobs we are still waiting for
+    def pending(self):
+        with self.lock:
+            return len(self.jobs)
+
+    def _run(self):
+        interval = self.min_interval
+        while True:
+            with self.lock:
+                jobids = self.jobs.keys()
+                if not jobids:
+                    self.thread = None
+                    return
+
+            if self.use_list:
+                results = self._poll_list(jobids)
+            else:
+                results = self._poll_query(jobids)
+
+            finished = 0
+            for jobid, result in results.iteritems():
+                if isinstance(result, Exception):
+                    self._handle_error(jobid, result)
+                elif result is not None and int(result['jobstatus']) != JOB_PENDING:
+                    self._finish(jobid, result=result)
+                    finished += 1
+
+            if finished > 0:
+                interval = self.min_interval
+            else:
+                interval = min(interval * 1.5, self.max_interval)
+
+            if self.DEBUG == 1:
+                print "DEBUG: JobWatcher: %s jobs finished, %s pending, next poll in %.1fs" % (
+                    finished, self.pending(), interval)
+            time.sleep(interval)
+
+    # Query each job, with a bounded number of concurrent calls
+    def _poll_query(self, jobids):
+        futures = dict((jobid, self.executor.submit(self._query, jobid)) for jobid in jobids)
+        return dict((jobid, future.result()) for jobid, future in futures.iteritems())
+
+    def _query(self, jobid):
+        try:
+            return self.api.queryAsyncJobResult(jobid=jobid)
+        except Exception as e:
+            return e
+
+    # One listAsyncJobs call for all jobs, query the ones it does not know
+    def _poll_list(self, jobids):
+        results = {}
+        try:
+            listing = self.api.listAsyncJobs()
+            for job in listing.get('asyncjobs', []):
+                if job['jobid'] in jobids:
+                    results[job['jobid']] = job
+        except Exception as e:
+            if self.DEBUG == 1:
+                print "DEBUG: listAsyncJobs failed, querying jobs one by one: %s" % e
+
+        missing = [jobid for jobid in jobids if jobid not in results]
+        if missing:
+            results.update(self._poll_query(missing))
+        return results
+
+    # Retry on the known transient errors, fail the job otherwise
+    def _handle_error(self, jobid, error):
+        # TODO: @FIXME Temporary fix for Cosmic serialization problem
+        transient = 'multiple JSON fields named jobstatus' in str(error) or 'Connection aborted' in str(error)
+        with self.lock:
+            job = self.jobs.get(jobid)
+            if job is None:
+                return
+            job['retries'] -= 1
+            retry = transient and job['retries'] >= 0
+
+        if retry:
+            if self.DEBUG == 1:
+                print "DEBUG: Retrying job %s after: %s" % (jobid, error)
+            if self.metrics is not None:
+                self.metrics.count_retry('queryAsyncJobResult')
+            return
+        self._finish(jobid, error=error)
+
+    def _finish(self, jobid, result=None, error=None):
+        with self.lock:
+            job = self.jobs.pop(jobid, None)
+        if job is None:
+            return
+        if error is not None:
+            job['future'].set_exception(error)
+        else:
+            job['future'].set_result(result)
@@ -0,0 +1,137 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Decode CloudStack list responses item by item while they arrive
+#
+# A list response looks like {"listvolumesresponse": {"count": 2, "volume":
+# [{...}, {...}]}}. Instead of buffering and parsing it as a whole, we walk
+# the outer objects ourselves and decode each list item with raw_decode as
+# soon as its bytes are in, so memory stays flat whatever the item count.
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+class ListResponseStream(object):
+    """Generator of the items of a list response, read from chunks of bytes.
+
+    After the items are consumed, meta holds the other fields of the
+    response (count, errorcode, errortext) and responsename its name.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.textdecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+        self.meta = {}
+        self.responsename = None
+
+    def __iter__(self):
+        self._expect('{')
+        while not self._next_is('}'):
+            key = self._value()
+            self._expect(':')
+            if key != 'cloudstack-version' and self._peek() == '{':
+                self.responsename = key
+                self._pos_after('{')
+                for item in self._response():
+                    yield item
+            else:
+                self._value()
+            self._skip_comma()
+
+    # Fields of the response object, lists are streamed
+    def _response(self):
+        while not self._next_is('}'):
+            key = self._value()
+            self._expect(':')
+            if self._peek() == '[':
+                self._pos_after('[')
+                while not self._next_is(']'):
+                    yield self._value()
+                    self._skip_comma()
+                self._pos_after(']')
+            else:
+                self.meta[key] = self._value()
+            self._skip_comma()
+        self._pos_after('}')
+
+    # Read more bytes, returns False at the end of the stream
+    def _fill(self):
+        if self.eof:
+            return False
+        # Drop what we consumed, so the buffer only holds the current item
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += self.textdecoder.decode(chunk)
+                return True
+        self.buf += self.textdecoder.decode('', final=True)
+        self.eof = True
+        return False
+
+    # Next non-whitespace character, without consuming it
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON list response")
+
+    def _next_is(self, char):
+        return self._peek() == char
+
+    def _pos_after(self, char):
+        if self._peek() != char:
+            raise ValueError("Expected '%s' at position %s of JSON list response" % (char, self.pos))
+        self.pos += 1
+
+    _expect = _pos_after
+
+    def _skip_comma(self):
+        if self._peek() == ',':
+            self.pos += 1
+
+    # Decode the next complete value
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+# Generator of the items of a list response read from chunks
+def iter_items(chunks):
+    return iter(ListResponseStream(chunks))
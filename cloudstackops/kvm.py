@@ -36,12 +36,16 @@ from fabric.api import (
 )
 
 import sys
-import libvirt
 from xml.etree import ElementTree
 
+from lazyimport import lazy_module
+
 import hypervisor
 from datetime import datetime
 
+# Only needed when we talk to libvirt directly
+libvirt = lazy_module('libvirt', install_hint=("libvirt python bindings", "pip install libvirt-python"))
+
 # Set user/passwd for fabric ssh
 env.user = 'root'
 env.password = 'password'
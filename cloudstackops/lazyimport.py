@@ -0,0 +1,74 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Import heavy dependencies when they are first used
+#
+# Small scripts that only talk to the database should not pay for loading
+# Marvin, its hundreds of command modules, cs, requests and friends.
+
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name, install_hint=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_install_hint'] = install_hint
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            try:
+                module = importlib.import_module(self.__dict__['_name'])
+            except ImportError as e:
+                hint = self.__dict__['_install_hint']
+                if hint is None:
+                    raise
+                print "Error: Please install %s: %s" % (hint[0], e)
+                print "       %s" % hint[1]
+                sys.exit(1)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__dict__['_name']
+
+
+# Lazy module, name is relative to package when given (pass __name__ of a
+# module inside our package to import a sibling)
+def lazy_module(name, package=None, install_hint=None):
+    if package is not None and '.' in package:
+        name = package.rpartition('.')[0] + '.' + name
+    return LazyModule(name, install_hint)
+
+
+# Has this lazy module been imported yet?
+def is_loaded(module):
+    if isinstance(module, LazyModule):
+        return module.__dict__['_module'] is not None
+    return True
@@ -0,0 +1,127 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to record what we ask the API and how long it takes
+#
+# Per API command we count calls, errors and retries, and keep latencies and
+# response sizes. At exit we can write a JSON or CSV summary, and a running
+# script prints the table so far when it receives SIGUSR1.
+
+import csv
+import json
+import math
+import signal
+import threading
+
+from lazyimport import lazy_module
+
+prettytable = lazy_module('prettytable', install_hint=("prettytable library", "pip install prettytable"))
+
+FIELDS = ('command', 'calls', 'errors', 'retries', 'p50', 'p90', 'p99', 'max', 'total', 'bytes')
+
+
+class Metrics(object):
+    """Thread-safe per-command API call statistics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+
+    def _command(self, command):
+        if command not in self.commands:
+            self.commands[command] = {'calls': 0, 'errors': 0, 'retries': 0, 'latencies': [], 'bytes': 0}
+        return self.commands[command]
+
+    # Record one API call, latency in seconds and size in bytes
+    def record(self, command, latency, size=0, error=False):
+        with self.lock:
+            stats = self._command(command)
+            stats['calls'] += 1
+            stats['latencies'].append(latency)
+            stats['bytes'] += size
+            if error:
+                stats['errors'] += 1
+
+    def count_retry(self, command):
+        with self.lock:
+            self._command(command)['retries'] += 1
+
+    # One row per command, busiest first
+    def summary(self):
+        rows = []
+        with self.lock:
+            for command, stats in self.commands.iteritems():
+                latencies = sorted(stats['latencies'])
+                rows.append({
+                    'command': command,
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'p50': _percentile(latencies, 50),
+                    'p90': _percentile(latencies, 90),
+                    'p99': _percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else 0.0,
+                    'total': sum(latencies),
+                    'bytes': stats['bytes'],
+                })
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
+
+    # Write the summary, the format follows the extension (.json or .csv)
+    def write(self, path):
+        try:
+            if path.endswith('.csv'):
+                with open(path, 'wb') as f:
+                    writer = csv.DictWriter(f, fieldnames=FIELDS)
+                    writer.writeheader()
+                    writer.writerows(self.summary())
+            else:
+                with open(path, 'w') as f:
+                    json.dump(self.summary(), f, indent=2)
+        except IOError as e:
+            print "Warning: Could not write API metrics to %s: %s" % (path, e)
+            return False
+        print "Note: API metrics written to %s" % path
+        return True
+
+    def print_table(self):
+        t = prettytable.PrettyTable(["Command", "Calls", "Errors", "Retries", "p50 (s)", "p90 (s)",
+                                     "p99 (s)", "Max (s)", "Total (s)", "KBytes"])
+        t.align["Command"] = "l"
+        for row in self.summary():
+            t.add_row([row['command'], row['calls'], row['errors'], row['retries'],
+                       "%.3f" % row['p50'], "%.3f" % row['p90'], "%.3f" % row['p99'],
+                       "%.3f" % row['max'], "%.1f" % row['total'], row['bytes'] / 1024])
+        print t
+
+    # Print the table so far when we receive SIGUSR1 (kill -USR1 <pid>)
+    def print_on_signal(self, signum=signal.SIGUSR1):
+        try:
+            signal.signal(signum, lambda sig, frame: self.print_table())
+        except ValueError:
+            # Only the main thread can handle signals
+            pass
+
+
+# Nearest-rank percentile of a sorted list
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
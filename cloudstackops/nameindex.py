@@ -0,0 +1,125 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to resolve CloudStack names to UUIDs without listing everything
+#
+# For each API type we list all objects once, remember name -> ids and store
+# that on disk per CloudMonkey profile. Next runs look names up in the stored
+# index until it expires. Names we do not know trigger one rebuild per run.
+
+import json
+import os
+import re
+import threading
+import time
+
+# API calls whose objects we index, these are few and rarely renamed
+INDEXED = ('listClusters', 'listDiskOfferings', 'listDomains', 'listHosts', 'listPods',
+           'listServiceOfferings', 'listStoragePools', 'listTemplates', 'listZones')
+
+
+class NameIndex(object):
+    """Name to UUID index per API type, stored on disk with a time to live."""
+
+    def __init__(self, path, ttl=3600, debug=0):
+        self.path = path
+        self.ttl = int(ttl)
+        self.DEBUG = debug
+        self.lock = threading.Lock()
+        self.index = None
+        self.refreshed = set()
+
+    # Index file for a CloudMonkey profile
+    @staticmethod
+    def path_for_profile(profile, directory=None):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".cloudstackops")
+        return os.path.join(directory, "nameindex-%s.json" % re.sub(r'[^\w.-]', '_', profile))
+
+    def enabled(self):
+        return self.ttl > 0
+
+    # Return the list of ids with this name, or None when we cannot tell
+    # listing() is called to (re)build the index of this type and must
+    # return all objects, or None when that fails
+    def lookup(self, indextype, name, listing):
+        with self.lock:
+            self._load()
+            entry = self.index.get(indextype)
+            fresh = entry is not None and entry['built'] + self.ttl > time.time()
+            if fresh and name in entry['names']:
+                return entry['names'][name]
+
+            # Expired, never built, or an unknown name: rebuild once per run
+            if indextype in self.refreshed:
+                return entry['names'].get(name, []) if entry is not None else None
+
+            items = listing()
+            if items is None:
+                return None
+            entry = self._build(items)
+            self.index[indextype] = entry
+            self.refreshed.add(indextype)
+            self._save()
+
+            if self.DEBUG == 1:
+                print "DEBUG: Rebuilt name index '%s' with %s names" % (indextype, len(entry['names']))
+            return entry['names'].get(name, [])
+
+    # Forget one type, or everything
+    def invalidate(self, indextype=None):
+        with self.lock:
+            self._load()
+            if indextype is None:
+                self.index = {}
+            else:
+                self.index.pop(indextype, None)
+            self._save()
+
+    def _build(self, items):
+        names = {}
+        for item in items:
+            for name in set([item.name, getattr(item, 'instancename', None)]):
+                if name:
+                    names.setdefault(name, []).append(item.id)
+        return {'built': time.time(), 'names': names}
+
+    def _load(self):
+        if self.index is not None:
+            return
+        self.index = {}
+        try:
+            with open(self.path) as f:
+                self.index = json.load(f)
+        except (IOError, ValueError) as e:
+            if self.DEBUG == 1:
+                print "DEBUG: No usable name index at %s: %s" % (self.path, e)
+
+    # Write to a temporary file first, so parallel runs never read half an index
+    def _save(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            tmpfile = "%s.%s.tmp" % (self.path, os.getpid())
+            with open(tmpfile, 'w') as f:
+                json.dump(self.index, f)
+            os.rename(tmpfile, self.path)
+        except (IOError, OSError) as e:
+            print "Warning: Could not save name index to %s: %s" % (self.path, e)
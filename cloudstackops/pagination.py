@@ -0,0 +1,104 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to page through CloudStack list calls
+#
+# The first page tells us the total count, the remaining pages are fetched
+# concurrently by a bounded number of workers and handed out in page order.
+
+import sys
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except Exception as e:
+    print "Error: Please install futures library to support concurrent API calls: %s" % e
+    print "       pip install futures"
+    sys.exit(1)
+
+
+class Paginator(object):
+    """Fetch all pages of a list call, with a bounded number of workers."""
+
+    # fetch(page, pagesize) must return a tuple (count, items) for that page
+    def __init__(self, fetch, pagesize=500, workers=4, debug=0):
+        self.fetch = fetch
+        self.pagesize = int(pagesize)
+        self.workers = max(1, int(workers))
+        self.DEBUG = debug
+
+    # Generator with the items of each page, in page order
+    def pages(self):
+        count, items = self.fetch(1, self.pagesize)
+        yield items
+
+        if not items or len(items) < self.pagesize:
+            return
+
+        # Without a count we can only walk page by page until a short page
+        if count is None:
+            for items in self._serial_pages(2):
+                yield items
+            return
+
+        lastpage = (int(count) + self.pagesize - 1) // self.pagesize
+        if self.DEBUG == 1:
+            print "DEBUG: Fetching %s items in %s pages of %s using %s workers" % (
+                count, lastpage, self.pagesize, self.workers)
+
+        # Keep a window of pages in flight so a lazy consumer does not make us
+        # buffer the whole listing in memory
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        window = self.workers * 2
+        futures = []
+        nextpage = 2
+        try:
+            while nextpage <= lastpage or futures:
+                while nextpage <= lastpage and len(futures) < window:
+                    futures.append(executor.submit(self.fetch, nextpage, self.pagesize))
+                    nextpage += 1
+                count, items = futures.pop(0).result()
+                if items:
+                    yield items
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _serial_pages(self, page):
+        while True:
+            count, items = self.fetch(page, self.pagesize)
+            if not items:
+                return
+            yield items
+            if len(items) < self.pagesize:
+                return
+            page += 1
+
+    # Lazy generator of all items
+    def items(self):
+        for items in self.pages():
+            for item in items:
+                yield item
+
+    # All items merged in one list
+    def all(self):
+        result = []
+        for items in self.pages():
+            result.extend(items)
+        return result
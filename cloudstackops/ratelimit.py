@@ -0,0 +1,108 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Class to adapt the number of concurrent API calls to what the management
+# server can handle
+#
+# Like TCP congestion control (AIMD): every successful, fast call slowly
+# raises the number of calls we allow in flight, a slow call, an overload
+# error or a long queue of pending async jobs halves it.
+
+import threading
+import time
+
+# HTTP status codes that mean the management server is overloaded
+OVERLOAD_STATUS = (429, 502, 503, 504)
+
+
+class AdaptiveRateLimiter(object):
+    """Limit concurrent API calls, adapting the limit with AIMD."""
+
+    def __init__(self, initial=4, minimum=1, maximum=32, target_latency=2.0, decrease=0.5,
+                 max_pending_jobs=50, probe_interval=30, debug=0):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.target_latency = float(target_latency)
+        self.decrease = float(decrease)
+        self.max_pending_jobs = max_pending_jobs
+        self.probe_interval = probe_interval
+        self.DEBUG = debug
+
+        self.condition = threading.Condition()
+        self.inflight = 0
+        self.lastdecrease = 0
+        self.pendingjobs = None
+        self.lastprobe = 0
+
+    # Function returning the number of pending async jobs, None to stop probing
+    def set_pending_jobs_probe(self, probe):
+        self.pendingjobs = probe
+
+    # Wait until we may start another call
+    def acquire(self):
+        self._probe()
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+
+    # A call finished, adapt the limit to how it went
+    def release(self, latency, overloaded=False):
+        with self.condition:
+            self.inflight -= 1
+            if overloaded or latency > self.target_latency:
+                self._decrease("%s call of %.1fs" % ("failed" if overloaded else "slow", latency))
+            else:
+                # Additive increase: about one more slot per window of successful calls
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    def current_limit(self):
+        with self.condition:
+            return int(self.limit)
+
+    # Must hold the condition
+    def _decrease(self, reason):
+        # Decrease at most once per target latency, calls that were already in
+        # flight tell us about the same overload
+        now = time.time()
+        if now - self.lastdecrease < self.target_latency:
+            return
+        self.lastdecrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        if self.DEBUG == 1:
+            print "DEBUG: Rate limiter: %s, allowing %s concurrent calls" % (reason, int(self.limit))
+
+    def _probe(self):
+        if self.pendingjobs is None:
+            return
+        with self.condition:
+            if time.time() - self.lastprobe < self.probe_interval:
+                return
+            self.lastprobe = time.time()
+        try:
+            pending = self.pendingjobs()
+        except Exception as e:
+            if self.DEBUG == 1:
+                print "DEBUG: Rate limiter: could not count pending async jobs: %s" % e
+            return
+        if pending is not None and pending > self.max_pending_jobs:
+            with self.condition:
+                self._decrease("%s pending async jobs" % pending)
@@ -0,0 +1,171 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+# Compact records for large API result sets
+#
+# Marvin turns every item of a response into an object with a __dict__
+# holding all fields the API returned. For a zone with 100k volumes that
+# adds up. These records use __slots__, only keep the fields our scripts read
+# and share repeated values such as states, domains and accounts.
+#
+# Like Marvin objects, fields that were not returned read as None. Fields we
+# do not keep raise AttributeError, so a script reading one fails loudly.
+
+from lazyimport import lazy_module
+
+jsonHelper = lazy_module('marvin.jsonHelper')
+
+# Repeated values (states, domain names, ...) we keep only one copy of, this
+# is emptied when it grows past SHARED_MAX so a long running script does not
+# keep every value it ever saw
+SHARED_MAX = 65536
+_shared = {}
+
+
+class Record(object):
+    """Base class of the compact records, subclasses list their fields in __slots__."""
+
+    __slots__ = ()
+
+    # Fields with few distinct values, shared between records
+    SHARED = ()
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    # Build a record from one item of an API response
+    @classmethod
+    def from_dict(cls, item):
+        record = cls.__new__(cls)
+        for field in cls.__slots__:
+            value = item.get(field)
+            if value is not None:
+                if field in cls.SHARED:
+                    value = _share(value)
+                elif isinstance(value, (dict, list)):
+                    value = _convert(value)
+            setattr(record, field, value)
+        return record
+
+    # Only reached for slots that were never set, those are None
+    def __getattr__(self, attr):
+        if attr in self.__slots__:
+            return None
+        raise AttributeError(attr)
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%s : %r' % (field, getattr(self, field))
+                                  for field in self.__slots__ if getattr(self, field) is not None)
+
+    __str__ = __repr__
+
+
+class HostRecord(Record):
+    __slots__ = ('id', 'name', 'state', 'resourcestate', 'type', 'clusterid', 'clustername', 'podid',
+                 'podname', 'zoneid', 'zonename', 'hypervisor', 'hypervisorversion', 'ipaddress',
+                 'memorytotal', 'memoryused', 'memoryallocated', 'cpunumber', 'cpuallocated',
+                 'hosttags', 'version', 'created')
+    SHARED = ('state', 'resourcestate', 'type', 'clusterid', 'clustername', 'podid', 'podname',
+              'zoneid', 'zonename', 'hypervisor', 'hypervisorversion', 'hosttags', 'version')
+
+
+class VirtualMachineRecord(Record):
+    __slots__ = ('id', 'name', 'displayname', 'instancename', 'state', 'hostid', 'hostname',
+                 'account', 'domain', 'domainid', 'project', 'projectid', 'zoneid', 'zonename',
+                 'memory', 'cpunumber', 'serviceofferingid', 'serviceofferingname', 'templateid',
+                 'templatename', 'templatedisplaytext', 'haenable', 'isoid', 'nic', 'affinitygroup',
+                 'laststartversion', 'created')
+    SHARED = ('state', 'hostid', 'hostname', 'account', 'domain', 'domainid', 'project', 'projectid',
+              'zoneid', 'zonename', 'serviceofferingid', 'serviceofferingname', 'templateid',
+              'templatename', 'templatedisplaytext', 'laststartversion')
+
+
+class RouterRecord(Record):
+    __slots__ = ('id', 'name', 'state', 'hostid', 'hostname', 'podid', 'zoneid', 'zonename',
+                 'account', 'domain', 'domainid', 'project', 'projectid', 'guestnetworkid',
+                 'guestnetworkname', 'vpcid', 'vpcname', 'isredundantrouter', 'redundantstate',
+                 'requiresupgrade', 'version', 'role', 'serviceofferingid', 'templateid',
+                 'linklocalip', 'nic', 'laststartversion', 'created')
+    SHARED = ('state', 'hostid', 'hostname', 'podid', 'zoneid', 'zonename', 'account', 'domain',
+              'domainid', 'project', 'projectid', 'redundantstate', 'version', 'role',
+              'serviceofferingid', 'templateid', 'laststartversion')
+
+
+class VolumeRecord(Record):
+    __slots__ = ('id', 'name', 'path', 'size', 'state', 'type', 'storage', 'storageid',
+                 'virtualmachineid', 'vmname', 'vmdisplayname', 'vmstate', 'account', 'domain',
+                 'domainid', 'project', 'projectid', 'zoneid', 'zonename', 'diskofferingid',
+                 'created')
+    SHARED = ('state', 'type', 'storage', 'storageid', 'vmstate', 'account', 'domain', 'domainid',
+              'project', 'projectid', 'zoneid', 'zonename', 'diskofferingid')
+
+
+class StoragePoolRecord(Record):
+    __slots__ = ('id', 'name', 'state', 'scope', 'type', 'clusterid', 'clustername', 'podid',
+                 'zoneid', 'zonename', 'ipaddress', 'path', 'tags', 'disksizetotal',
+                 'disksizeused', 'disksizeallocated', 'created')
+    SHARED = ('state', 'scope', 'type', 'clusterid', 'clustername', 'podid', 'zoneid', 'zonename',
+              'ipaddress', 'tags')
+
+
+# Offerings and networks (or vpcs) the report scripts look up by id, filled
+# from the database instead of an API call
+class ServiceOfferingRecord(Record):
+    __slots__ = ('id', 'name', 'memory', 'cpunumber')
+
+
+class NetworkRecord(Record):
+    __slots__ = ('id', 'name')
+
+
+# Record type of the items of a list command, if we have one
+FOR_COMMAND = {
+    'listHosts': HostRecord,
+    'listVirtualMachines': VirtualMachineRecord,
+    'listRouters': RouterRecord,
+    'listVolumes': VolumeRecord,
+    'listStoragePools': StoragePoolRecord,
+}
+
+
+# The shared copy of a repeated value
+def _share(value):
+    if len(_shared) >= SHARED_MAX:
+        _shared.clear()
+    return _shared.setdefault(value, value)
+
+
+# Nested values (nics, affinity groups) become Marvin objects, as before
+def _convert(value):
+    if isinstance(value, dict):
+        return jsonHelper.jsonLoader(value)
+    if len(value) > 0 and isinstance(value[0], dict):
+        return [jsonHelper.jsonLoader(item) for item in value]
+    return value
+
+
+# Keep only the given fields of a raw API item, None keeps everything
+def project(item, fields):
+    if fields is None:
+        return item
+    return dict((key, item[key]) for key in fields if key in item)
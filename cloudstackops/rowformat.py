@@ -0,0 +1,95 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+# Write the rows of a report in one of a few formats
+#
+# The table format collects all rows in a PrettyTable and prints it at the
+# end. The plain, csv and jsonl formats print each row as soon as we get it,
+# so the first rows show up while the database is still sending the rest.
+
+import collections
+import csv
+import json
+import sys
+
+from lazyimport import lazy_module
+
+prettytable = lazy_module('prettytable', install_hint=("prettytable library", "pip install prettytable"))
+
+FORMATS = ('table', 'plain', 'csv', 'jsonl')
+
+
+class RowWriter(object):
+    """Print rows right away, or collect them in a table printed by close()."""
+
+    def __init__(self, columns, format='table', sortby=None, align=None, out=None):
+        if format not in FORMATS:
+            print "Error: Unknown output format '%s', use one of %s" % (format, ', '.join(FORMATS))
+            sys.exit(1)
+        self.columns = list(columns)
+        self.format = format
+        self.sortby = sortby
+        self.out = out if out is not None else sys.stdout
+        self.count = 0
+        self.table = None
+        self.csv = None
+
+        if format == 'table':
+            self.table = prettytable.PrettyTable(self.columns)
+            for column, alignment in (align or {}).iteritems():
+                self.table.align[column] = alignment
+        elif format == 'csv':
+            self.csv = csv.writer(self.out)
+
+    # Does this format print rows as they come?
+    def streaming(self):
+        return self.format != 'table'
+
+    def write(self, row):
+        self.count += 1
+        if self.table is not None:
+            self.table.add_row(row)
+            return
+
+        if self.format == 'plain':
+            self.out.write("\t".join(_text(field) for field in row) + "\n")
+        elif self.format == 'csv':
+            if self.count == 1:
+                self.csv.writerow([_text(column) for column in self.columns])
+            self.csv.writerow(['' if field is None else _text(field) for field in row])
+        else:
+            self.out.write(json.dumps(collections.OrderedDict(zip(self.columns, row)), default=unicode) + "\n")
+        self.out.flush()
+
+    # Print the table, streaming formats are done already
+    def close(self):
+        if self.table is None:
+            return
+        if self.sortby is not None:
+            self.out.write(self.table.get_string(sortby=self.sortby) + "\n")
+        else:
+            self.out.write(self.table.get_string() + "\n")
+
+
+# Text of a field, as bytes for the python 2 csv module and stdout
+def _text(field):
+    if isinstance(field, unicode):
+        return field.encode('utf-8')
+    return "%s" % field
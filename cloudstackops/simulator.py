@@ -0,0 +1,685 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+# A stand-in for the CloudStack / Cosmic management server API
+#
+# SyntheticCloud generates zones, clusters, hosts, vm's, routers, system vm's,
+# storage pools and volumes, and answers the API commands we use against
+# them. Async commands (migrations, start/stop, maintenance) become jobs that
+# finish after a simulated duration, when queryAsyncJobResult sees them.
+#
+# Use it in-process by setting CLOUDSTACKOPS_SIMULATOR, e.g.
+#   CLOUDSTACKOPS_SIMULATOR="zones=1,clusters=4,hosts=20,vms=30,jobduration=2" ./listVirtualMachines.py ...
+# or run it on localhost and point a config profile at it:
+#   python cloudstackops/simulator.py --port 8096 --hosts 20 --vms 30
+
+import getopt
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urlparse
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+SIMULATOR_ENV = 'CLOUDSTACKOPS_SIMULATOR'
+
+# Size of the generated cloud, per zone / cluster / host / vm
+DEFAULTS = {
+    'zones': 1,
+    'clusters': 2,
+    'hosts': 10,
+    'vms': 20,
+    'volumes': 2,
+    'jobduration': 1.0,
+    'pagesize': 500,
+    'seed': 42,
+}
+
+GB = 1024 * 1024 * 1024
+CREATED = '2016-01-01T00:00:00+0100'
+HOST_MEMORY = 256 * GB
+
+# CloudStack error codes
+PARAM_ERROR = 431
+UNSUPPORTED_ACTION_ERROR = 432
+INTERNAL_ERROR = 530
+
+# jobstatus values, as in jobwatcher.py
+JOB_PENDING = 0
+JOB_SUCCESS = 1
+JOB_FAILURE = 2
+
+# List command -> (collection, key of the items in the response)
+LISTS = {
+    'listZones': ('zones', 'zone'),
+    'listPods': ('pods', 'pod'),
+    'listClusters': ('clusters', 'cluster'),
+    'listHosts': ('hosts', 'host'),
+    'listStoragePools': ('storagepools', 'storagepool'),
+    'listVirtualMachines': ('virtualmachines', 'virtualmachine'),
+    'listRouters': ('routers', 'router'),
+    'listSystemVms': ('systemvms', 'systemvm'),
+    'listVolumes': ('volumes', 'volume'),
+    'listServiceOfferings': ('serviceofferings', 'serviceoffering'),
+    'listOsTypes': ('ostypes', 'ostype'),
+    'listOsCategories': ('oscategories', 'oscategory'),
+    'listDomains': ('domains', 'domain'),
+    'listConfigurations': ('configurations', 'configuration'),
+    'listNetworks': ('networks', 'network'),
+    'listTemplates': ('templates', 'template'),
+    'listVPCs': ('vpcs', 'vpc'),
+    # No dedicated hosts in the simulated cloud
+    'listDedicatedHosts': ('dedicatedhosts', 'dedicatedhost'),
+}
+
+# Parameters we filter list results on, when the items have that field
+FILTERS = ('id', 'name', 'zoneid', 'podid', 'clusterid', 'hostid', 'storageid', 'virtualmachineid', 'type',
+           'state', 'resourcestate', 'role', 'domainid', 'issystem', 'vpcid', 'guestnetworkid', 'oscategoryid')
+
+
+class SimulatorError(Exception):
+    """An API error we answer with, like the management server would."""
+
+    def __init__(self, errorcode, errortext):
+        Exception.__init__(self, errortext)
+        self.errorcode = errorcode
+        self.errortext = errortext
+
+
+class SyntheticCloud(object):
+    """Generated inventory plus the API commands that act on it."""
+
+    def __init__(self, zones=1, clusters=2, hosts=10, vms=20, volumes=2, jobduration=1.0, pagesize=500,
+                 seed=42, debug=0):
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.jobduration = float(jobduration)
+        self.pagesize = int(pagesize)
+        self.DEBUG = debug
+        self.data = dict((collection, []) for collection, key in LISTS.values())
+        self.by_id = {}
+        self.collection_of = {}
+        self.jobs = {}
+        self.counter = 0
+        self._generate(int(zones), int(clusters), int(hosts), int(vms), int(volumes))
+
+    # Build a cloud from a spec like "zones=1,hosts=20,vms=30"
+    @classmethod
+    def from_spec(cls, spec, debug=0):
+        settings = {}
+        for part in spec.split(','):
+            if not part.strip():
+                continue
+            key, _, value = part.partition('=')
+            key = key.strip().lower()
+            if key not in DEFAULTS:
+                raise ValueError("unknown simulator setting '%s', use one of %s" % (key, ', '.join(sorted(DEFAULTS))))
+            settings[key] = float(value) if key == 'jobduration' else int(value)
+        return cls(debug=debug, **settings)
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def _number(self):
+        self.counter += 1
+        return self.counter
+
+    def _add(self, collection, item):
+        self.data[collection].append(item)
+        self.by_id[item['id']] = item
+        self.collection_of[item['id']] = collection
+        return item
+
+    def _generate(self, zones, clusters, hosts, vms, volumes):
+        domain = self._add('domains', {'id': self._uuid(), 'name': 'ROOT', 'path': 'ROOT', 'level': 0})
+        self._add('configurations', {'id': self._uuid(), 'name': 'default.page.size', 'value': str(self.pagesize),
+                                     'category': 'Advanced'})
+        category = self._add('oscategories', {'id': self._uuid(), 'name': 'CentOS'})
+        ostypes = [self._add('ostypes', {'id': self._uuid(), 'description': 'CentOS 7 (%s)' % bits,
+                                         'oscategoryid': category['id']}) for bits in ('32-bit', '64-bit')]
+        # Os types rebalanceOSTypesOnCluster.py looks for, no vm's use them
+        for name, description in (('Windows', 'Windows Server 2012 R2 (64-bit)'),
+                                  ('RedHat', 'Red Hat Enterprise Linux 7')):
+            self._add('ostypes', {'id': self._uuid(), 'description': description,
+                                  'oscategoryid': self._add('oscategories', {'id': self._uuid(), 'name': name})['id']})
+        template = self._add('templates', {
+            'id': self._uuid(), 'name': 'CentOS 7', 'displaytext': 'CentOS 7 (simulated)', 'ostypeid': ostypes[1]['id'],
+            'ostypename': ostypes[1]['description'], 'isready': True, 'templatetype': 'USER', 'hypervisor': 'KVM',
+            'format': 'QCOW2', 'size': 20 * GB})
+        offerings = [self._add('serviceofferings', {
+            'id': self._uuid(), 'name': 'Simulated %s GB' % memory, 'memory': memory * 1024, 'cpunumber': cpu,
+            'cpuspeed': 2000, 'issystem': False, 'offerha': True, 'storagetype': 'shared'})
+            for memory, cpu in ((1, 1), (2, 2), (4, 2), (8, 4), (16, 8))]
+        routeroffering = self._add('serviceofferings', {
+            'id': self._uuid(), 'name': 'System Offering For Software Router', 'memory': 256, 'cpunumber': 1,
+            'cpuspeed': 500, 'issystem': True, 'systemvmtype': 'domainrouter', 'storagetype': 'shared'})
+
+        for z in range(1, zones + 1):
+            zone = self._add('zones', {'id': self._uuid(), 'name': 'zone%s' % z, 'allocationstate': 'Enabled',
+                                       'networktype': 'Advanced'})
+            pod = self._add('pods', {'id': self._uuid(), 'name': 'zone%s-pod1' % z, 'zoneid': zone['id'],
+                                     'zonename': zone['name'], 'allocationstate': 'Enabled'})
+
+            systemvms = [self._systemvm(kind, zone, pod) for kind in ('s', 'v')]
+
+            for c in range(1, clusters + 1):
+                cluster = self._add('clusters', {
+                    'id': self._uuid(), 'name': 'zone%s-cluster%s' % (z, c), 'zoneid': zone['id'],
+                    'zonename': zone['name'], 'podid': pod['id'], 'podname': pod['name'], 'hypervisortype': 'KVM',
+                    'clustertype': 'CloudManaged', 'allocationstate': 'Enabled', 'managedstate': 'Managed'})
+                pool = self._add('storagepools', {
+                    'id': self._uuid(), 'name': '%s-pool1' % cluster['name'], 'zoneid': zone['id'],
+                    'zonename': zone['name'], 'podid': pod['id'], 'clusterid': cluster['id'],
+                    'clustername': cluster['name'], 'type': 'NetworkFilesystem', 'scope': 'CLUSTER',
+                    'state': 'Up', 'ipaddress': '10.%s.%s.250' % (z, c), 'path': '/export/%s' % cluster['name'],
+                    'disksizetotal': 100 * 1024 * GB, 'disksizeallocated': 0, 'disksizeused': 0, 'tags': ''})
+
+                for h in range(1, hosts + 1):
+                    host = self._add('hosts', {
+                        'id': self._uuid(), 'name': '%s-kvm%s' % (cluster['name'], h), 'type': 'Routing',
+                        'state': 'Up', 'resourcestate': 'Enabled', 'hypervisor': 'KVM', 'version': '4.11',
+                        'zoneid': zone['id'], 'zonename': zone['name'], 'podid': pod['id'], 'podname': pod['name'],
+                        'clusterid': cluster['id'], 'clustername': cluster['name'], 'clustertype': 'CloudManaged',
+                        'ipaddress': '10.%s.%s.%s' % (z, c, h), 'cpunumber': 32, 'cpuspeed': 2600,
+                        'memorytotal': HOST_MEMORY, 'memoryallocated': 0, 'memoryused': 0, 'hosttags': ''})
+
+                    # Every 50 vm's share a network with a redundant router pair
+                    for v in range(vms):
+                        if v % 50 == 0:
+                            network = self._network(zone, domain)
+                            for state in ('MASTER', 'BACKUP'):
+                                self._router(zone, pod, host, network, routeroffering, pool, state)
+                        self._vm(zone, host, network, self.random.choice(offerings), template, domain, pool,
+                                 volumes)
+                    for systemvm in systemvms:
+                        if systemvm['hostid'] is None:
+                            self._place(systemvm, host)
+
+                    # Leave room to migrate, however many vm's we put on a host
+                    host['memorytotal'] = max(HOST_MEMORY, host['memoryallocated'] * 3 // 2)
+
+    def _vm(self, zone, host, network, offering, template, domain, pool, volumes):
+        number = self._number()
+        vm = self._add('virtualmachines', {
+            'id': self._uuid(), 'name': 'vm%s' % number, 'displayname': 'vm%s' % number,
+            'instancename': 'i-2-%s-VM' % number, 'state': 'Running', 'haenable': True,
+            'maintenancepolicy': 'LiveMigrate', 'zoneid': zone['id'], 'zonename': zone['name'],
+            'serviceofferingid': offering['id'], 'serviceofferingname': offering['name'],
+            'memory': offering['memory'], 'cpunumber': offering['cpunumber'], 'cpuspeed': offering['cpuspeed'],
+            'guestosid': template['ostypeid'], 'templateid': template['id'], 'templatename': template['name'],
+            'templatedisplaytext': template['displaytext'], 'created': CREATED, 'domainid': domain['id'], 'domain': domain['name'], 'account': 'admin',
+            'hypervisor': 'KVM', 'nic': [self._nic(network, number)]})
+        self._place(vm, host)
+
+        for v in range(volumes):
+            self._add('volumes', {
+                'id': self._uuid(), 'name': 'ROOT-%s' % number if v == 0 else 'DATA-%s-%s' % (number, v),
+                'type': 'ROOT' if v == 0 else 'DATADISK', 'deviceid': v, 'size': 20 * GB if v == 0 else 100 * GB,
+                'state': 'Ready', 'zoneid': zone['id'], 'zonename': zone['name'], 'domainid': domain['id'],
+                'storageid': pool['id'], 'storage': pool['name'], 'storagetype': 'shared', 'path': self._uuid(),
+                'virtualmachineid': vm['id'], 'vmname': vm['name'], 'vmdisplayname': vm['name'],
+                'vmstate': vm['state']})
+            pool['disksizeallocated'] += 20 * GB if v == 0 else 100 * GB
+        return vm
+
+    def _nic(self, network, number):
+        return {'id': self._uuid(), 'networkid': network['id'], 'networkname': network['name'],
+                'ipaddress': '10.%s.%s.%s' % (number // 65536 % 256, number // 256 % 256, number % 256),
+                'macaddress': '02:00:%02x:%02x:%02x:%02x' % (number >> 24 & 255, number >> 16 & 255,
+                                                            number >> 8 & 255, number & 255),
+                'isdefault': True, 'type': 'Isolated', 'traffictype': 'Guest'}
+
+    def _network(self, zone, domain):
+        number = len(self.data['networks']) + 1
+        return self._add('networks', {
+            'id': self._uuid(), 'name': 'network%s' % number, 'zoneid': zone['id'], 'zonename': zone['name'],
+            'state': 'Implemented', 'type': 'Isolated', 'domainid': domain['id'], 'account': 'admin',
+            'cidr': '10.%s.%s.0/24' % (number // 256 % 256, number % 256), 'redundantrouter': True})
+
+    def _router(self, zone, pod, host, network, offering, pool, redundantstate):
+        number = self._number()
+        router = self._add('routers', {
+            'id': self._uuid(), 'name': 'r-%s-VM' % number, 'state': 'Running', 'role': 'VIRTUAL_ROUTER',
+            'zoneid': zone['id'], 'zonename': zone['name'], 'podid': pod['id'], 'serviceofferingid': offering['id'],
+            'serviceofferingname': offering['name'], 'memory': offering['memory'], 'guestnetworkid': network['id'],
+            'guestnetworkname': network['name'], 'isredundantrouter': True, 'redundantstate': redundantstate,
+            'requiresupgrade': False, 'version': '4.11', 'account': 'admin', 'domain': 'ROOT', 'created': CREATED,
+            'instancename': 'r-%s-VM' % number, 'templatedisplaytext': 'SystemVM Template (KVM)',
+            'linklocalip': '169.254.%s.%s' % (number // 256 % 256, number % 256), 'nic': [self._nic(network, number)]})
+        self._place(router, host)
+        self._add('volumes', {
+            'id': self._uuid(), 'name': 'ROOT-%s' % number, 'type': 'ROOT', 'deviceid': 0, 'size': 2 * GB,
+            'state': 'Ready', 'zoneid': zone['id'], 'storageid': pool['id'], 'storage': pool['name'],
+            'path': self._uuid(), 'virtualmachineid': router['id'], 'vmname': router['name'],
+            'vmstate': router['state']})
+        return router
+
+    def _systemvm(self, kind, zone, pod):
+        number = self._number()
+        return self._add('systemvms', {
+            'id': self._uuid(), 'name': '%s-%s-VM' % (kind, number), 'state': 'Running', 'zoneid': zone['id'],
+            'zonename': zone['name'], 'podid': pod['id'],
+            'systemvmtype': 'secondarystoragevm' if kind == 's' else 'consoleproxy', 'memory': 1024,
+            'hostid': None, 'hostname': None})
+
+    # Put a vm on a host, keeping the memory accounting of both hosts right
+    def _place(self, vm, host):
+        old = self.by_id.get(vm.get('hostid'))
+        if old is not None:
+            old['memoryallocated'] -= vm.get('memory', 0) * 1024 * 1024
+            old['memoryused'] = old['memoryallocated']
+        vm['hostid'] = host['id'] if host else None
+        vm['hostname'] = host['name'] if host else None
+        if host is not None:
+            host['memoryallocated'] += vm.get('memory', 0) * 1024 * 1024
+            host['memoryused'] = host['memoryallocated']
+
+    # Answer one API call, returns the HTTP status and the response
+    def handle(self, params):
+        command = params.get('command', '')
+        responsename = command.lower() + 'response'
+        if self.DEBUG == 1:
+            print "DEBUG: Simulator: %s" % params
+
+        try:
+            with self.lock:
+                if command in LISTS:
+                    result = self._list(command, params)
+                else:
+                    method = getattr(self, 'api_' + command, None)
+                    if method is None:
+                        raise SimulatorError(UNSUPPORTED_ACTION_ERROR,
+                                             "The given command does not exist or it is not available for user")
+                    result = method(params)
+            return 200, {responsename: result}
+        except SimulatorError as e:
+            return e.errorcode, {responsename: {'errorcode': e.errorcode, 'errortext': e.errortext,
+                                                'uuidList': [], 'cserrorcode': 9999}}
+
+    def _get(self, collection, id, what):
+        item = self.by_id.get(id)
+        if item is None or self.collection_of[id] != collection:
+            raise SimulatorError(PARAM_ERROR, "Unable to find %s with id %s" % (what, id))
+        return item
+
+    def _required(self, params, name):
+        if not params.get(name):
+            raise SimulatorError(PARAM_ERROR, "Unable to execute API command due to missing parameter %s" % name)
+        return params[name]
+
+    def _list(self, command, params):
+        collection, key = LISTS[command]
+        # No projects in the simulated cloud
+        if params.get('projectid'):
+            return {}
+
+        # Like CloudStack, only list system offerings when asked for
+        if command == 'listServiceOfferings':
+            params = dict(params, issystem=params.get('issystem') or 'false')
+
+        items = self.data[collection]
+        for name in FILTERS:
+            if name in params:
+                value = params[name]
+                items = [item for item in items if name not in item or str(item[name]).lower() == value.lower()]
+        if params.get('networkid'):
+            items = [item for item in items if item.get('guestnetworkid') == params['networkid'] or
+                     params['networkid'] in [nic['networkid'] for nic in item.get('nic', [])]]
+        if params.get('keyword'):
+            items = [item for item in items
+                     if params['keyword'] in item.get('name', item.get('description', ''))]
+
+        count = len(items)
+        if params.get('page'):
+            page = int(params['page'])
+            pagesize = min(int(params.get('pagesize') or self.pagesize), self.pagesize)
+            items = items[(page - 1) * pagesize:page * pagesize]
+        if not items:
+            return {}
+        return {'count': count, key: items}
+
+    def api_listCapabilities(self, params):
+        return {'capability': {'cloudstackversion': '4.11.0-simulator', 'apilimitmax': 0}}
+
+    # Hosts in the same cluster we could live migrate this vm to
+    def api_findHostsForMigration(self, params):
+        vm = self._vm_or_router(self._required(params, 'virtualmachineid'))
+        current = self.by_id[vm['hostid']]
+        hosts = []
+        for host in self.data['hosts']:
+            if host['clusterid'] != current['clusterid'] or host['id'] == current['id']:
+                continue
+            suitable = host['resourcestate'] == 'Enabled' and host['state'] == 'Up' and \
+                host['memoryallocated'] + vm['memory'] * 1024 * 1024 <= host['memorytotal']
+            hosts.append(dict(host, suitableformigration=suitable, requiresStorageMotion=False))
+        return {'count': len(hosts), 'host': hosts}
+
+    def _vm_or_router(self, id):
+        if self.collection_of.get(id) in ('virtualmachines', 'routers', 'systemvms'):
+            return self.by_id[id]
+        raise SimulatorError(PARAM_ERROR, "Unable to find virtual machine with id %s" % id)
+
+    # Async jobs: the action runs when a poll sees the job is done
+    def _job(self, command, resultkey, item, action):
+        jobid = self._uuid()
+        self.jobs[jobid] = {
+            'jobid': jobid, 'cmd': command, 'created': time.time(),
+            'duration': self.jobduration * self.random.uniform(0.5, 1.5),
+            'resultkey': resultkey, 'item': item, 'action': action,
+            'jobstatus': JOB_PENDING, 'jobresult': None}
+        return {'jobid': jobid, 'id': item['id'] if item else None}
+
+    def _progress(self, job):
+        if job['jobstatus'] != JOB_PENDING or time.time() - job['created'] < job['duration']:
+            return
+        try:
+            if job['action'] is not None:
+                job['action']()
+            job['jobstatus'] = JOB_SUCCESS
+            if job['resultkey'] is not None:
+                job['jobresult'] = {job['resultkey']: dict(job['item'])}
+            else:
+                job['jobresult'] = {'success': True}
+        except SimulatorError as e:
+            job['jobstatus'] = JOB_FAILURE
+            job['jobresult'] = {'errorcode': e.errorcode, 'errortext': e.errortext}
+
+    def _jobresponse(self, job):
+        response = {'jobid': job['jobid'], 'cmd': job['cmd'], 'jobstatus': job['jobstatus'],
+                    'jobprocstatus': 0, 'jobresultcode': 0 if job['jobstatus'] != JOB_FAILURE else INTERNAL_ERROR,
+                    'jobresulttype': 'object', 'created': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                                                        time.localtime(job['created']))}
+        if job['jobresult'] is not None:
+            response['jobresult'] = job['jobresult']
+        return response
+
+    def api_queryAsyncJobResult(self, params):
+        job = self.jobs.get(self._required(params, 'jobid'))
+        if job is None:
+            raise SimulatorError(PARAM_ERROR, "Unable to find async job with id %s" % params['jobid'])
+        self._progress(job)
+        return self._jobresponse(job)
+
+    def api_listAsyncJobs(self, params):
+        jobs = []
+        for job in self.jobs.values():
+            self._progress(job)
+            jobs.append(self._jobresponse(job))
+        if not jobs:
+            return {}
+        return {'count': len(jobs), 'asyncjobs': jobs}
+
+    def _migrate(self, command, resultkey, params):
+        vm = self._vm_or_router(self._required(params, 'virtualmachineid'))
+        host = self._get('hosts', self._required(params, 'hostid'), 'host')
+        if vm['state'] != 'Running':
+            raise SimulatorError(PARAM_ERROR, "VM is not Running, unable to migrate the vm %s" % vm['name'])
+        return self._job(command, resultkey, vm, lambda: self._place(vm, host))
+
+    def api_migrateVirtualMachine(self, params):
+        return self._migrate('org.apache.cloudstack.api.command.admin.vm.MigrateVMCmd', 'virtualmachine', params)
+
+    def api_migrateVirtualMachineWithVolume(self, params):
+        return self._migrate('org.apache.cloudstack.api.command.admin.vm.MigrateVirtualMachineWithVolumeCmd',
+                             'virtualmachine', params)
+
+    def api_migrateSystemVm(self, params):
+        return self._migrate('org.apache.cloudstack.api.command.admin.systemvm.MigrateSystemVMCmd', 'systemvm',
+                             params)
+
+    def api_migrateVolume(self, params):
+        volume = self._get('volumes', self._required(params, 'volumeid'), 'volume')
+        pool = self._get('storagepools', self._required(params, 'storageid'), 'storage pool')
+
+        def move():
+            volume['storageid'] = pool['id']
+            volume['storage'] = pool['name']
+        return self._job('org.apache.cloudstack.api.command.user.volume.MigrateVolumeCmd', 'volume', volume, move)
+
+    def _power(self, command, collection, resultkey, params, state):
+        vm = self._get(collection, self._required(params, 'id'), 'virtual machine')
+        host = self.by_id.get(params.get('hostid') or vm.get('lasthostid') or vm.get('hostid'))
+
+        def change():
+            if state == 'Stopped':
+                vm['lasthostid'] = vm['hostid']
+                self._place(vm, None)
+            elif vm.get('hostid') is None:
+                self._place(vm, host)
+            vm['state'] = state
+            for volume in self.data['volumes']:
+                if volume.get('virtualmachineid') == vm['id']:
+                    volume['vmstate'] = state
+        return self._job(command, resultkey, vm, change)
+
+    def api_stopVirtualMachine(self, params):
+        return self._power('org.apache.cloudstack.api.command.user.vm.StopVMCmd', 'virtualmachines',
+                           'virtualmachine', params, 'Stopped')
+
+    def api_startVirtualMachine(self, params):
+        return self._power('org.apache.cloudstack.api.command.user.vm.StartVMCmd', 'virtualmachines',
+                           'virtualmachine', params, 'Running')
+
+    def api_rebootVirtualMachine(self, params):
+        return self._power('org.apache.cloudstack.api.command.user.vm.RebootVMCmd', 'virtualmachines',
+                           'virtualmachine', params, 'Running')
+
+    def api_stopRouter(self, params):
+        return self._power('org.apache.cloudstack.api.command.admin.router.StopRouterCmd', 'routers', 'router',
+                           params, 'Stopped')
+
+    def api_startRouter(self, params):
+        return self._power('org.apache.cloudstack.api.command.admin.router.StartRouterCmd', 'routers', 'router',
+                           params, 'Running')
+
+    def api_rebootRouter(self, params):
+        return self._power('org.apache.cloudstack.api.command.admin.router.RebootRouterCmd', 'routers', 'router',
+                           params, 'Running')
+
+    def api_rebootSystemVm(self, params):
+        return self._power('org.apache.cloudstack.api.command.admin.systemvm.RebootSystemVmCmd', 'systemvms',
+                           'systemvm', params, 'Running')
+
+    # Maintenance moves the running vm's to the other enabled hosts of the cluster
+    def api_prepareHostForMaintenance(self, params):
+        host = self._get('hosts', self._required(params, 'id'), 'host')
+        host['resourcestate'] = 'PrepareForMaintenance'
+
+        def evacuate():
+            targets = [h for h in self.data['hosts'] if h['clusterid'] == host['clusterid'] and
+                       h['id'] != host['id'] and h['resourcestate'] == 'Enabled' and h['state'] == 'Up']
+            for collection in ('virtualmachines', 'routers', 'systemvms'):
+                for vm in self.data[collection]:
+                    if vm.get('hostid') != host['id']:
+                        continue
+                    if not targets:
+                        host['resourcestate'] = 'ErrorInMaintenance'
+                        raise SimulatorError(INTERNAL_ERROR, "No hosts to migrate vm %s to" % vm['name'])
+                    self._place(vm, min(targets, key=lambda h: h['memoryallocated']))
+            host['resourcestate'] = 'Maintenance'
+        return self._job('com.cloud.api.commands.PrepareForMaintenanceCmd', 'host', host, evacuate)
+
+    def api_cancelHostMaintenance(self, params):
+        host = self._get('hosts', self._required(params, 'id'), 'host')
+
+        def enable():
+            host['resourcestate'] = 'Enabled'
+        return self._job('com.cloud.api.commands.CancelMaintenanceCmd', 'host', host, enable)
+
+    def api_updateHost(self, params):
+        host = self._get('hosts', self._required(params, 'id'), 'host')
+        if 'hosttags' in params:
+            host['hosttags'] = params['hosttags']
+        if params.get('allocationstate') == 'Disable':
+            host['resourcestate'] = 'Disabled'
+        elif params.get('allocationstate') == 'Enable':
+            host['resourcestate'] = 'Enabled'
+        return {'host': host}
+
+    def api_listAffinityGroups(self, params):
+        return {}
+
+
+class SimulatorAdapter(BaseAdapter):
+    """requests adapter that answers from a SyntheticCloud, in-process."""
+
+    def __init__(self, cloud):
+        super(SimulatorAdapter, self).__init__()
+        self.cloud = cloud
+
+    def send(self, request, **kwargs):
+        status, result = self.cloud.handle(request_params(request.url, request.body))
+        body = json.dumps(result)
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json; charset=UTF-8',
+                                                'Content-Length': str(len(body))})
+        response.encoding = 'utf-8'
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+# API parameters of a request, from the query string and a form body
+def request_params(url, body=None):
+    query = urlparse.urlsplit(url).query
+    if isinstance(body, basestring):
+        query += '&' + body
+    return dict(urlparse.parse_qsl(query, keep_blank_values=True))
+
+
+# Answer API calls of this session from a simulated cloud, when asked for in
+# the environment. Returns the cloud, or None
+def install_from_env(session, environ=None, debug=0):
+    if environ is None:
+        environ = os.environ
+    spec = environ.get(SIMULATOR_ENV)
+    if spec is None:
+        return None
+
+    try:
+        cloud = SyntheticCloud.from_spec(spec, debug=debug)
+    except ValueError as e:
+        print "Error: Invalid %s '%s': %s" % (SIMULATOR_ENV, spec, e)
+        sys.exit(1)
+    adapter = SimulatorAdapter(cloud)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return cloud
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cloud = None
+
+    def log_message(self, format, *args):
+        if self.cloud.DEBUG == 1:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self._answer(request_params(self.path))
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self._answer(request_params(self.path, self.rfile.read(length)))
+
+    def _answer(self, params):
+        status, result = self.cloud.handle(params)
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SimulatorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# Serve a simulated cloud on localhost, in a background thread
+def serve(cloud, port=8096, address='127.0.0.1'):
+    class Handler(SimulatorHandler):
+        pass
+    Handler.cloud = cloud
+
+    server = SimulatorServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="Simulator")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv):
+    settings = dict(DEFAULTS)
+    port = 8096
+    debug = 0
+    help = "Usage: " + os.path.basename(__file__) + " [--port 8096] [--zones N] [--clusters N] [--hosts N]" + \
+        " [--vms N] [--volumes N] [--job-duration SECONDS] [--page-size N] [--seed N] [--debug]"
+    try:
+        opts, args = getopt.getopt(argv, "h", ["port=", "zones=", "clusters=", "hosts=", "vms=", "volumes=",
+                                              "job-duration=", "page-size=", "seed=", "debug"])
+    except getopt.GetoptError as e:
+        print "Error: " + str(e)
+        print help
+        return 2
+    for opt, arg in opts:
+        if opt == "-h":
+            print help
+            return 0
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--job-duration":
+            settings['jobduration'] = float(arg)
+        elif opt == "--page-size":
+            settings['pagesize'] = int(arg)
+        elif opt == "--debug":
+            debug = 1
+        else:
+            settings[opt[2:]] = int(arg)
+
+    cloud = SyntheticCloud(debug=debug, **settings)
+    print "Note: Simulating %s hosts, %s vm's, %s routers and %s volumes on http://127.0.0.1:%s/client/api" % (
+        len(cloud.data['hosts']), len(cloud.data['virtualmachines']), len(cloud.data['routers']),
+        len(cloud.data['volumes']), port)
+    server = serve(cloud, port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+#      Copyright 2015, Schuberg Philis BV
+#
+#      Licensed to the Apache Software Foundation (ASF) under one
+#      or more contributor license agreements.  See the NOTICE file
+#      distributed with this work for additional information
+#      regarding copyright ownership.  The ASF licenses this file
+#      to you under the Apache License, Version 2.0 (the
+#      "License"); you may not use this file except in compliance
+#      with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#      Unless required by applicable law or agreed to in writing,
+#      software distributed under the License is distributed on an
+#      "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#      KIND, either express or implied.  See the License for the
+#      specific language governing permissions and limitations
+#      under the License.
+
+
+# Pooled MySQL connections for CloudStackSQL
+#
+# The config file is parsed once per process. Connections come from one
+# mysql.connector pool per config section (or host), are checked before we
+# hand them out, and go back to the pool on close. We keep timings of the
+# wait for a connection and of every query.
+
+import ConfigParser
+import os
+import sys
+import threading
+import time
+
+import mysql.connector
+import mysql.connector.pooling
+
+import metrics
+
+# How long to wait for a free connection when the pool is exhausted
+POOL_WAIT = 30.0
+
+# Largest pool mysql.connector allows
+MAX_POOL_SIZE = mysql.connector.pooling.CNX_POOL_MAXSIZE
+
+# Connection wait and query timings of this process
+stats = metrics.Metrics()
+
+_lock = threading.Lock()
+_configs = {}
+_pools = {}
+
+
+# Parsed config file, read once per process
+def read_config(path=None):
+    if path is None:
+        path = os.getcwd() + '/config'
+    with _lock:
+        if path not in _configs:
+            config = ConfigParser.RawConfigParser()
+            config.read(path)
+            _configs[path] = config
+        return _configs[path]
+
+
+# Pool size from the [cloudstackOps] section, if set
+# The pool opens all its connections at once, so keep this small
+def pool_size(config):
+    try:
+        return max(1, config.getint('cloudstackOps', 'sql_pool_size'))
+    except:
+        return 2
+
+
+# mysql.connector only allows a limited set of characters in pool names
+def _pool_name(key):
+    name = ''.join(c if c.isalnum() or c in '._:-*$#' else '_' for c in key)
+    return name[:mysql.connector.pooling.CNX_POOL_MAXNAMESIZE]
+
+
+def _pool(key, dbconfig, size):
+    if size > MAX_POOL_SIZE:
+        print "Warning: MySQL pools hold at most %s connections, not %s" % (MAX_POOL_SIZE, size)
+        size = MAX_POOL_SIZE
+    with _lock:
+        if key not in _pools:
+            _pools[key] = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=_pool_name(key), pool_size=size, **dbconfig)
+        return _pools[key]
+
+
+# Get a healthy connection from the pool of key, waiting when all are in use
+def get_connection(key, dbconfig, size=2):
+    pool = _pool(key, dbconfig, size)
+    start = time.time()
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except mysql.connector.errors.PoolError:
+            if time.time() - start > POOL_WAIT:
+                raise
+            time.sleep(0.05)
+
+    # A pooled connection may have been closed by the server meanwhile
+    try:
+        conn.ping(reconnect=True, attempts=2, delay=1)
+    except mysql.connector.Error:
+        conn.close()
+        raise
+    stats.record('connect:' + key, time.time() - start)
+    return TimedConnection(conn)
+
+
+class TimedConnection(object):
+    """Pooled connection whose cursors record how long each query takes."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.preparedcursor = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self.conn.cursor(*args, **kwargs))
+
+    # One prepared cursor per connection, reused for repeated queries
+    def prepared(self):
+        if self.preparedcursor is None:
+            self.preparedcursor = TimedCursor(self.conn.cursor(prepared=True))
+        return self.preparedcursor
+
+    # Hand the connection back to the pool
+    def close(self):
+        if self.preparedcursor is not None:
+            self.preparedcursor.close()
+            self.preparedcursor = None
+        self.conn.close()
+
+
+class TimedCursor(object):
+    """Cursor that records the time of each execute, per calling method."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        caller = sys._getframe(1).f_code.co_name
+        start = time.time()
+        try:
+            result = self.cursor.execute(operation, params, *args, **kwargs)
+        except Exception:
+            stats.record('sql:' + caller, time.time() - start, error=True)
+            raise
+        stats.record('sql:' + caller, time.time() - start)
+        return result
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        caller = sys._getframe(1).f_code.co_name
+        start = time.time()
+        try:
+            result = self.cursor.executemany(operation, seq_params, *args, **kwargs)
+        except Exception:
+            stats.record('sql:' + caller, time.time() - start, error=True)
+            raise
+        stats.record('sql:' + caller, time.time() - start)
+        return result
@@ -26,9 +26,9 @@ import time
 import sys
 import getopt
 from cloudstackops import cloudstacksql
+from cloudstackops import rowformat
 import os.path
 from random import choice
-from prettytable import PrettyTable
 
 
 # Function to handle our arguments
@@ -43,8 +43,8 @@ def handleArguments(argv):
     mysqlPasswd = ''
     global hypervisorName
     hypervisorName = ''
-    global plainDisplay
-    plainDisplay = 0
+    global outputFormat
+    outputFormat = 'table'
     global onlyNonRunning
     onlyNonRunning = 0
     global vmnameFilter
@@ -54,6 +54,7 @@ def handleArguments(argv):
     help = "Usage: ./" + os.path.basename(__file__) + ' [options] ' + \
         '\n  --mysqlserver -s <mysql hostname>\tSpecify MySQL server to ' \
         'read HA worker table from' + \
+        '\n\t\t\t\t\tuse any for all databases from config file, or a comma separated list' + \
         '\n  --mysqlpassword <passwd>\t\tSpecify password to cloud ' + \
         'MySQL user' + \
         '\n  --hostname -n <hostname>\t\tLimit search to this hypervisor ' + \
@@ -62,6 +63,7 @@ def handleArguments(argv):
         '\n  --non-running\t\t\t\tOnly show HA entries of VMs that ' + \
         'have non-running current state' + \
         '\n  --plain-display\t\t\tEnable plain display, no pretty tables' + \
+        '\n  --output <format>\t\t\ttable, plain, csv or jsonl; all but table print rows as they arrive' + \
         '\n  --debug\t\t\t\tEnable debug mode' + \
         '\n  --exec\t\t\t\tExecute for real (not needed for list* scripts)'
 
@@ -73,6 +75,7 @@ def handleArguments(argv):
             "name-filter=",
             "non-running",
             "plain-display",
+            "output=",
             "debug",
             "exec"
         ])
@@ -93,7 +96,9 @@ def handleArguments(argv):
         elif opt in ("--name-filter"):
             vmnameFilter = arg
         elif opt in ("--plain-display"):
-            plainDisplay = 1
+            outputFormat = 'plain'
+        elif opt in ("--output"):
+            outputFormat = arg
         elif opt in ("--non-running"):
             onlyNonRunning = 1
         elif opt in ("--debug"):
@@ -119,18 +124,12 @@ if DEBUG == 1:
 if DRYRUN == 1:
     print "Warning: dry-run mode is enabled, not running any commands!"
 
-# Connect MySQL
-result = s.connectMySQL(mysqlHost, mysqlPasswd)
-if result > 0:
-    print "Error: MySQL connection failed"
-    sys.exit(1)
-elif DEBUG == 1:
-    print "DEBUG: MySQL connection successful"
-    print s.conn
-
-haworkers = s.getHAWorkerData(hypervisorName)
-counter = 0
-t = PrettyTable([
+db = s.resolveDatabases(mysqlHost)
+
+# With more than one database, each row tells where it came from
+dbColumn = ["Database"] if len(db) > 1 else []
+
+out = rowformat.RowWriter(dbColumn + [
     "Domain",
     "VM",
     "Type",
@@ -140,28 +139,28 @@ t = PrettyTable([
     "Step",
     "Hypervisor",
     "Mgt server"
-])
-t.align["VM"] = "l"
+], outputFormat, sortby="VM", align={"VM": "l"})
 
-if plainDisplay == 1:
-    t.border = False
-    t.header = False
-    t.padding_width = 1
+# All databases are queried at the same time, rows are handled as they arrive
+for mysqlHost, haworker in cloudstacksql.fan_out_rows(
+        db, lambda sql: sql.getHAWorkerData(hypervisorName, stream=True), mysqlPasswd, DEBUG, DRYRUN):
+    if haworker is None:
+        sys.exit(1)
+    dbCell = [mysqlHost] if dbColumn else []
 
-for (domain,vmname, vm_type, state, created, taken, step, hypervisor, mgtname,
-        hastate) in haworkers:
+    (domain, vmname, vm_type, state, created, taken, step, hypervisor, mgtname,
+        hastate) = haworker
     if onlyNonRunning == 1 and state == "Running":
         continue
+    if vmname == None:
+        continue
     if len(vmnameFilter) > 0 and vmname.find(vmnameFilter) < 0:
         continue
-    if vmname == None:
-       continue
-    counter = counter + 1
     displayname = (vmname[:28] + '..') if len(vmname) >= 31 else vmname
     if mgtname is not None:
         mgtname = mgtname.split(".")[0]
     hvname = hypervisor.split(".")[0]
-    t.add_row([
+    out.write(dbCell + [
         domain,
         displayname,
         vm_type,
@@ -173,9 +172,7 @@ for (domain,vmname, vm_type, state, created, taken, step, hypervisor, mgtname,
         mgtname
     ])
 
-# Disconnect MySQL
-s.disconnectMySQL()
-print t.get_string(sortby="VM")
+out.close()
 
-if plainDisplay == 0:
-    print "Note: Found " + str(counter) + " HA workers."
+if not out.streaming():
+    print "Note: Found " + str(out.count) + " HA workers."
@@ -60,16 +60,19 @@ def handle_arguments(argv):
     clusterarg = ''
     global configProfileName
     configProfileName = ''
+    global stream
+    stream = 0
 
     # Usage message
     help = "Usage: " + os.path.basename(__file__) + ' [options] ' + \
         '\n  --config-profile -c <profilename>\t\tSpecify the CloudMonkey profile name to get the credentials from (or specify in ./config file) [required]' + \
         '\n  --zone -z <zonename>\t\t\t\tZone Name [required]\t' + \
         '\n  --cluster -t <clustername>\t\t\tCluster Name [optional]\t' + \
+        '\n  --stream\t\t\t\t\tPrint orphans while they arrive, instead of one table per pool [optional]' + \
         '\n  --debug\t\t\t\t\tEnable debug mode [optional]'
     try:
         opts, args = getopt.getopt(
-            argv, "hc:z:t:", ["config-profile=", "zone=", "clusterarg=", "debug"])
+            argv, "hc:z:t:", ["config-profile=", "zone=", "clusterarg=", "debug", "stream"])
 
     except getopt.GetoptError as e:
         print "Error: " + str(e)
@@ -87,6 +90,8 @@ def handle_arguments(argv):
             zone = arg
         elif opt in ("-t", "--cluster"):
             clusterarg = arg
+        elif opt in ("--stream"):
+            stream = 1
 
     # Print help if required options not provided
     if len(configProfileName) == 0 or len(zone) == 0:
@@ -162,7 +167,8 @@ for cluster in clusters:
 
             # Get list of orphaned cloudstack disks for storagepool
             print "[INFO]: Retrieving list of orphans for storage pool", storagepool.name
-            orphans = c.getDetachedVolumes(storagepool.id)
+            orphans = c.getDetachedVolumes(storagepool.id, stream=(stream == 1))
+            orphancount = 0
 
             storagepool_devicepath = storagepool.ipaddress + \
                 ":" + str(storagepool.path)
@@ -184,6 +190,7 @@ for cluster in clusters:
                              "Allocated Size (GB)", "Real Size (GB)", "Orphaned"])
 
             for orphan in orphans:
+                orphancount += 1
                 isorphaned = ''
 
                 orphan_allocated_sizeGB = (orphan.size / math.pow(1024, 3))
@@ -207,13 +214,18 @@ for cluster in clusters:
                         isorphaned = 'N'
 
                 # add a row with orphan details
-                t.add_row([orphan.domain, orphan.account, orphan.name, cluster.name, storagepool.name, orphan.path,
-                           orphan_allocated_sizeGB, orphan_real_sizeGB, isorphaned])
+                row = [orphan.domain, orphan.account, orphan.name, cluster.name, storagepool.name, orphan.path,
+                       orphan_allocated_sizeGB, orphan_real_sizeGB, isorphaned]
+                if stream == 1:
+                    print "\t".join("%s" % field for field in row)
+                else:
+                    t.add_row(row)
 
             # Print orphan table
-            print t.get_string()
+            if stream == 0:
+                print t.get_string()
             t_storagepool.add_row(
-                [cluster.name, storagepool.name, len(orphans), format(used_space, '.2f')])
+                [cluster.name, storagepool.name, orphancount, format(used_space, '.2f')])
 
 print "Storagepool Totals"
 print t_storagepool.get_string()
@@ -26,9 +26,9 @@ import time
 import sys
 import getopt
 from cloudstackops import cloudstacksql
+from cloudstackops import rowformat
 import os.path
 from random import choice
-from prettytable import PrettyTable
 
 
 # Function to handle our arguments
@@ -43,16 +43,18 @@ def handleArguments(argv):
     mysqlPasswd = ''
     global hypervisorName
     hypervisorName = ''
-    global plainDisplay
-    plainDisplay = 0
+    global outputFormat
+    outputFormat = 'table'
 
     # Usage message
     help = "Usage: ./" + os.path.basename(__file__) + ' [options] ' + \
         '\n  --mysqlserver -s <mysql hostname>\tSpecify MySQL server to ' + \
         'read HA worker table from' + \
+        '\n\t\t\t\t\tuse any for all databases from config file, or a comma separated list' + \
         '\n  --mysqlpassword <passwd>\t\tSpecify password to cloud ' \
         'MySQL user' + \
         '\n  --plain-display\t\t\tEnable plain display, no pretty tables' + \
+        '\n  --output <format>\t\t\ttable, plain, csv or jsonl; all but table print rows as they arrive' + \
         '\n  --debug\t\t\t\tEnable debug mode' + \
         '\n  --exec\t\t\t\tExecute for real (not needed for list* scripts)'
 
@@ -61,6 +63,7 @@ def handleArguments(argv):
             "mysqlserver=",
             "mysqlpassword=",
             "plain-display",
+            "output=",
             "debug",
             "exec"
         ])
@@ -77,7 +80,9 @@ def handleArguments(argv):
         elif opt in ("-p", "--mysqlpassword"):
             mysqlPasswd = arg
         elif opt in ("--plain-display"):
-            plainDisplay = 1
+            outputFormat = 'plain'
+        elif opt in ("--output"):
+            outputFormat = arg
         elif opt in ("--debug"):
             DEBUG = 1
         elif opt in ("--exec"):
@@ -101,18 +106,12 @@ if DEBUG == 1:
 if DRYRUN == 1:
     print "Warning: dry-run mode is enabled, not running any commands!"
 
-# Connect MySQL
-result = s.connectMySQL(mysqlHost, mysqlPasswd)
-if result > 0:
-    print "Error: MySQL connection failed"
-    sys.exit(1)
-elif DEBUG == 1:
-    print "DEBUG: MySQL connection successful"
-    print s.conn
-
-asyncjobs = s.getAsyncJobData()
-counter = 0
-t = PrettyTable([
+db = s.resolveDatabases(mysqlHost)
+
+# With more than one database, each row tells where it came from
+dbColumn = ["Database"] if len(db) > 1 else []
+
+out = rowformat.RowWriter(dbColumn + [
     "username",
     "account_name",
     "instance_name",
@@ -123,19 +122,18 @@ t = PrettyTable([
     "Mgt Server",
     "Job ID",
     "Related job ID"
-])
-t.align["instance_name"] = "l"
-
-if plainDisplay == 1:
-    t.border = Falsusername, account_name, instance_id, vm_state, job_cmd, \
-        job_dispatcher, created, mgtserver, jobid, related
-    t.header = False
-    t.padding_width = 1
-
-for (username, account_name, instance_id, vm_state, job_cmd, job_dispatcher,
-        created, mgtserver, jobid, related) in asyncjobs:
-    counter = counter + 1
-    t.add_row([
+], outputFormat, sortby="instance_name", align={"instance_name": "l"})
+
+# All databases are queried at the same time, rows are handled as they arrive
+for mysqlHost, asyncjob in cloudstacksql.fan_out_rows(
+        db, lambda sql: sql.getAsyncJobData(stream=True), mysqlPasswd, DEBUG, DRYRUN):
+    if asyncjob is None:
+        sys.exit(1)
+    dbCell = [mysqlHost] if dbColumn else []
+
+    (username, account_name, instance_id, vm_state, job_cmd, job_dispatcher,
+        created, mgtserver, jobid, related) = asyncjob
+    out.write(dbCell + [
         username,
         account_name,
         instance_id,
@@ -148,9 +146,7 @@ for (username, account_name, instance_id, vm_state, job_cmd, job_dispatcher,
         related
     ])
 
-# Disconnect MySQL
-s.disconnectMySQL()
-print t.get_string(sortby="instance_name")
+out.close()
 
-if plainDisplay == 0:
-    print "Note: Found " + str(counter) + " running jobs."
+if not out.streaming():
+    print "Note: Found " + str(out.count) + " running jobs."
@@ -24,7 +24,11 @@
 
 import sys
 import getopt
+import re
 from cloudstackops import cloudstackops
+from cloudstackops import inventory
+from cloudstackops import cloudstacksql
+from cloudstackops import records
 import os.path
 from prettytable import PrettyTable
 from distutils.version import LooseVersion
@@ -77,6 +81,12 @@ def handleArguments(argv):
     routerMaxVersion = '999'
     global  routerMinVersion
     routerMinVersion = '0'
+    global fromDatabase
+    fromDatabase = 0
+    global mysqlHost
+    mysqlHost = ''
+    global mysqlPasswd
+    mysqlPasswd = ''
 
 
     # Usage message
@@ -112,6 +122,12 @@ def handleArguments(argv):
         'domains (list should be comma separated, without spaces)' + \
         '\n  --non-admin-credentials\t\tLimit search to VMs of calling ' + \
         'credentials' + \
+        '\n  --from-db\t\t\t\tRead the vm, router and host data ' + \
+        'from the database instead of the API' + \
+        '\n  --mysqlserver -s <mysql hostname>\tSpecify MySQL server to ' + \
+        'read from with --from-db' + \
+        '\n  --mysqlpassword <passwd>\t\tSpecify password to cloud ' + \
+        'MySQL user' + \
         '\n  --summary\t\t\t\tDisplay only a summary, no details' + \
         '\n  --no-summary\t\t\t\tDo not display summary' + \
         '\n  --debug\t\t\t\tEnable debug mode' + \
@@ -119,7 +135,7 @@ def handleArguments(argv):
 
     try:
         opts, args = getopt.getopt(
-            argv, "hc:d:p:o:f:z:n:",
+            argv, "hc:d:p:o:f:z:n:s:",
             [
                 "config-profile=", "domainname=",
                 "projectname=", "oncluster=", "filter=",
@@ -130,7 +146,8 @@ def handleArguments(argv):
                 "only-routers-to-be-upgraded",
                 "nic-count-is-minimum",
                 "nic-count-is-maximum", "ignore-domains=",
-                "router-max-version=", "router-min-version="
+                "router-max-version=", "router-min-version=",
+                "from-db", "mysqlserver=", "mysqlpassword="
             ]
         )
     except getopt.GetoptError as e:
@@ -162,6 +179,8 @@ def handleArguments(argv):
             zonename = arg
         elif opt in ("--pod"):
             podname = arg
+        elif opt in ("-s", "--mysqlserver"):
+            mysqlHost = arg
         elif opt in ("--router-nic-count"):
             routerNicCount = arg
         elif opt in ("--debug"):
@@ -191,6 +210,10 @@ def handleArguments(argv):
             routerMinVersion = str(arg)
         elif opt in ("--router-max-version"):
             routerMaxVersion = str(arg)
+        elif opt in ("--from-db"):
+            fromDatabase = 1
+        elif opt in ("--mysqlpassword"):
+            mysqlPasswd = arg
 
     # Default to cloudmonkey default config file
     if len(configProfileName) == 0:
@@ -209,6 +232,16 @@ def handleArguments(argv):
         print help
         sys.exit()
 
+    # The database knows all vm's, not only those of the calling credentials
+    if fromDatabase == 1 and len(mysqlHost) == 0:
+        print "Error: Please specify the MySQL server to read from with --mysqlserver."
+        print help
+        sys.exit()
+    if fromDatabase == 1 and nonAdminCredentials == 1:
+        print "Error: Please specify either --from-db or --non-admin-credentials, not both."
+        print help
+        sys.exit()
+
 
 # Function to handle stdout vm data
 def printVirtualmachine(args):
@@ -230,11 +263,11 @@ def printVirtualmachine(args):
         for vm in vmdata:
             if vm.domain in ignoreDomains:
                 continue
-            # Calculate storage usage
-            storageSize = c.calculateVirtualMachineStorageUsage(
-                vm.id,
-                projectParam
-            )
+            # Calculate storage usage, the database already summed it
+            if fromDatabase == 1:
+                storageSize = vmStorageSize[vm.id]
+            else:
+                storageSize = inv.storage_size(vm.id, volumeCollection)
             storageSizeTotal = storageSizeTotal + storageSize
 
             # Memory
@@ -291,6 +324,19 @@ def printVirtualmachine(args):
                 sys.stdout.flush()
     return storageSizeTotal, memoryTotal, coresTotal, counter
 
+
+# Router version as the API shows it, the database has the full template
+# version like 'Cloudstack Release 4.11.2 Mon Jan 1 2018'
+def routerVersion(templateversion):
+    if templateversion is None:
+        return "UNKNOWN"
+    if re.match(r'^[0-9]+(\.[0-9]+)*$', templateversion):
+        return templateversion
+    tokens = templateversion.split(" ")
+    if len(tokens) >= 3 and re.match(r'^[0-9]+(\.[0-9]+)*$', tokens[2]):
+        return tokens[2]
+    return "0"
+
 # Parse arguments
 if __name__ == "__main__":
     handleArguments(sys.argv[1:])
@@ -388,6 +434,12 @@ if nonAdminCredentials == 1:
     ])
     t.align["VM"] = "l"
 
+    # Volumes of the calling credentials, to calculate storage usage
+    inv = inventory.Inventory(c, DEBUG)
+    volumeCollection = 'volumes'
+    if not inv.load(volumeCollection, listAll='false'):
+        sys.exit(1)
+
     vmdata = c.deprecatedListVirtualMachines({'listAll': 'false'})
     printVirtualmachine({'vmdata': vmdata, 'ignoreDomains': ignoreDomains})
     print
@@ -398,6 +450,14 @@ clusters = {}
 # ClusterID available
 if 'fromClusterID' in locals():
     clusters[fromClusterID] = fromCluster
+
+    # Scope the inventory to the zone of the cluster, not the whole cloud
+    result = c.listClusters({'clusterid': fromClusterID})
+    if result == 1 or not result:
+        print "Error: cluster " + fromCluster + " does not exist."
+        sys.exit(1)
+    if len(zoneID) == 0:
+        zoneID = result[0].zoneid
 else:
     if len(podname) > 0:
         result = c.listClusters({'podid': podID})
@@ -412,6 +472,130 @@ if DEBUG == 1:
     print clusters
     print "Debug: display mode = " + display
 
+# Load the inventory once, instead of asking the API per host, vm and router
+if projectParam == "true":
+    vmCollection = 'projectvirtualmachines'
+    routerCollection = 'projectrouters'
+    volumeCollection = 'projectvolumes'
+else:
+    vmCollection = 'virtualmachines'
+    routerCollection = 'routers'
+    volumeCollection = 'volumes'
+
+print "Note: Loading inventory.."
+inv = inventory.Inventory(c, DEBUG)
+
+# The same hosts, vm's and routers from a few aggregate queries, storage
+# and nic counts come summed up by the database
+if fromDatabase == 1:
+    s = cloudstacksql.CloudStackSQL(DEBUG, DRYRUN)
+    if s.connectMySQL(mysqlHost, mysqlPasswd) > 0:
+        print "Error: MySQL connection failed"
+        sys.exit(1)
+
+    hostData = s.getReportHostData(clusters.keys())
+    if hostData == 1:
+        print "Error: Could not read hosts from the database"
+        sys.exit(1)
+    inv.fill('hosts', [records.HostRecord(
+        id=hostid, name=name, clusterid=clusterid, clustername=clustername,
+        state=state, resourcestate=resourcestate, memorytotal=memorytotal
+    ) for (hostid, name, clusterid, clustername, state, resourcestate,
+           memorytotal) in hostData])
+
+    vmStorageSize = {}
+    if onlyDisplayRouters < 1:
+        vmData = s.getReportVirtualMachineData(
+            clusters.keys(), domainnameID, filterKeyword, projectParam == "true")
+        if vmData == 1:
+            print "Error: Could not read vm's from the database"
+            sys.exit(1)
+        vms = []
+        for (vmid, name, displayname, instancename, hostid, hostname, account,
+             domain, domainid, project, projectid, memory, cpunumber,
+             templatedisplaytext, storageSize, created) in vmData:
+            vms.append(records.VirtualMachineRecord(
+                id=vmid, name=name, displayname=displayname,
+                instancename=instancename, hostid=hostid, hostname=hostname,
+                account=account, domain=domain, domainid=domainid,
+                project=project, projectid=projectid, memory=int(memory),
+                cpunumber=int(cpunumber),
+                templatedisplaytext=templatedisplaytext or '',
+                laststartversion='-', created=created))
+            vmStorageSize[vmid] = int(storageSize)
+        inv.fill(vmCollection, vms)
+
+    routerNics = {}
+    if displayRouters > 0:
+        routerData = s.getReportRouterData(
+            clusters.keys(), domainnameID, projectParam == "true")
+        if routerData == 1:
+            print "Error: Could not read routers from the database"
+            sys.exit(1)
+        routers = []
+        offerings = {}
+        networks = {}
+        vpcs = {}
+        for (routerid, name, hostid, hostname, account, domain, domainid,
+             project, projectid, templateversion, isredundantrouter,
+             redundantstate, vpcid, vpcname, networkid, networkname,
+             offeringid, memory, cpunumber, niccount, minversion,
+             created) in routerData:
+            version = routerVersion(templateversion)
+            if templateversion is None:
+                requiresupgrade = True
+            elif minversion is not None:
+                requiresupgrade = LooseVersion(version) < \
+                    LooseVersion(minversion)
+            else:
+                requiresupgrade = False
+            routers.append(records.RouterRecord(
+                id=routerid, name=name, hostid=hostid, hostname=hostname,
+                account=account, domain=domain, domainid=domainid,
+                project=project, projectid=projectid, version=version,
+                isredundantrouter=bool(isredundantrouter),
+                redundantstate=redundantstate, vpcid=vpcid,
+                guestnetworkid=networkid, serviceofferingid=offeringid,
+                requiresupgrade=requiresupgrade, laststartversion='-',
+                created=created))
+            routerNics[routerid] = int(niccount)
+            offerings[offeringid] = records.ServiceOfferingRecord(
+                id=offeringid, memory=int(memory), cpunumber=int(cpunumber))
+            if vpcid is not None:
+                vpcs[vpcid] = records.NetworkRecord(id=vpcid, name=vpcname)
+            if networkid is not None:
+                networks[networkid] = records.NetworkRecord(
+                    id=networkid, name=networkname)
+        inv.fill(routerCollection, routers)
+        inv.fill('systemofferings', offerings.values())
+        inv.fill('networks', networks.values())
+        inv.fill('vpcs', vpcs.values())
+
+    s.disconnectMySQL()
+else:
+    if 'fromClusterID' in locals():
+        scope = {'clusterid': fromClusterID}
+    else:
+        scope = {'zoneid': zoneID, 'podid': podID}
+    if not inv.load('hosts', **scope):
+        sys.exit(1)
+
+    scope = {'zoneid': zoneID, 'podid': podID}
+    if onlyDisplayRouters < 1:
+        if not inv.load(vmCollection, domainid=domainnameID,
+                        keyword=filterKeyword, **scope):
+            sys.exit(1)
+        if not inv.load(volumeCollection, domainid=domainnameID,
+                        zoneid=zoneID):
+            sys.exit(1)
+    if displayRouters > 0:
+        if not inv.load(routerCollection, domainid=domainnameID, **scope):
+            sys.exit(1)
+        for name in ('systemofferings', 'networks', 'projectnetworks', 'vpcs',
+                     'projectvpcs'):
+            if not inv.load(name, zoneid=zoneID):
+                sys.exit(1)
+
 # Empty line
 print
 
@@ -426,9 +610,9 @@ grandHostMemoryTotal = 0
 for clusterid, clustername in clusters.items():
 
     # Get hosts that belong to fromCluster
-    fromClusterHostsData = c.getHostsFromCluster(clusterid)
+    fromClusterHostsData = inv.hosts_in_cluster(clusterid, 'Enabled', 'Up')
 
-    if fromClusterHostsData == 1 or fromClusterHostsData is None:
+    if not fromClusterHostsData:
         print
         sys.stdout.write("\033[F")
         print "No (enabled) hosts found on cluster " + str(clustername)
@@ -486,13 +670,7 @@ for clusterid, clustername in clusters.items():
         # Get all vms of the domainid running on this host
         if onlyDisplayRouters < 1:
 
-            vmdata = c.deprecatedListVirtualMachines({
-                'hostid': fromHostData.id,
-                'domainid': domainnameID,
-                'isProjectVm': projectParam,
-                'projectid': projectnameID,
-                'filterKeyword': filterKeyword
-            })
+            vmdata = inv.find(vmCollection, 'hostid', fromHostData.id)
 
             storageSizeTotal, memoryTotal, coresTotal, \
                 counter = printVirtualmachine({
@@ -514,14 +692,7 @@ for clusterid, clustername in clusters.items():
         if displayRouters < 1:
             continue
 
-        vmdata = c.getRouterData({
-            'hostid': fromHostData.id,
-            'domainid': domainnameID,
-            'isProjectVm': projectParam
-        })
-
-        if vmdata is None:
-            continue
+        vmdata = inv.find(routerCollection, 'hostid', fromHostData.id)
 
         for vm in vmdata:
             if vm.domain in ignoreDomains:
@@ -538,7 +709,10 @@ for clusterid, clustername in clusters.items():
                 continue
 
             # Amount of NICs
-            niccount = len(vm.nic)
+            if fromDatabase == 1:
+                niccount = routerNics[vm.id]
+            else:
+                niccount = len(vm.nic)
 
             if routerNicCountIsMinimum == 1:
                 # Minimum this number of nics
@@ -560,26 +734,25 @@ for clusterid, clustername in clusters.items():
                 continue
 
             # Service Offering (to find allocated RAM)
-            serviceOfferingData = c.listServiceOfferings({
-                'serviceofferingid': vm.serviceofferingid,
-                'issystem': 'true'
-            })
+            serviceOffering = inv.get('systemofferings', vm.serviceofferingid)
 
-            if serviceOfferingData is not None:
+            if serviceOffering is not None:
                 # Memory
-                memory = round(float(serviceOfferingData[0].memory) / 1024, 3)
+                memory = round(float(serviceOffering.memory) / 1024, 3)
                 memoryTotal = memoryTotal + memory
-                if serviceOfferingData[0].memory >= 1024:
-                    memoryDisplay = str(serviceOfferingData[0].memory / 1024) \
+                if serviceOffering.memory >= 1024:
+                    memoryDisplay = str(serviceOffering.memory / 1024) \
                         + " GB"
                 else:
-                    memoryDisplay = str(serviceOfferingData[0].memory) + " MB"
+                    memoryDisplay = str(serviceOffering.memory) + " MB"
 
                 # Cores
-                hostCoresTotal += serviceOfferingData[0].cpunumber
+                hostCoresTotal += serviceOffering.cpunumber
+                cpunumber = serviceOffering.cpunumber
 
             else:
                 memoryDisplay = "Unknown"
+                cpunumber = "Unknown"
 
             # Tabs
             counter = counter + 1
@@ -593,15 +766,15 @@ for clusterid, clustername in clusters.items():
 
             # Name of the network / VPC
             if vm.vpcid is not None:
-                networkResult = c.listVPCs(vm.vpcid)
+                networkResult = inv.get(('vpcs', 'projectvpcs'), vm.vpcid)
             else:
-                networkResult = c.listNetworks(vm.guestnetworkid)
+                networkResult = inv.get(('networks', 'projectnetworks'),
+                                        vm.guestnetworkid)
 
             if networkResult is not None:
-                displayname = networkResult[0].name
-                displayname = (networkResult[0].name[:18] + '..') \
-                    if len(networkResult[0].name) >= 21 \
-                    else networkResult[0].name
+                displayname = (networkResult.name[:18] + '..') \
+                    if len(networkResult.name) >= 21 \
+                    else networkResult.name
             else:
                 displayname = (vm.name[:18] + '..') \
                     if len(vm.name) >= 21 else vm.name
@@ -616,71 +789,37 @@ for clusterid, clustername in clusters.items():
             # Display project and non-project different
             if display != "onlySummary":
                 if vm.project:
-                    try:
-                        t.add_row([
-                            displayname,
-                            '-',
-                            '-',
-                            vmniccount,
-                            vmversion,
-                            memoryDisplay,
-                            serviceOfferingData[0].cpunumber,
-                            vm.name,
-                            vm.hostname,
-                            vm.domain,
-                            "Proj: " + " " + vm.project,
-                            vm.created,
-                            vm.laststartversion
-                        ])
-                    except:
-                        t.add_row([
-                            displayname,
-                            '-',
-                            '-',
-                            vmniccount,
-                            vmversion,
-                            memoryDisplay,
-                            'Unknown',
-                            vm.name,
-                            vm.hostname,
-                            vm.domain,
-                            "Proj: " + " " + vm.project,
-                            vm.created,
-                            vm.laststartversion
-                        ])
+                    t.add_row([
+                        displayname,
+                        '-',
+                        '-',
+                        vmniccount,
+                        vmversion,
+                        memoryDisplay,
+                        cpunumber,
+                        vm.name,
+                        vm.hostname,
+                        vm.domain,
+                        "Proj: " + " " + vm.project,
+                        vm.created,
+                        vm.laststartversion
+                    ])
                 else:
-                    try:
-                        t.add_row([
-                            displayname,
-                            '-',
-                            '-',
-                            vmniccount,
-                            vmversion,
-                            memoryDisplay,
-                            serviceOfferingData[0].cpunumber,
-                            vm.name,
-                            vm.hostname,
-                            vm.domain,
-                            vm.account,
-                            vm.createda,
-                            vm.laststartversion
-                        ])
-                    except:
-                        t.add_row([
-                            displayname,
-                            '-',
-                            '-',
-                            vmniccount,
-                            vmversion,
-                            memoryDisplay,
-                            'Unknown',
-                            vm.name,
-                            vm.hostname,
-                            vm.domain,
-                            vm.account,
-                            vm.created,
-                            vm.laststartversion
-                        ])
+                    t.add_row([
+                        displayname,
+                        '-',
+                        '-',
+                        vmniccount,
+                        vmversion,
+                        memoryDisplay,
+                        cpunumber,
+                        vm.name,
+                        vm.hostname,
+                        vm.domain,
+                        vm.account,
+                        vm.created,
+                        vm.laststartversion
+                    ])
 
                 sys.stdout.write(".")
                 sys.stdout.flush()
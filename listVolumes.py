@@ -26,6 +26,7 @@ import time
 import sys
 import getopt
 from cloudstackops import cloudstackops
+from cloudstackops import inventory
 import os.path
 from random import choice
 from prettytable import PrettyTable
@@ -46,19 +47,22 @@ def handleArguments(argv):
     storagepoolname = ''
     global isProjectVm
     isProjectVm = 0
+    global stream
+    stream = 0
 
     # Usage message
     help = "Usage: ./" + os.path.basename(__file__) + ' [options] ' + \
         '\n  --config-profile -c <profilename>\t\tSpecify the CloudMonkey profile name to get the credentials from (or specify in ./config file)' + \
         '\n  --storagepoolname -p <storage pool name>\tList volumes from this storage pool' + \
         '\n  --is-projectvm\t\t\t\tLimit search to volumes that belong to a project' + \
+        '\n  --stream\t\t\t\t\tPrint volumes while they arrive, instead of one table at the end' + \
         '\n  --debug\t\t\t\t\tEnable debug mode' + \
         '\n  --exec\t\t\t\t\tExecute for real (not needed for list* scripts)'
 
     try:
         opts, args = getopt.getopt(
             argv, "hc:p:", [
-                "config-profile=", "storagepoolname=", "debug", "exec", "is-projectvm"])
+                "config-profile=", "storagepoolname=", "debug", "exec", "is-projectvm", "stream"])
     except getopt.GetoptError as e:
         print "Error: " + str(e)
         print help
@@ -82,6 +86,8 @@ def handleArguments(argv):
             DRYRUN = 0
         elif opt in ("--is-projectvm"):
             isProjectVm = 1
+        elif opt in ("--stream"):
+            stream = 1
 
     # Default to cloudmonkey default config file
     if len(configProfileName) == 0:
@@ -129,8 +135,23 @@ if len(storagepoolname) > 1:
     storagepoolID = c.checkCloudStackName(
         {'csname': storagepoolname, 'csApiCall': 'listStoragePools'})
 
+# Load the vm's once, instead of looking up each attached volume's vm
+inv = inventory.Inventory(c, DEBUG)
+if projectParam == "true":
+    vmCollection = 'projectvirtualmachines'
+else:
+    vmCollection = 'virtualmachines'
+
+# Only the vm's in the zone of the pool can have volumes on it
+poolData = c.getStoragePoolData(storagepoolID)
+if poolData == 1 or not poolData:
+    print "Error: storage pool " + storagepoolname + " does not exist."
+    sys.exit(1)
+if not inv.load(vmCollection, zoneid=poolData[0].zoneid):
+    sys.exit(1)
+
 # Get volumes from storage pool
-volumesData = c.listVolumes(storagepoolID, projectParam)
+volumesData = c.listVolumes(storagepoolID, projectParam, stream=(stream == 1))
 
 # Empty line
 print
@@ -150,15 +171,21 @@ for volume in volumesData:
             volume.vmname[:20] +
             '..') if len(
             volume.vmname) >= 22 else volume.vmname
-        virtualmachineData = c.getVirtualmachineData(volume.virtualmachineid)
-        vm = virtualmachineData[0]
-        instancename = vm.instancename
+        vm = inv.get(vmCollection, volume.virtualmachineid)
+        instancename = vm.instancename if vm is not None else "Unknown"
 
     # Table
-    t.add_row([vmname, volume.name, instancename, volume.path + ".vhd"])
+    row = [vmname, volume.name, instancename, volume.path + ".vhd"]
+    if stream == 1:
+        print "\t".join("%s" % field for field in row)
+    else:
+        t.add_row(row)
 
 # Display table
-print t
+if stream == 1:
+    print "Note: Found %s volumes" % counter
+else:
+    print t
 
 if DEBUG == 1:
     print "Note: We're done!"
@@ -141,8 +141,10 @@ def liveMigrateHVtoPOD(DEBUG=0, DRYRUN=1, fromHV='', toCluster='', configProfile
         print host
 
     hostid = host['host'][0]['id']
-    listVMs = c.listVirtualMachines({'hostid': hostid, 'listall': 'true'})
-    listProjectVMs = c.listVirtualMachines({'hostid': hostid, 'listall': 'true', 'projectid': -1})
+    api = c.getConcurrentClient()
+    listVMs, listProjectVMs = api.gather([
+        api.listVirtualMachines(hostid=hostid, listall='true'),
+        api.listVirtualMachines(hostid=hostid, listall='true', projectid=-1)], raise_errors=True)
     
     VMs = {}
     VMs['count'] = listVMs.get('count',0) + listProjectVMs.get('count',0)
@@ -165,8 +167,9 @@ def liveMigrateHVtoPOD(DEBUG=0, DRYRUN=1, fromHV='', toCluster='', configProfile
         vmCount += 1
 
     result = True
-    listVMs = c.listVirtualMachines({'hostid': hostid, 'listall': 'true'})
-    listProjectVMs = c.listVirtualMachines({'hostid': hostid, 'listall': 'true', 'projectid': -1})
+    listVMs, listProjectVMs = api.gather([
+        api.listVirtualMachines(hostid=hostid, listall='true'),
+        api.listVirtualMachines(hostid=hostid, listall='true', projectid=-1)], raise_errors=True)
     
     vmCount = listVMs.get('count',0) + listProjectVMs.get('count',0)
     if DEBUG == 1:
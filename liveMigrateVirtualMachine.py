@@ -212,6 +212,9 @@ def liveMigrateVirtualMachine(c=None, DEBUG=0, DRYRUN=1, vmname='', toCluster=''
         print("DEBUG: MySQL connection successful")
         print(s.conn)
 
+    # Slow down our API calls when the management server queues up jobs
+    c.usePendingJobsFromSQL(configProfileName)
+
 
     # Init KVM class
     k = kvm.Kvm(ssh_user=getpass.getuser())
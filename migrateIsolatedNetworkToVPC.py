@@ -8,6 +8,14 @@ from datetime import datetime
 
 from cloudstackops import cloudstackops
 from cloudstackops import cloudstacksql
+from cloudstackops import sqlpool
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except Exception as e:
+    print "Error: Please install futures library to migrate networks concurrently: %s" % e
+    print "       pip install futures"
+    sys.exit(1)
 
 
 # Function to handle our arguments
@@ -36,6 +44,10 @@ def handleArguments(argv):
     mysqlHost = ''
     global mysqlPasswd
     mysqlPasswd = ''
+    global batchFile
+    batchFile = ''
+    global restartThreads
+    restartThreads = 4
 
     # Usage message
     help = "Usage: ./" + os.path.basename(__file__) + ' [options] ' + \
@@ -43,6 +55,9 @@ def handleArguments(argv):
            '(or specify in ./config file)' + \
            '\n  --network-name -n <network-name>\tMigrate Isolated network with this name.' \
            '\n  --uuid -u <uuid>\t\t\tThe UUID of the network. When provided, the network name will be ignored.' \
+           '\n  --batch -b <file>\t\t\tMigrate the networks in this file, one name or UUID per line' \
+           '\n  --threads -t <nr>\t\t\tMigrate this many networks of a batch at the same time (default 5)' \
+           '\n  --restart-threads <nr>\t\tRestart this many VPCs of a batch at the same time (default 4)' \
            '\n  --vpc-offering -v <vpc-offering-name>\tThe name of the VPC offering.' \
            '\n  --network-offering -o <network-offering-name>\tThe name of the VPC tier network offering.' \
            '\n  --mysqlserver -s <mysql hostname>\tSpecify MySQL server config section name' + \
@@ -54,7 +69,7 @@ def handleArguments(argv):
         opts, args = getopt.getopt(
             argv, "hc:n:u:v:o:t:p:s:b:", [
                 "config-profile=", "network-name=", "uuid=", "vpc-offering=", "network-offering=", "mysqlserver=",
-                "mysqlpassword=", "debug", "exec", "force"
+                "mysqlpassword=", "batch=", "threads=", "restart-threads=", "debug", "exec", "force"
             ])
     except getopt.GetoptError as e:
         print "Error: " + str(e)
@@ -78,6 +93,12 @@ def handleArguments(argv):
             mysqlHost = arg
         elif opt in ("-p", "--mysqlpassword"):
             mysqlPasswd = arg
+        elif opt in ("-b", "--batch"):
+            batchFile = arg
+        elif opt in ("-t", "--threads"):
+            threads = int(arg)
+        elif opt in ("--restart-threads"):
+            restartThreads = int(arg)
         elif opt in ("--debug"):
             DEBUG = 1
         elif opt in ("--exec"):
@@ -90,10 +111,11 @@ def handleArguments(argv):
         configProfileName = "config"
 
     # We need at least these vars
-    if (len(networkname) == 0 and len(networkuuid) == 0) or len(mysqlHost) == 0 or len(vpcofferingname) == 0 or \
-                    len(networkofferingname) == 0:
+    if (len(networkname) == 0 and len(networkuuid) == 0 and len(batchFile) == 0) or len(mysqlHost) == 0 or \
+                    len(vpcofferingname) == 0 or len(networkofferingname) == 0:
         print "networkname: " + networkname
         print "networkuuid: " + networkuuid
+        print "batch: " + batchFile
         print "mysqlHost: " + mysqlHost
         print "vpcofferingname: " + vpcofferingname
         print "networkofferingname: " + networkofferingname
@@ -101,12 +123,162 @@ def handleArguments(argv):
         print help
         sys.exit()
 
+    # Every thread needs its own connection, next to the one of the script
+    if threads < 1 or threads >= sqlpool.MAX_POOL_SIZE:
+        print "Error: --threads should be between 1 and %s" % (sqlpool.MAX_POOL_SIZE - 1)
+        sys.exit(1)
+
 
 def exit_script(message):
     print "Fatal Error: %s" % message
     sys.exit(1)
 
 
+# Names or UUIDs of the networks in the batch file, skipping empty lines and comments
+def read_batch_file(filename):
+    try:
+        with open(filename) as f:
+            lines = [line.strip() for line in f]
+    except IOError as e:
+        exit_script("Cannot read batch file '%s': %s" % (filename, e))
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+# Look up all networks of the batch with one paginated list call
+def resolve_networks(entries):
+    networks = c.listAll('listNetworks', {'listAll': 'true'})
+    if networks == 1:
+        exit_script("Could not list the networks")
+
+    by_id = {}
+    by_name = {}
+    for network in networks or []:
+        by_id[network.id] = network
+        by_name.setdefault(network.name, []).append(network)
+
+    resolved = {}
+    for entry in entries:
+        if entry in by_id:
+            network = by_id[entry]
+        elif len(by_name.get(entry, [])) == 1:
+            network = by_name[entry][0]
+        else:
+            print "Error: Network '%s' not found or not unique, skipping it" % entry
+            continue
+        resolved[network.id] = network
+    return resolved.values()
+
+
+# Convert one isolated network to a VPC tier, with sql connected
+# Returns 'migrated', 'skipped', 'dryrun' or 'failed' and the UUID of the new VPC
+def migrate_network(sql, network, vpc_offering_db_id, vpc_tier_offering_db_id, to_slack):
+    isolated_network_db_id = sql.get_network_db_id(network.id)
+    if not isolated_network_db_id:
+        message = "Network '%s' not found in the database" % network.name
+        c.print_message(message=message, message_type="Error", to_slack=to_slack)
+        return 'failed', None
+
+    # Pre-flight checks
+    # 1. Check if network is actually already an VPC tier
+    if sql.check_if_network_is_vpc_tier(isolated_network_db_id):
+        message = "Network '%s' is already part of a VPC. Nothing to do!" % network.name
+        c.print_message(message=message, message_type="Note", to_slack=to_slack)
+        return 'skipped', None
+
+    if DRYRUN:
+        message = "Would have migrated classic network '%s' to a VPC!" % network.name
+        c.print_message(message=message, message_type="Note", to_slack=to_slack)
+        return 'dryrun', None
+
+    message = "Starting migration of classic network '%s' to VPC" % network.name
+    c.print_message(message=message, message_type="Note", to_slack=to_slack)
+
+    # Migration
+    # All steps run in one transaction, so a failure leaves the network as it was
+    try:
+        with sql.transaction():
+            # 1. Create the new VPC
+            vpc_db_id = sql.create_vpc(isolated_network_db_id, vpc_offering_db_id)
+
+            # 2. Fill the vpc service map
+            sql.fill_vpc_service_map(vpc_db_id)
+
+            # 3. Update network service map
+            sql.migrate_ntwk_service_map_from_isolated_network_to_vpc(isolated_network_db_id)
+
+            # 4. Create network acl from isolated network egress for vpc
+            egress_network_acl_db_id = sql.create_network_acl_for_vpc(vpc_db_id, network.id + '-fwrules')
+
+            # TODO Think about default deny / default allow
+            # 5. Fill egress network acl
+            sql.convert_isolated_network_egress_rules_to_network_acl(isolated_network_db_id, egress_network_acl_db_id)
+
+            # 6. Update network to become a VPC tier
+            sql.update_isolated_network_to_be_a_vpc_tier(vpc_db_id, egress_network_acl_db_id,
+                                                         vpc_tier_offering_db_id, isolated_network_db_id)
+
+            # 7. Migrate public ips to vpc
+            # Fill the acl with the ingress rules of all public ips, then move the ips
+            sql.convert_isolated_network_ingress_rules_to_network_acl(isolated_network_db_id,
+                                                                      egress_network_acl_db_id)
+            sql.migrate_public_ips_from_isolated_network_to_vpc(vpc_db_id, 2, isolated_network_db_id)
+
+            # HACK Update Egress cidrs to be allow all
+            sql.fix_egress_cidr_allow_all(egress_network_acl_db_id)
+
+            # 8. Migrate routers
+            sql.migrate_routers_from_isolated_network_to_vpc(vpc_db_id, isolated_network_db_id)
+    except Exception as e:
+        message = "Migration of classic network '%s' to VPC failed, all changes were rolled back: %s"\
+                  % (network.name, e)
+        c.print_message(message=message, message_type="Error", to_slack=to_slack)
+        return 'failed', None
+
+    return 'migrated', sql.get_vpc_uuid(vpc_db_id)
+
+
+# Convert one network of a batch on its own pooled connection
+def migrate_batch_network(network, vpc_offering_db_id, vpc_tier_offering_db_id):
+    sql = cloudstacksql.CloudStackSQL(DEBUG, DRYRUN)
+    if sql.connectMySQL(mysqlHost, mysqlPasswd, poolsize=poolsize) > 0:
+        print "Error: MySQL connection failed for network '%s'" % network.name
+        return 'failed', None
+    try:
+        return migrate_network(sql, network, vpc_offering_db_id, vpc_tier_offering_db_id, False)
+    except Exception as e:
+        print "Error: Migration of network '%s' failed: %s" % (network.name, e)
+        return 'failed', None
+    finally:
+        sql.disconnectMySQL()
+
+
+# Convert all networks of the batch, at most threads at the same time, then
+# restart the new VPCs with clean up
+def migrate_batch(networks, vpc_offering_db_id, vpc_tier_offering_db_id):
+    executor = ThreadPoolExecutor(max_workers=max(1, threads))
+    futures = dict((executor.submit(migrate_batch_network, network, vpc_offering_db_id, vpc_tier_offering_db_id),
+                    network) for network in networks)
+    results = {}
+    vpcs = {}
+    for future in as_completed(futures):
+        network = futures[future]
+        status, vpc_uuid = future.result()
+        results.setdefault(status, []).append(network.name)
+        if vpc_uuid:
+            vpcs[vpc_uuid] = network.name
+    executor.shutdown()
+
+    if vpcs:
+        print "Note: Restarting %s VPCs with clean up, %s at a time" % (len(vpcs), restartThreads)
+        for vpc_uuid, restarted in c.restartVPCs(vpcs.keys(), workers=restartThreads).iteritems():
+            if not restarted:
+                print "Error: Restart of the VPC of network '%s' (%s) failed, investigate manually!" % (
+                    vpcs[vpc_uuid], vpc_uuid)
+                results.setdefault('restart failed', []).append(vpcs[vpc_uuid])
+
+    return results
+
+
 # Parse arguments
 if __name__ == "__main__":
     handleArguments(sys.argv[1:])
@@ -130,7 +302,11 @@ c.slack_custom_title = "Migration details"
 s = cloudstacksql.CloudStackSQL(DEBUG, DRYRUN)
 
 # Connect MySQL
-result = s.connectMySQL(mysqlHost, mysqlPasswd)
+# A batch needs a pooled connection per thread next to this one
+poolsize = None
+if batchFile:
+    poolsize = threads + 1
+result = s.connectMySQL(mysqlHost, mysqlPasswd, poolsize=poolsize)
 if result > 0:
     message = "MySQL connection failed"
     c.print_message(message=message, message_type="Error", to_slack=True)
@@ -145,6 +321,39 @@ c.configProfileName = configProfileName
 # Init the CloudStack API
 c.initCloudStackAPI()
 
+if DEBUG == 1:
+    print "API address: " + c.apiurl
+    print "ApiKey: " + c.apikey
+    print "SecretKey: " + c.secretkey
+    print "Username: " + c.username
+    print "Password: " + c.password
+
+to_slack = True
+if DRYRUN == 1:
+    to_slack = False
+
+# Gather VPC / network offering, once for all networks
+vpc_offering_db_id = s.get_vpc_offering_id(vpcofferingname)
+vpc_tier_offering_db_id = s.get_network_offering_id(networkofferingname)
+
+if batchFile:
+    networks = resolve_networks(read_batch_file(batchFile))
+    message = "Starting migration of %s classic networks to VPC, %s at a time" % (len(networks), threads)
+    c.slack_custom_value = "%s networks" % len(networks)
+    c.print_message(message=message, message_type="Note", to_slack=to_slack)
+
+    results = migrate_batch(networks, vpc_offering_db_id, vpc_tier_offering_db_id)
+
+    message = "Batch migration of classic networks to VPC done: " + ", ".join(
+        "%s %s" % (len(names), status) for status, names in sorted(results.iteritems()))
+    failed = results.get('failed', []) + results.get('restart failed', [])
+    if failed:
+        message += "\nFailed: " + ", ".join(sorted(failed))
+    c.print_message(message=message, message_type="Error" if failed else "Note", to_slack=to_slack)
+    if failed:
+        sys.exit(1)
+    sys.exit(0)
+
 if not networkuuid:
     networkuuid = c.checkCloudStackName({
         'csname': networkname,
@@ -153,13 +362,6 @@ if not networkuuid:
         'isProjectVm': False
     })
 
-if DEBUG == 1:
-    print "API address: " + c.apiurl
-    print "ApiKey: " + c.apikey
-    print "SecretKey: " + c.secretkey
-    print "Username: " + c.username
-    print "Password: " + c.password
-
 # Check cloudstack IDs
 if DEBUG == 1:
     print "Debug: Checking CloudStack IDs of provided input.."
@@ -167,7 +369,6 @@ if DEBUG == 1:
 
 # Get Isolated network details
 isolated_network = c.listNetworks(networkuuid)[0]
-isolated_network_db_id = s.get_network_db_id(networkuuid)
 
 # Pretty Slack messages
 c.instance_name = isolated_network.name
@@ -176,68 +377,12 @@ c.slack_custom_value = isolated_network.name
 c.zone_name = isolated_network.zonename
 c.task = "Converting legacy network to VPC tier"
 
-to_slack = True
-if DRYRUN == 1:
-    to_slack = False
-
-# Pre-flight checks
-# 1. Check if network is actually already an VPC tier
-if s.check_if_network_is_vpc_tier(isolated_network_db_id):
-    message = "Network '%s' is already part of a VPC. Nothing to do!" % isolated_network.name
-    c.print_message(message=message, message_type="Note", to_slack=to_slack)
+status, vpc_uuid = migrate_network(s, isolated_network, vpc_offering_db_id, vpc_tier_offering_db_id, to_slack)
+if status in ('skipped', 'failed'):
     exit(1)
-
-# 2 Gather VPC / network offering
-vpc_offering_db_id = s.get_vpc_offering_id(vpcofferingname)
-vpc_tier_offering_db_id = s.get_network_offering_id(networkofferingname)
-
-if DRYRUN:
-    message = "Would have migrated classic network '%s' to a VPC!" % isolated_network.name
-    c.print_message(message=message, message_type="Note", to_slack=to_slack)
+if status == 'dryrun':
     exit(0)
 
-message = "Starting migration of classic network '%s' to VPC" % isolated_network.name
-c.print_message(message=message, message_type="Note", to_slack=to_slack)
-
-# Migration
-# 1. Create the new VPC
-vpc_db_id = s.create_vpc(isolated_network_db_id, vpc_offering_db_id)
-
-# 2. Fill the vpc service map
-s.fill_vpc_service_map(vpc_db_id)
-
-# 3. Update network service map
-s.migrate_ntwk_service_map_from_isolated_network_to_vpc(isolated_network_db_id)
-
-# 4. Create network acl from isolated network egress for vpc
-egress_network_acl_db_id = s.create_network_acl_for_vpc(vpc_db_id, networkuuid + '-fwrules')
-
-# TODO Think about default deny / default allow
-# 5. Fill egress network acl
-s.convert_isolated_network_egress_rules_to_network_acl(isolated_network_db_id, egress_network_acl_db_id)
-
-# 6. Update network to become a VPC tier
-s.update_isolated_network_to_be_a_vpc_tier(vpc_db_id, egress_network_acl_db_id, vpc_tier_offering_db_id,
-                                           isolated_network_db_id)
-
-# 7. Migrate public ips to vpc
-ipadresses = s.get_all_ipaddresses_from_network(isolated_network_db_id)
-for ipaddress in ipadresses:
-    # Create ACL for ingress rules
-    # ingress_acl_db_id = s.create_network_acl_for_vpc(vpc_db_id, ipaddress[1] + '-ingress_rules')
-
-    # Fill ingress ACL with rules
-    s.convert_isolated_network_public_ip_rules_to_network_acl(ipaddress[0], egress_network_acl_db_id)
-
-    # Migrate public ip to vpc
-    s.migrate_public_ip_from_isolated_network_to_vpc(vpc_db_id, 2, ipaddress[0])
-
-# HACK Update Egress cidrs to be allow all
-s.fix_egress_cidr_allow_all(egress_network_acl_db_id)
-
-# 8. Migrate routers
-s.migrate_routers_from_isolated_network_to_vpc(vpc_db_id, isolated_network_db_id)
-
-message = "Migration of classic network '%s' to VPC succeeded! Restart+Cleanup needed to complete migration!"\
-          % isolated_network.name
+message = "Migration of classic network '%s' to VPC %s succeeded! Restart+Cleanup needed to complete migration!"\
+          % (isolated_network.name, vpc_uuid)
 c.print_message(message=message, message_type="Note", to_slack=to_slack)
@@ -216,6 +216,9 @@ elif DEBUG == 1:
     print "DEBUG: MySQL connection successful"
     print s.conn
 
+# Volumes and revert data decide what we do, only read them from an up to date replica
+s.checkReplica()
+
 # make credentials file known to our class
 c.configProfileName = configProfileName
 
@@ -560,6 +563,9 @@ elif DEBUG == 1:
     print "DEBUG: MySQL connection successful"
     print s.conn
 
+# Volumes and revert data decide what we do, only read them from an up to date replica
+s.checkReplica()
+
 # Revery Query
 revert_sql = s.generate_revert_query(vm.instancename)
 
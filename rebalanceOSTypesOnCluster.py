@@ -186,8 +186,10 @@ for family in osFamilies:
       print "# Memory of this host: " + str(fromHostData.memorytotal)
 
     # Get all vm's: project and non project
-    vmdata_non_project = c.deprecatedListVirtualMachines({'hostid': fromHostData.id, 'isProjectVm': 'false' })
-    vmdata_project = c.deprecatedListVirtualMachines({'hostid': fromHostData.id, 'isProjectVm': 'true' })
+    # We only look at the os type and memory of each vm
+    vmargs = {'hostid': fromHostData.id, 'details': 'servoff', 'fields': ('id', 'name', 'memory', 'guestosid')}
+    vmdata_non_project = c.deprecatedListVirtualMachines(dict(vmargs, isProjectVm='false'))
+    vmdata_project = c.deprecatedListVirtualMachines(dict(vmargs, isProjectVm='true'))
 
     if vmdata_project is None and vmdata_non_project is None:
       print "Note: No vm's of type " + family  + " found on " + fromHostData.name
@@ -25,10 +25,11 @@
 import time
 import sys
 import getopt
+import socket
 from cloudstackops import cloudstacksql
+from cloudstackops import rowformat
 import os.path
 from random import choice
-from prettytable import PrettyTable
 
 # Function to handle our arguments
 
@@ -44,14 +45,22 @@ def handleArguments(argv):
     mysqlPasswd = ''
     global ipaddress
     ipaddress = ''
+    global matchMode
+    matchMode = ''
+    global outputFormat
+    outputFormat = 'table'
 
     # Usage message
     help = "Usage: ./" + os.path.basename(__file__) + ' [options] ' + \
         '\n  --ip-address -i <ip address>\t\tSearch for this ip address ' + \
-        '(partial is allowed)' + \
+        '(the start of an address is allowed)' + \
+        '\n  --match <mode>\t\t\texact, prefix or substring (slow, scans all nics); ' + \
+        'default is exact for a full address and prefix otherwise,' + \
+        '\n\t\t\t\t\tuse substring to find the middle or end of an address like 2.3' + \
+        '\n  --output <format>\t\t\ttable, plain, csv or jsonl; all but table print rows as they arrive' + \
         '\n  --mysqlserver -s <mysql hostname>\tSpecify MySQL server ' + \
         'to read HA worker table from' + \
-        '\n\t\t\t\t\tuse any for all databases from config file' + \
+        '\n\t\t\t\t\tuse any for all databases from config file, or a comma separated list' + \
         '\n  --mysqlpassword <passwd>\t\tSpecify password to cloud ' + \
         'MySQL user' + \
         '\n  --debug\t\t\t\tEnable debug mode' + \
@@ -63,6 +72,8 @@ def handleArguments(argv):
                 "mysqlserver=",
                 "ip-address=",
                 "mysqlpassword=",
+                "match=",
+                "output=",
                 "debug",
                 "exec"])
     except getopt.GetoptError as e:
@@ -79,6 +90,10 @@ def handleArguments(argv):
             mysqlPasswd = arg
         elif opt in ("-i", "--ip-address"):
             ipaddress = arg
+        elif opt in ("--match"):
+            matchMode = arg
+        elif opt in ("--output"):
+            outputFormat = arg
         elif opt in ("--debug"):
             DEBUG = 1
         elif opt in ("--exec"):
@@ -89,6 +104,26 @@ def handleArguments(argv):
         print help
         sys.exit()
 
+    # A full address can use the index with an exact match
+    if len(matchMode) == 0:
+        matchMode = 'exact' if isFullIpAddress(ipaddress) else 'prefix'
+    if matchMode not in cloudstacksql.MATCH_MODES:
+        print "Error: Unknown match mode '" + matchMode + "'"
+        print help
+        sys.exit(2)
+
+
+# Is this a complete ipv4 address, not a subnet like 10.1.2.?
+def isFullIpAddress(address):
+    octets = address.split('.')
+    if len(octets) != 4 or '' in octets:
+        return False
+    try:
+        socket.inet_aton(address)
+    except socket.error:
+        return False
+    return True
+
 # Parse arguments
 if __name__ == "__main__":
     handleArguments(sys.argv[1:])
@@ -102,155 +137,139 @@ if DEBUG == 1:
 if DRYRUN == 1:
     print "# Warning: dry-run mode is enabled, not running any commands!"
 
-db = []
-dbHost = ''
-if mysqlHost == 'any':
-    db = s.getAllDB()
+db = s.resolveDatabases(mysqlHost)
+if outputFormat == 'table':
+    print "\nConnecting to the following DB's: " + str(db) + "\n"
+
+
+# Look the address up in one database, trying vm nics and VPCs first, then
+# bridged networks and then infra nics
+# Yields which of the three answered and each of its rows as they arrive
+def lookup(sql):
+    for kind, query, what in (
+            ('nic', sql.getIpAddressData, "public and vm nic ip addresses"),
+            ('bridge', sql.getIpAddressDataBridge, "bridged network ip addresses"),
+            ('infra', sql.getIpAddressDataInfra, "infra nic ip addresses")):
+        start = time.time()
+        found = False
+        for row in query(ipaddress, matchMode, stream=True):
+            found = True
+            yield kind, row
+        if outputFormat == 'table':
+            print "Note: Searched " + what + " in " + sql.mysqlhost + " (" + matchMode + " match) in %.3fs" % (
+                time.time() - start)
+        if found:
+            return
+
+
+# With more than one database, each row tells where it came from
+dbColumn = ["Database"] if len(db) > 1 else []
+
+# Columns of the nic, bridge and infra results
+COLUMNS = {
+    'nic': ["VM name", "Network Name", "Mac Address", "Ipv4", "Netmask", "Mode", "State", "Created"],
+    'bridge': ["VM name", "State", "Ipv4", "Network Name", "Created"],
+    'infra': ["VM name", "VM Type", "Ipv4", "Instance ID", "State"],
+}
+
+# Streaming formats share stdout, so they print one set of columns with the
+# kind of each row in front
+STREAM_COLUMNS = ["Kind", "VM name", "VM Type", "Instance ID", "Network Name", "Mac Address", "Ipv4",
+                  "Netmask", "Mode", "State", "Created"]
+
+if outputFormat == 'table':
+    writers = {
+        'nic': rowformat.RowWriter(dbColumn + COLUMNS['nic'], outputFormat,
+                                   align={"VM name": "l", "Network Name": "l"}),
+        'bridge': rowformat.RowWriter(dbColumn + COLUMNS['bridge'], outputFormat,
+                                      align={"VM name": "l", "Network Name": "l"}),
+        'infra': rowformat.RowWriter(dbColumn + COLUMNS['infra'], outputFormat,
+                                     align={"VM name": "l", "Ipv4": "l"}),
+    }
 else:
-    db.append(mysqlHost)
-print "\nConnecting to the following DB's: " + str(db) + "\n"
-
-for mysqlHost in db:
-    # Connect MySQL
-    result = s.connectMySQL(mysqlHost, mysqlPasswd)
-    if result > 0:
-        print "Error: MySQL connection failed"
+    out = rowformat.RowWriter(dbColumn + STREAM_COLUMNS, outputFormat)
+
+
+# Write one result, fields maps column names to values
+def writeRow(kind, dbCell, fields):
+    if outputFormat == 'table':
+        writers[kind].write(dbCell + [fields.get(column) for column in COLUMNS[kind]])
+    else:
+        out.write(dbCell + [kind] + [fields.get(column) for column in STREAM_COLUMNS[1:]])
+
+
+dbHosts = []
+
+# All databases are queried at the same time, we handle their rows as they arrive
+for mysqlHost, result in cloudstacksql.fan_out_rows(db, lookup, mysqlPasswd, DEBUG, DRYRUN):
+    if result is None:
         sys.exit(1)
-    elif DEBUG == 1:
-        print "DEBUG: MySQL connection successful"
-        print s.conn
-
-    ipaddresses = s.getIpAddressData(ipaddress)
-    counter = 0
-    networknamenone = 0
-    t = PrettyTable(["VM name",
-                     "Network Name",
-                     "Mac Address",
-                     "Ipv4",
-                     "Netmask",
-                     "Mode",
-                     "State",
-                     "Created"])
-    t.align["VM name"] = "l"
-    t.align["Network Name"] = "l"
-    
-    for (
-            networkname,
-            mac_address,
-            ip4_address,
-            netmask,
-            broadcast_uri,
-            mode,
-            state,
-            created,
-            vmname) in ipaddresses:
-        counter = counter + 1
-        dbHost = mysqlHost
-        if networkname is None:
-          networknamenone =  networknamenone + 1
-    
+    kind, ipaddressdata = result
+    dbCell = [mysqlHost] if dbColumn else []
+    if mysqlHost not in dbHosts:
+        dbHosts.append(mysqlHost)
+
+    if kind == 'nic':
+        (networkname,
+         mac_address,
+         ip4_address,
+         netmask,
+         broadcast_uri,
+         mode,
+         state,
+         created,
+         vmname) = ipaddressdata
+
+        vmname = (vmname[:22] + '..') if len(vmname) > 24 else vmname
+        networkname = (
+            networkname[:22] + '..') if networkname is not None \
+            and len(networkname) > 24 else networkname
+        writeRow(kind, dbCell, {"VM name": vmname,
+                                "Network Name": networkname,
+                                "Mac Address": mac_address,
+                                "Ipv4": ip4_address,
+                                "Netmask": netmask,
+                                "Mode": mode,
+                                "State": state,
+                                "Created": created})
+
+    elif kind == 'bridge':
+        (vmname,
+         ip4_address,
+         created,
+         networkname,
+         state) = ipaddressdata
+
         vmname = (vmname[:22] + '..') if len(vmname) > 24 else vmname
         networkname = (
             networkname[:22] + '..') if networkname is not None \
             and len(networkname) > 24 else networkname
-        t.add_row([vmname,
-                   networkname,
-                   mac_address,
-                   ip4_address,
-                   netmask,
-                   mode,
-                   state,
-                   created])
-    
-    # When not found a vm name in the VPC query check the bridged networks
-    if counter == networknamenone:
-      countera = 0
-      ipaddresses = s.getIpAddressDataBridge(ipaddress)
-      r = PrettyTable(["VM name",
-                       "State",
-                       "Ipv4",
-                       "Network Name",
-                       "Created"])
-      r.align["VM name"] = "l"
-      r.align["Network Name"] = "l"
-    
-      r = PrettyTable(["VM name",
-                       "State",
-                       "Ipv4",
-                       "Network Name",
-                       "Created"])
-      r.align["VM name"] = "l"
-      r.align["Network Name"] = "l"
-    
-      for (
-              vmname,
-              ip4_address,
-              created,
-              state,
-              networkname) in ipaddresses:
-          countera = countera + 1 
-          dbHost = mysqlHost
-    
-          vmname = (vmname[:22] + '..') if len(vmname) > 24 else vmname
-          networkname = (
-              networkname[:22] + '..') if networkname is not None \
-              and len(networkname) > 24 else networkname
-          r.add_row([vmname,
-                     networkname,
-                     ip4_address,
-                     state,
-                     created])
-
-    # When not found a vm name in the VPC query and the bridged networks check the infra
-    if counter == networknamenone and countera == networknamenone:
-      counterb = 0
-      ipaddresses = s.getIpAddressDataInfra(ipaddress)
-      u = PrettyTable(["VM name",
-                       "VM Type",
-                       "Ipv4",
-                       "Instance ID",
-                       "State"])
-      u.align["VM name"] = "l"
-      u.align["VM Type"] = "l"
-
-      u = PrettyTable(["VM name",
-                       "VM Type",
-                       "Ipv4",
-                       "Instance ID",
-                       "State"])
-      u.align["VM name"] = "l"
-      u.align["Ipv4"] = "l"
-
-      for (
-              vmname,
-              vmtype,
-              ip4_address,
-              instance_id,
-              state) in ipaddresses:
-          counterb = counterb + 1
-          dbHost = mysqlHost
-
-          vmname = (vmname[:22] + '..') if len(vmname) > 24 else vmname
-          u.add_row([vmname,
-                     vmtype,
-                     ip4_address,
-                     instance_id,
-                     state])
-
-    # Disconnect MySQL
-    s.disconnectMySQL()
-   
-    if counter <> 0:
-        print "Results: " + dbHost + "\n"
-        print t
-        print "Note: Found " + str(counter) + " results."
-    elif countera <> 0:
-        print "Results: " + dbHost + "\n"
-        print r
-        print "Note: Found " + str(countera) + " results."
-    elif counterb <> 0:
-        print "Results:"  + dbHost + "\n"
-        print u
-        print "Note: Found " + str(counterb) + " results."
+        writeRow(kind, dbCell, {"VM name": vmname,
+                                "Network Name": networkname,
+                                "Ipv4": ip4_address,
+                                "State": state,
+                                "Created": created})
+
+    else:
+        (vmname,
+         vmtype,
+         ip4_address,
+         instance_id,
+         state) = ipaddressdata
 
+        vmname = (vmname[:22] + '..') if len(vmname) > 24 else vmname
+        writeRow(kind, dbCell, {"VM name": vmname,
+                                "VM Type": vmtype,
+                                "Ipv4": ip4_address,
+                                "Instance ID": instance_id,
+                                "State": state})
 
+# Streaming formats printed their rows already
+if outputFormat == 'table':
+    dbHost = ", ".join(dbHosts)
+    for kind in ('nic', 'bridge', 'infra'):
+        table = writers[kind]
+        if table.count <> 0:
+            print "Results: " + dbHost + "\n"
+            table.close()
+            print "Note: Found " + str(table.count) + " results."
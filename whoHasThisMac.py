@@ -25,10 +25,14 @@
 import time
 import sys
 import getopt
+import re
 from cloudstackops import cloudstacksql
+from cloudstackops import rowformat
 import os.path
 from random import choice
-from prettytable import PrettyTable
+
+# A complete mac address, not the start of one like 06:a1:b2:c3:d4:
+FULL_MAC_ADDRESS = re.compile(r'^[0-9a-fA-F]{2}(:[0-9a-fA-F]{2}){5}$')
 
 # Function to handle our arguments
 
@@ -44,13 +48,22 @@ def handleArguments(argv):
     mysqlPasswd = ''
     global macaddress
     macaddress = ''
+    global matchMode
+    matchMode = ''
+    global outputFormat
+    outputFormat = 'table'
 
     # Usage message
     help = "Usage: ./" + os.path.basename(__file__) + ' [options] ' + \
         '\n  --mac-address -m <mac address>\t\tSearch for this mac address ' + \
-        '(partial is allowed)' + \
+        '(the start of an address is allowed)' + \
+        '\n  --match <mode>\t\t\t\texact, prefix or substring (slow, scans all nics); ' + \
+        'default is exact for a full address and prefix otherwise,' + \
+        '\n\t\t\t\t\t\tuse substring to find the middle or end of an address like c3:d4' + \
+        '\n  --output <format>\t\t\t\ttable, plain, csv or jsonl; all but table print rows as they arrive' + \
         '\n  --mysqlserver -s <mysql hostname>\t\tSpecify MySQL server ' + \
         'to read HA worker table from' + \
+        '\n\t\t\t\t\t\tuse any for all databases from config file, or a comma separated list' + \
         '\n  --mysqlpassword <passwd>\t\t\tSpecify password to cloud ' + \
         'MySQL user' + \
         '\n  --debug\t\t\t\t\tEnable debug mode' + \
@@ -62,6 +75,8 @@ def handleArguments(argv):
                 "mysqlserver=",
                 "mac-address=",
                 "mysqlpassword=",
+                "match=",
+                "output=",
                 "debug",
                 "exec"])
     except getopt.GetoptError as e:
@@ -78,6 +93,10 @@ def handleArguments(argv):
             mysqlPasswd = arg
         elif opt in ("-m", "--mac-address"):
             macaddress = arg
+        elif opt in ("--match"):
+            matchMode = arg
+        elif opt in ("--output"):
+            outputFormat = arg
         elif opt in ("--debug"):
             DEBUG = 1
         elif opt in ("--exec"):
@@ -88,6 +107,17 @@ def handleArguments(argv):
         print help
         sys.exit()
 
+    # Mac addresses are stored with colons
+    macaddress = macaddress.replace('-', ':')
+
+    # A full address can use the index with an exact match
+    if len(matchMode) == 0:
+        matchMode = 'exact' if FULL_MAC_ADDRESS.match(macaddress) else 'prefix'
+    if matchMode not in cloudstacksql.MATCH_MODES:
+        print "Error: Unknown match mode '" + matchMode + "'"
+        print help
+        sys.exit(2)
+
 # Parse arguments
 if __name__ == "__main__":
     handleArguments(sys.argv[1:])
@@ -101,55 +131,62 @@ if DEBUG == 1:
 if DRYRUN == 1:
     print "# Warning: dry-run mode is enabled, not running any commands!"
 
-# Connect MySQL
-result = s.connectMySQL(mysqlHost, mysqlPasswd)
-if result > 0:
-    print "Error: MySQL connection failed"
-    sys.exit(1)
-elif DEBUG == 1:
-    print "DEBUG: MySQL connection successful"
-    print s.conn
-
-macaddresses = s.getMacAddressData(macaddress)
-counter = 0
-t = PrettyTable(["VM name",
-                 "Network Name",
-                 "Mac Address",
-                 "Ipv4",
-                 "Netmask",
-                 "Mode",
-                 "State",
-                 "Created"])
-t.align["VM name"] = "l"
-t.align["Network Name"] = "l"
-
-for (
-        networkname,
-        mac_address,
-        ip4_address,
-        netmask,
-        broadcast_uri,
-        mode,
-        state,
-        created,
-        vmname) in macaddresses:
-    counter = counter + 1
+db = s.resolveDatabases(mysqlHost)
+
+
+# Look the mac address up in one database, yielding rows as they arrive
+def lookup(sql):
+    start = time.time()
+    for row in sql.getMacAddressData(macaddress, matchMode, stream=True):
+        yield row
+    if not out.streaming():
+        print "Note: Searched mac addresses in " + sql.mysqlhost + " (" + matchMode + " match) in %.3fs" % (
+            time.time() - start)
+
+
+# With more than one database, each row tells where it came from
+dbColumn = ["Database"] if len(db) > 1 else []
+
+out = rowformat.RowWriter(dbColumn + ["VM name",
+                                      "Network Name",
+                                      "Mac Address",
+                                      "Ipv4",
+                                      "Netmask",
+                                      "Mode",
+                                      "State",
+                                      "Created"],
+                          outputFormat, align={"VM name": "l", "Network Name": "l"})
+
+# All databases are queried at the same time, we handle their rows as they arrive
+for mysqlHost, macaddressdata in cloudstacksql.fan_out_rows(db, lookup, mysqlPasswd, DEBUG, DRYRUN):
+    if macaddressdata is None:
+        sys.exit(1)
+    dbCell = [mysqlHost] if dbColumn else []
+
+    (networkname,
+     mac_address,
+     ip4_address,
+     netmask,
+     broadcast_uri,
+     mode,
+     state,
+     created,
+     vmname) = macaddressdata
 
     vmname = (vmname[:22] + '..') if len(vmname) > 24 else vmname
     networkname = (
         networkname[:22] + '..') if networkname is not None \
         and len(networkname) > 24 else networkname
-    t.add_row([vmname,
-               networkname,
-               mac_address,
-               ip4_address,
-               netmask,
-               mode,
-               state,
-               created])
-
-# Disconnect MySQL
-s.disconnectMySQL()
-
-print t
-print "Note: Found " + str(counter) + " results."
+    out.write(dbCell + [vmname,
+                        networkname,
+                        mac_address,
+                        ip4_address,
+                        netmask,
+                        mode,
+                        state,
+                        created])
+
+out.close()
+
+if not out.streaming():
+    print "Note: Found " + str(out.count) + " results."